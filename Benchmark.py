@@ -0,0 +1,388 @@
+"""
+Benchmarks for MoodleMeld.
+
+    python Benchmark.py initials --copies 300
+    python Benchmark.py suite --students 50 400 --pages 4 20 --output before.json
+    python Benchmark.py compare before.json after.json
+
+The suite generates synthetic Moodle downloads and times each meld/unmeld
+stage in a fresh process, so the peak memory recorded is that stage's own.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pypdf
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject, StreamObject
+
+from Meld import (
+    meld, scan_download, index_submissions, merge_pdfs, scale_pdf_to_width, annotate_pdf, meld_single_pass, meld_parallel,
+    MELDED_FILE_NAME, KEY_FILE_NAME, TARGET_WIDTH,
+)
+from Meldlogging import JobStatus, peak_rss_mb
+from Unmeld import unmeld, read_key_file, write_student_pdf, student_output_path, annotate, UNMELDED_FOLDER_NAME
+
+# ================================================================
+# Constants
+# ================================================================
+SAMPLE_DATA = Path(__file__).parent / "Sample data"
+LAYOUTS = ("name_id", "id_name")     # Name_ID_assignsubmission, ID - Name - ...
+CONTENTS = ("vector", "scanned")
+PAGE_SIZES = [(595, 842), (612, 792), (842, 595)]  # A4, US Letter, A4 landscape
+PDF_VARIANTS = 3                     # distinct PDFs per cohort, reused round-robin
+STAGES = (
+    "index", "merge_pdfs", "scale_pdf_to_width", "annotate_pdf", "single_pass", "parallel_meld",
+    "unmeld", "unmeld_pdfwriter",
+)
+SLOWER_WARNING_RATIO = 1.2
+
+FIRST_NAMES = ["Ada", "Alan", "Emmy", "Grace", "Isaac", "Katherine", "Niels", "Rosalind", "Srinivasa", "Sophie"]
+LAST_NAMES = ["Lovelace", "Turing", "Noether", "Hopper", "Newton", "Johnson", "Bohr", "Franklin", "Ramanujan", "Germain"]
+
+
+# ================================================================
+# Cohort Builders
+# ================================================================
+def copy_sample_cohort(dest: Path, copies: int) -> Path:
+    """
+    Build a Moodle-style download with `copies` students by repeating the
+    folders in Sample data under new names and IDs. Returns the download folder.
+    """
+    download = dest / "download"
+    download.mkdir(parents=True)
+    samples = sorted(p for p in SAMPLE_DATA.iterdir() if p.is_dir())
+
+    for n in range(copies):
+        source = samples[n % len(samples)]
+        name = source.name.split("_")[0]
+        target = download / f"{name}_{100000 + n}_assignsubmission"
+        target.mkdir()
+        for pdf in source.glob("*.pdf"):
+            shutil.copy(pdf, target / pdf.name)
+
+    return download
+
+
+def student_folder_name(layout: str, name: str, student_id: int) -> str:
+    """Folder name as Moodle writes it, in either of the layouts extract_name_id reads."""
+    if layout == "name_id":
+        return f"{name}_{student_id}_assignsubmission_file_"
+    return f"{student_id} - {name} - Coursework submission"
+
+
+def text_page_contents(rng: random.Random, height: float) -> bytes:
+    """A page of typed answers: Helvetica lines plus a few ruled boxes."""
+    lines = [b"BT /F1 11 Tf 14 TL", f"50 {height - 60:.0f} Td".encode()]
+    for _ in range(int((height - 100) // 14)):
+        words = " ".join(rng.choice(LAST_NAMES).lower() for _ in range(rng.randint(6, 12)))
+        lines.append(f"({words}) Tj T*".encode())
+    lines.append(b"ET")
+    for _ in range(3):
+        lines.append(f"{rng.randint(40, 300)} {rng.randint(40, int(height) - 200)} 200 120 re S".encode())
+    return b"\n".join(lines)
+
+
+def scan_image_data(rng: random.Random, width: int, height: int) -> bytes:
+    """Greyscale rows that are mostly paper-white with noisy 'ink', roughly as compressible as a scan."""
+    white = b"\xff" * width
+    rows = [rng.randbytes(width) if rng.random() < 0.3 else white for _ in range(height)]
+    return zlib.compress(b"".join(rows))
+
+
+def synthetic_pdf(pages: int, content: str, seed: int, scan_dpi: int = 72) -> bytes:
+    """
+    A submission of `pages` pages in assorted paper sizes. Vector pages hold
+    text; scanned pages are one full-page greyscale image XObject each.
+    """
+    rng = random.Random(seed)
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+
+    for _ in range(pages):
+        width, height = rng.choice(PAGE_SIZES)
+        page = writer.add_blank_page(width, height)
+        stream = DecodedStreamObject()
+
+        if content == "scanned":
+            pixels_w, pixels_h = width * scan_dpi // 72, height * scan_dpi // 72
+            image = StreamObject()
+            image._data = scan_image_data(rng, pixels_w, pixels_h)
+            image.update({
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Image"),
+                NameObject("/Width"): NumberObject(pixels_w),
+                NameObject("/Height"): NumberObject(pixels_h),
+                NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+                NameObject("/BitsPerComponent"): NumberObject(8),
+                NameObject("/Filter"): NameObject("/FlateDecode"),
+            })
+            resources = {NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): writer._add_object(image)})}
+            stream.set_data(f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode())
+        else:
+            resources = {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+            stream.set_data(text_page_contents(rng, height))
+
+        page[NameObject("/Resources")] = DictionaryObject(resources)
+        page.replace_contents(stream.flate_encode())
+
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def synthetic_cohort(
+    dest: Path,
+    students: int,
+    pages: int,
+    content: str = "vector",
+    files: int = 1,
+    layout: str = "name_id",
+    scan_dpi: int = 72,
+) -> Path:
+    """
+    Build a synthetic Moodle download of `students` folders, each holding
+    `files` PDFs of `pages` pages. Returns the download folder.
+    """
+    download = dest / "download"
+    download.mkdir(parents=True)
+    variants = [synthetic_pdf(pages, content, seed, scan_dpi) for seed in range(PDF_VARIANTS)]
+    names = itertools.cycle(itertools.product(LAST_NAMES, FIRST_NAMES))
+
+    for n in range(students):
+        last, first = next(names)
+        folder = download / student_folder_name(layout, f"{last} {first}", 200000 + n)
+        folder.mkdir()
+        for f in range(files):
+            (folder / f"answers_{f + 1}.pdf").write_bytes(variants[(n + f) % len(variants)])
+
+    return download
+
+
+# ================================================================
+# Benchmarks
+# ================================================================
+def bench_unmeld_initials(copies: int = 200, initials: str = "MKR") -> Dict[str, float]:
+    """
+    Compare writing initials inside the split writer (one write per file)
+    with the older write-then-annotate path (write, re-read, rewrite).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        download = copy_sample_cohort(tmp, copies)
+        meld(str(download), False)
+
+        rows = read_key_file(tmp / KEY_FILE_NAME)
+        results = {}
+
+        # Each path gets a fresh reader so neither benefits from objects the other parsed
+        out = tmp / UNMELDED_FOLDER_NAME / "single_write"
+        start = time.perf_counter()
+        reader = PdfReader(str(tmp / MELDED_FILE_NAME))
+        for row in rows:
+            write_student_pdf(reader, row, out, initials)
+        results["single_write_s"] = time.perf_counter() - start
+
+        out = tmp / UNMELDED_FOLDER_NAME / "write_then_annotate"
+        start = time.perf_counter()
+        reader = PdfReader(str(tmp / MELDED_FILE_NAME))
+        for row in rows:
+            write_student_pdf(reader, row, out, "")
+            annotate(student_output_path(out, row[1], row[2]), initials)
+        results["write_then_annotate_s"] = time.perf_counter() - start
+
+    print(f"Unmeld of {len(rows)} files with initials:")
+    print(f"   • written once:          {results['single_write_s']:.2f} s")
+    print(f"   • write then annotate:   {results['write_then_annotate_s']:.2f} s")
+    return results
+
+
+class QuietStatus(JobStatus):
+    """Status sink that drops log lines, so printing is not part of the timings."""
+
+    def put(self, message: str) -> None:
+        pass
+
+
+def run_stage(stage: str, download: Path, show_names: bool = True) -> Dict[str, Optional[float]]:
+    """
+    Time one stage on an existing download, reading whatever the previous
+    stages left on disk. Run in a fresh process so peak memory is its own.
+    Indexing is redone (untimed) for the stages that need the index.
+    """
+    status = QuietStatus()
+    parent = download.parent
+    melded_pdf, key_file = parent / MELDED_FILE_NAME, parent / KEY_FILE_NAME
+    students = scan_download(download, status)
+
+    index = None
+    if stage in ("merge_pdfs", "annotate_pdf", "single_pass"):
+        index = index_submissions(students, status)
+
+    start = time.perf_counter()
+    if stage == "index":
+        index_submissions(students, status)
+    elif stage == "merge_pdfs":
+        merge_pdfs(parent, key_file, index, status)
+    elif stage == "scale_pdf_to_width":
+        scale_pdf_to_width(melded_pdf, TARGET_WIDTH, status)
+    elif stage == "annotate_pdf":
+        annotate_pdf(melded_pdf, index, show_names, status)
+    elif stage == "single_pass":
+        meld_single_pass(parent, key_file, index, show_names, TARGET_WIDTH, status)
+    elif stage == "parallel_meld":
+        meld_parallel(parent, key_file, students, None, show_names, os.cpu_count() or 1, TARGET_WIDTH, status)
+    elif stage == "unmeld":
+        unmeld(str(melded_pdf), initials="MKR", status_widget=status)
+    elif stage == "unmeld_pdfwriter":
+        unmeld(str(melded_pdf), initials="MKR", status_widget=status, zero_copy=False)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    return {"seconds": round(time.perf_counter() - start, 4), "peak_rss_mb": _round(peak_rss_mb())}
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 1)
+
+
+def bench_case(case: Dict[str, Any], scan_dpi: int = 72) -> Dict[str, Any]:
+    """Generate one cohort and time every stage on it in order."""
+    with tempfile.TemporaryDirectory() as tmp:
+        download = synthetic_cohort(Path(tmp), scan_dpi=scan_dpi, **case)
+        input_bytes = sum(f.stat().st_size for f in download.rglob("*.pdf"))
+
+        stages = {}
+        context = multiprocessing.get_context("spawn")  # nothing inherited from this process's heap
+        for stage in STAGES:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                stages[stage] = pool.submit(run_stage, stage, download).result()
+        output_bytes = (Path(tmp) / MELDED_FILE_NAME).stat().st_size
+
+    return {
+        "case": case,
+        "input_mb": round(input_bytes / 1024**2, 2),
+        "output_mb": round(output_bytes / 1024**2, 2),
+        "stages": stages,
+    }
+
+
+def case_key(case: Dict[str, Any]) -> str:
+    return "{students} students x {files} file(s) x {pages} pp, {content}, {layout}".format(**case)
+
+
+def environment() -> Dict[str, Optional[str]]:
+    """What the results were measured on, so runs can be told apart later."""
+    try:
+        revision = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).parent, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "pypdf": pypdf.__version__,
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def bench_suite(
+    students: List[int],
+    pages: List[int],
+    contents: List[str],
+    files: List[int],
+    layouts: List[str],
+    scan_dpi: int = 72,
+    output: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """Run every combination of the given cohort parameters and optionally save JSON results."""
+    results = {"environment": environment(), "scan_dpi": scan_dpi, "cases": []}
+
+    for n, p, c, f, l in itertools.product(students, pages, contents, files, layouts):
+        case = {"students": n, "pages": p, "content": c, "files": f, "layout": l}
+        result = bench_case(case, scan_dpi)
+        results["cases"].append(result)
+
+        print(f"{case_key(case)} ({result['input_mb']} MB in, {result['output_mb']} MB out):")
+        for stage, timing in result["stages"].items():
+            print(f"   • {stage:<20} {timing['seconds']:8.2f} s   peak {timing['peak_rss_mb']} MB")
+
+    if output:
+        Path(output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Results written to {output}")
+    return results
+
+
+def compare_results(before: Path, after: Path) -> int:
+    """Print stage-by-stage time and memory ratios for cases present in both runs. Returns slowdowns found."""
+    old = {case_key(r["case"]): r for r in json.loads(Path(before).read_text(encoding="utf-8"))["cases"]}
+    new = {case_key(r["case"]): r for r in json.loads(Path(after).read_text(encoding="utf-8"))["cases"]}
+
+    slower = 0
+    for key in (k for k in new if k in old):
+        print(key)
+        for stage, timing in new[key]["stages"].items():
+            previous = old[key]["stages"].get(stage)
+            if not previous or not previous["seconds"]:
+                continue
+            ratio = timing["seconds"] / previous["seconds"]
+            memory = ""
+            if timing["peak_rss_mb"] and previous["peak_rss_mb"]:
+                memory = f"   memory x{timing['peak_rss_mb'] / previous['peak_rss_mb']:.2f}"
+            flag = "  ⚠️ slower" if ratio > SLOWER_WARNING_RATIO else ""
+            slower += bool(flag)
+            print(f"   • {stage:<20} {previous['seconds']:8.2f} s -> {timing['seconds']:8.2f} s  (x{ratio:.2f}){memory}{flag}")
+    return slower
+
+
+# ================================================================
+# Command line
+# ================================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MoodleMeld benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    initials_parser = commands.add_parser("initials", help="unmeld with initials: in-writer vs write-then-annotate")
+    initials_parser.add_argument("--copies", type=int, default=200, help="students in the scaled-up Sample data cohort")
+
+    suite_parser = commands.add_parser("suite", help="time each meld/unmeld stage on synthetic cohorts")
+    suite_parser.add_argument("--students", type=int, nargs="+", default=[20], help="cohort sizes")
+    suite_parser.add_argument("--pages", type=int, nargs="+", default=[4], help="pages per submission PDF")
+    suite_parser.add_argument("--content", nargs="+", choices=CONTENTS, default=list(CONTENTS))
+    suite_parser.add_argument("--files", type=int, nargs="+", default=[1, 2], help="PDFs per student folder")
+    suite_parser.add_argument("--layout", nargs="+", choices=LAYOUTS, default=list(LAYOUTS))
+    suite_parser.add_argument("--scan-dpi", type=int, default=72, help="resolution of scanned pages")
+    suite_parser.add_argument("--output", type=Path, help="write results as JSON")
+
+    compare_parser = commands.add_parser("compare", help="compare two saved suite results")
+    compare_parser.add_argument("before", type=Path)
+    compare_parser.add_argument("after", type=Path)
+
+    args = parser.parse_args()
+    if args.command == "initials":
+        bench_unmeld_initials(args.copies)
+    elif args.command == "suite":
+        bench_suite(args.students, args.pages, args.content, args.files, args.layout, args.scan_dpi, args.output)
+    else:
+        sys.exit(1 if compare_results(args.before, args.after) else 0)
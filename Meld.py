@@ -1,28 +1,52 @@
 import os
 import csv
+import gc
+import heapq
+import json
 import re
-from pathlib import Path
-from typing import List, Tuple, Optional, Callable
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from io import BytesIO
+from itertools import groupby
+from pathlib import Path, PurePath, PurePosixPath
+from typing import Any, Collection, Dict, List, Tuple, Optional, Callable, Iterator, Sequence
 
-import tkinter as tk
-from tkinter import messagebox as mb
-from pypdf import PdfWriter, PdfReader
+from pypdf import PdfWriter, PdfReader, PageObject
 from pypdf.annotations import FreeText
 from pypdf.generic import RectangleObject
 
-from Meldlogging import log
+from Meldcache import PageCache, content_hash
+from Meldimages import ImageConverter, can_convert_images, image_page_count, image_to_pdf, is_image
+from Meldjournal import Journal, QuarantinedPdf, failure_reason, write_quarantine_file, MELD_JOURNAL_NAME, QUARANTINE_FILE_NAME
+from Meldoptimise import PdfOptimiser, format_bytes
+from Meldwriter import Bookmark, IncrementalAppender, StreamingPdfWriter, can_linearize, linearize_pdf
+from Meldlogging import (
+    log, report_progress, check_cancelled, peak_rss_mb, current_rss_mb, format_mb, StatusSink, MessageList
+)
+from Meldtrace import Tracer, span, tracing, current_tracer, RUN
 
 # ================================================================
 # Constants
 # ================================================================
 KEY_FILE_NAME = "key_file.csv"
 MELDED_FILE_NAME = "melded_PDF.pdf"
+SHARD_FOLDER_NAME = "Shard"  # shards go in "Shard 1", "Shard 2", ... next to the download
+
+TARGET_WIDTH = 595  # A4 width in points
 
 EXPECTED_NUM_FILES = range(1, 10)
 
 WARNING_FILE_SIZE_MB = 10
 WARNING_ANNOTATION_COUNT = 5
 
+SCAN_THREADS = 8             # folders listed at once (helps most on network drives)
+
+DEFAULT_CHUNK_SIZE = 25      # students per chunk in a chunked meld
+SOURCE_MEMORY_FACTOR = 4     # rough memory per byte of source PDF while it is parsed and scaled
+
 
 # ================================================================
 # Filename / Student Info Parsing
@@ -52,90 +76,519 @@ def extract_name_id(text: str) -> Tuple[Optional[str], Optional[int]]:
 # ================================================================
 # Directory Validation
 # ================================================================
+@dataclass
+class ScannedFolder:
+    """What one directory listing of a student folder found."""
+    path: Path
+    pdfs: List[Path] = field(default_factory=list)  # sorted; images too, if they can be converted (see is_submission)
+    pdf_bytes: int = 0
+    num_files: int = 0
+    has_subdirs: bool = False
+
+
+def is_submission(name: str) -> bool:
+    """Whether a file in a student folder is melded: a PDF, or an image when Pillow is there to convert it."""
+    return name.lower().endswith(".pdf") or (is_image(name) and can_convert_images())
+
+
+def scan_folder(folder: Path) -> ScannedFolder:
+    """
+    List a student folder with a single os.scandir pass. Entry types come
+    from the listing itself; only submissions are stat()ed, for their size.
+    """
+    scanned = ScannedFolder(Path(folder))
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                scanned.has_subdirs = True
+            elif entry.is_file():
+                scanned.num_files += 1
+                if is_submission(entry.name):
+                    scanned.pdfs.append(Path(entry.path))
+                    scanned.pdf_bytes += entry.stat().st_size
+    scanned.pdfs.sort()
+    return scanned
+
+
+def scan_download(
+    download: Path,
+    status_widget: Optional[StatusSink] = None,
+    skip: Collection[str] = (),
+    threads: int = SCAN_THREADS,
+) -> List[ScannedFolder]:
+    """
+    Scan every student folder of a download (except those named in skip)
+    and return the valid ones, sorted like the ZIP folders. Folders are
+    listed by a thread pool, since on OneDrive or SMB drives each listing
+    is a network round trip; they are validated (and logged) in order.
+    """
+    with os.scandir(download) as entries:
+        folders = [Path(e.path) for e in entries if e.is_dir() and e.name not in skip]
+    folders.sort(key=lambda p: p.name.lower())
+
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+        scanned = list(pool.map(scan_folder, folders))
+
+    return [
+        s for s in scanned
+        if check_folder_contents(s.path.relative_to(download), s.has_subdirs, s.num_files, status_widget)
+        in EXPECTED_NUM_FILES
+    ]
+
+
 def check_number_of_files(
-    root: Path, folder: Path, status_widget: Optional[tk.Text] = None
+    root: Path, folder: Path, status_widget: Optional[StatusSink] = None
 ) -> int:
     """Ensure no subdirectories exist and file count is plausible."""
-    subdirs = [p for p in folder.iterdir() if p.is_dir()]
-    if subdirs:
-        log(f"⚠️ '{folder.relative_to(root)}' contains subfolders.", status_widget)
+    scanned = scan_folder(folder)
+    return check_folder_contents(folder.relative_to(root), scanned.has_subdirs, scanned.num_files, status_widget)
+
+
+def check_folder_contents(
+    folder: PurePath, has_subdirs: bool, num_files: int, status_widget: Optional[StatusSink] = None
+) -> int:
+    """
+    Shared validation rules for a student folder, on disk or inside a ZIP.
+    Returns the file count, or -1 if the folder has subfolders.
+    """
+    if has_subdirs:
+        log(f"⚠️ '{folder}' contains subfolders.", status_widget)
         return -1
 
-    files = [p for p in folder.iterdir() if p.is_file()]
-    if len(files) not in EXPECTED_NUM_FILES:
-        log(
-            f"⚠️ '{folder.relative_to(root)}' contains {len(files)} files.",
-            status_widget,
+    if num_files not in EXPECTED_NUM_FILES:
+        log(f"⚠️ '{folder}' contains {num_files} files.", status_widget)
+
+    return num_files
+
+
+def zip_student_folders(
+    zip_file: zipfile.ZipFile, status_widget: Optional[StatusSink] = None
+) -> Dict[PurePosixPath, List[zipfile.ZipInfo]]:
+    """
+    Group ZIP members into student folders by member path, validated with the
+    same rules as check_number_of_files. A single wrapper folder around the
+    student folders (as made by zipping a download folder) is looked through.
+    Returns {student folder: file members}, sorted like the on-disk folders.
+    """
+    members = [PurePosixPath(info.filename) for info in zip_file.infolist()]
+    root = PurePosixPath()
+    top_dirs = {m.parts[0] for m in members if len(m.parts) > 1}
+    if len(top_dirs) == 1 and any(len(m.parts) > 2 for m in members):
+        root = PurePosixPath(top_dirs.pop())
+
+    folders: Dict[PurePosixPath, List[zipfile.ZipInfo]] = {}
+    nested = set()
+    for info, member in zip(zip_file.infolist(), members):
+        try:
+            relative = member.relative_to(root)
+        except ValueError:
+            continue
+        if len(relative.parts) < 2:
+            continue  # loose file (or the folder entry itself) at the top level
+
+        folder = root / relative.parts[0]
+        files = folders.setdefault(folder, [])
+        if len(relative.parts) > 2:
+            nested.add(folder)
+        elif not info.is_dir():
+            files.append(info)
+
+    valid = {}
+    for folder in sorted(folders, key=lambda p: p.name.lower()):
+        count = check_folder_contents(folder.relative_to(root), folder in nested, len(folders[folder]), status_widget)
+        if count in EXPECTED_NUM_FILES:
+            valid[folder] = folders[folder]
+    return valid
+
+
+# ================================================================
+# Submission Index
+# ================================================================
+Box = Tuple[float, float, float, float]  # left, bottom, right, top
+PageBoxes = Tuple[float, ...]  # visible box, then mediabox (older key files and caches: visible box only)
+
+
+@dataclass
+class SubmissionPdf:
+    """
+    One student PDF, parsed once per meld run (from disk or a ZIP member).
+    An image submission is converted to a PDF first; size_bytes and sha256
+    are still those of the image.
+    """
+    folder: PurePath
+    path: PurePath
+    size_bytes: int
+    reader: PdfReader
+    page_count: int
+    page_boxes: List[PageBoxes] = field(default_factory=list)
+    annotation_count: int = 0
+    sha256: str = ""
+    scaled_to: Optional[float] = None  # set when `reader` holds cached, already-scaled pages
+
+
+def _page_box(page: PageObject) -> Box:
+    """Visible box of a page (cropbox, falling back to the mediabox)."""
+    try:
+        box = page.cropbox
+    except Exception:
+        box = page.mediabox
+    return float(box.left), float(box.bottom), float(box.right), float(box.top)
+
+
+def _original_boxes(page: PageObject) -> PageBoxes:
+    """The visible box and mediabox of a page before melding, so unmelding can restore both."""
+    visible = _page_box(page)
+    try:
+        media = page.mediabox
+        return visible + (float(media.left), float(media.bottom), float(media.right), float(media.top))
+    except Exception:
+        return visible
+
+
+def index_pdf(
+    folder: PurePath,
+    pdf: PurePath,
+    data: bytes,
+    cache: Optional[PageCache] = None,
+    target_width: float = TARGET_WIDTH,
+    to_pdf: Optional[Callable[[], bytes]] = None,
+) -> SubmissionPdf:
+    """
+    Parse one PDF and record everything later stages need to know about it.
+    With a page cache, an unchanged PDF is not parsed at all: its scaled pages
+    and recorded details come from the cache instead.
+    An image is converted to a PDF target_width wide first, by to_pdf() if
+    given (see ImageConverter.take, which may have converted it already),
+    otherwise here.
+    """
+    sha256 = content_hash(data)
+    cached = cache.get(sha256, target_width) if cache else None
+    if cached:
+        return SubmissionPdf(
+            folder=folder,
+            path=pdf,
+            size_bytes=len(data),
+            reader=PdfReader(BytesIO(cached["pdf_bytes"])),
+            page_count=cached["page_count"],
+            page_boxes=[tuple(box) for box in cached["page_boxes"]],
+            annotation_count=cached["annotation_count"],
+            sha256=sha256,
+            scaled_to=target_width,
+        )
+
+    size_bytes = len(data)
+    if is_image(pdf.name):
+        data = to_pdf() if to_pdf else image_to_pdf(data, target_width)
+    reader = PdfReader(BytesIO(data))
+    annotation_count = 0
+    boxes = []
+    for page in reader.pages:
+        boxes.append(_original_boxes(page))
+        if "/Annots" in page:
+            annotation_count += len(page["/Annots"])
+
+    return SubmissionPdf(
+        folder=folder,
+        path=pdf,
+        size_bytes=size_bytes,
+        reader=reader,
+        page_count=len(reader.pages),
+        page_boxes=boxes,
+        annotation_count=annotation_count,
+        sha256=sha256,
+    )
+
+
+def index_submissions(
+    student_folders: List[ScannedFolder],
+    status_widget: Optional[StatusSink] = None,
+    cache: Optional[PageCache] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+    images: Optional[ImageConverter] = None,
+) -> List[SubmissionPdf]:
+    """
+    Read and parse every student PDF exactly once.
+
+    The folders come from scan_download, so their PDFs are already listed.
+    The returned index (in folder order, then file order) is what every later
+    stage works from, so no source file is opened a second time.
+    PDFs that cannot be read are quarantined (see index_or_quarantine).
+    With an ImageConverter, the folders' images are all set converting
+    first, so they convert concurrently while the PDFs are parsed.
+    """
+    if images:
+        images.prefetch(((pdf, pdf.read_bytes) for s in student_folders for pdf in s.pdfs if is_image(pdf.name)), cache)
+    index = []
+    for i, scanned in enumerate(student_folders, start=1):
+        check_cancelled(status_widget)
+        report_progress(i, len(student_folders), status_widget, "Reading")
+        folder = scanned.path
+        if not scanned.pdfs:
+            log(f"⚠️ No PDFs in {folder.name}. Skipping.", status_widget)
+            continue
+
+        for pdf in scanned.pdfs:
+            submission = index_or_quarantine(folder, pdf, pdf.read_bytes, cache, status_widget, quarantine, images)
+            if submission:
+                index.append(submission)
+
+    return index
+
+
+def index_zip_submissions(
+    zip_file: zipfile.ZipFile,
+    student_folders: Dict[PurePosixPath, List[zipfile.ZipInfo]],
+    status_widget: Optional[StatusSink] = None,
+    cache: Optional[PageCache] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+    images: Optional[ImageConverter] = None,
+) -> List[SubmissionPdf]:
+    """Like index_submissions, but parses PDFs straight from ZIP members in memory."""
+    submitted = {
+        folder: sorted((info for info in members if is_submission(info.filename)), key=lambda info: info.filename)
+        for folder, members in student_folders.items()
+    }
+    if images:
+        images.prefetch(
+            (
+                (PurePosixPath(info.filename), lambda info=info: zip_file.read(info))
+                for pdfs in submitted.values() for info in pdfs if is_image(info.filename)
+            ),
+            cache,
         )
+    index = []
+    for i, (folder, pdfs) in enumerate(submitted.items(), start=1):
+        check_cancelled(status_widget)
+        report_progress(i, len(student_folders), status_widget, "Reading")
+        if not pdfs:
+            log(f"⚠️ No PDFs in {folder.name}. Skipping.", status_widget)
+            continue
+
+        for info in pdfs:
+            submission = index_or_quarantine(
+                folder, PurePosixPath(info.filename), lambda: zip_file.read(info), cache, status_widget, quarantine,
+                images,
+            )
+            if submission:
+                index.append(submission)
 
-    return len(files)
+    return index
+
+
+def index_traced(
+    folder: PurePath,
+    pdf: PurePath,
+    read: Callable[[], bytes],
+    cache: Optional[PageCache] = None,
+    images: Optional[ImageConverter] = None,
+) -> SubmissionPdf:
+    """
+    Read a PDF's bytes with read() and index it, as one "index" trace span.
+    An image prefetched by `images` is not read again.
+    """
+    with span("index", file=pdf.name) as counts:
+        if images and is_image(pdf.name):
+            data, to_pdf = images.take(pdf, read)
+        else:
+            data, to_pdf = read(), None
+        submission = index_pdf(folder, pdf, data, cache, to_pdf=to_pdf)
+        counts.update(bytes_read=len(data), pages=submission.page_count, cached=submission.scaled_to is not None)
+    return submission
+
+
+def index_or_quarantine(
+    folder: PurePath,
+    pdf: PurePath,
+    read: Callable[[], bytes],
+    cache: Optional[PageCache] = None,
+    status_widget: Optional[StatusSink] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+    images: Optional[ImageConverter] = None,
+) -> Optional[SubmissionPdf]:
+    """
+    index_traced and check_submission, except that a PDF which cannot be
+    read or parsed is quarantined (logged with the reason, and added to
+    `quarantine`) and None returned, so one bad submission does not stop the meld.
+    """
+    try:
+        submission = index_traced(folder, pdf, read, cache, images)
+    except Exception as e:
+        quarantine_pdf(folder, pdf, e, status_widget, quarantine)
+        return None
+    check_submission(submission, status_widget)
+    return submission
+
+
+def quarantine_pdf(
+    folder: PurePath,
+    pdf: PurePath,
+    error: Exception,
+    status_widget: Optional[StatusSink] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+) -> None:
+    """Log why a submission is being left out of the meld, and add it to `quarantine`."""
+    item = QuarantinedPdf(folder.name, pdf.name, failure_reason(error))
+    log(item.message(), status_widget)
+    if quarantine is not None:
+        quarantine.append(item)
+
+
+def check_submission(submission: SubmissionPdf, status_widget: Optional[StatusSink] = None) -> None:
+    """Warn about PDFs that are unusually large or already annotated."""
+    size_mb = submission.size_bytes / 1024**2
+    if size_mb > WARNING_FILE_SIZE_MB:
+        log(f"⚠️ {submission.path.name} is {size_mb:.1f} MB.", status_widget)
+    if submission.annotation_count > WARNING_ANNOTATION_COUNT:
+        log(f"⚠️ {submission.path.name} has many annotations.", status_widget)
+
+
+def by_folder(index: List[SubmissionPdf]) -> Iterator[Tuple[PurePath, List[SubmissionPdf]]]:
+    """Yield (folder, submissions) groups in index order."""
+    for folder, group in groupby(index, key=lambda s: s.folder):
+        yield folder, list(group)
 
 
 # ================================================================
 # PDF Scaling
 # ================================================================
-def scale_pdf_to_width(
-    pdf_path: Path,
-    target_width: float,
-    status_widget: Optional[tk.Text] = None
-) -> None:
+@dataclass
+class ScalePlan:
     """
-    Scale all pages of pdf_path so the visible cropbox width equals target_width.
+    Page sizes to scale to, worked out for a batch of pages before any of
+    them is touched. Pages already at the target width, and pages without a
+    usable box, have no size and are left alone.
     """
+    target_width: float
+    sizes: List[Optional[Tuple[float, float]]] = field(default_factory=list)
+    at_target: int = 0
+    invalid: List[int] = field(default_factory=list)  # page indexes
+    rotated: int = 0
 
-    pdf_path = Path(pdf_path)
-    reader = PdfReader(str(pdf_path))
-    writer = PdfWriter()
+    @property
+    def to_scale(self) -> int:
+        return sum(1 for size in self.sizes if size)
+
+    def add(self, other: "ScalePlan") -> None:
+        """Fold another document's plan into this running total."""
+        offset = len(self.sizes)
+        self.sizes.extend(other.sizes)
+        self.at_target += other.at_target
+        self.invalid.extend(offset + i for i in other.invalid)
+        self.rotated += other.rotated
 
-    total = len(reader.pages)
-    log(f"➡️ Scaling {pdf_path.name}: {total} pages", status_widget)
+    def summary(self) -> str:
+        text = f"{self.at_target:,} of {len(self.sizes):,} pages already at target width, {self.to_scale:,} scaled"
+        if self.invalid:
+            text += f", {len(self.invalid):,} with invalid boxes left as they are"
+        if self.rotated:
+            text += f" ({self.rotated:,} rotated)"
+        return text
 
-    for idx, page in enumerate(reader.pages, start=1):
 
-        # --- Prefer cropbox ---
+def _visible_size(page: PageObject) -> Optional[Tuple[float, float]]:
+    """Width and height of the cropbox, falling back to the mediabox; None if neither is usable."""
+    try:
+        crop = page.cropbox
+        width, height = float(crop.right) - float(crop.left), float(crop.top) - float(crop.bottom)
+    except Exception:
+        width, height = 0, 0
+    if width <= 0 or height <= 0:
         try:
-            crop = page.cropbox
-            left = float(crop.left)
-            right = float(crop.right)
-            bottom = float(crop.bottom)
-            top = float(crop.top)
-            crop_width = right - left
-            crop_height = top - bottom
+            width, height = float(page.mediabox.width), float(page.mediabox.height)
         except Exception:
-            # fallback to mediabox
-            crop_width = float(page.mediabox.right) - float(page.mediabox.left)
-            crop_height = float(page.mediabox.top) - float(page.mediabox.bottom)
-
-        # Handle broken boxes
-        if crop_width <= 0 or crop_height <= 0:
-            try:
-                crop_width = float(page.mediabox.width)
-                crop_height = float(page.mediabox.height)
-            except Exception:
-                writer.add_page(page)
-                log(f"⚠️ Page {idx}/{total}: invalid box, skipped.", status_widget)
-                continue
+            return None
+    return (width, height) if width > 0 and height > 0 else None
 
-        aspect = crop_height / crop_width
-        target_height = target_width * aspect
 
-        # Scale the page
-        page.scale_to(target_width, target_height)
+def plan_scaling(pages: Sequence[PageObject], target_width: float) -> ScalePlan:
+    """
+    Read every page's boxes and rotation once and decide what each needs:
+    the size to scale to (keeping the visible aspect ratio), nothing if it
+    is already target_width wide with matching boxes, or nothing because
+    its boxes are invalid.
+    """
+    plan = ScalePlan(target_width)
+    for idx, page in enumerate(pages):
+        visible = _visible_size(page)
+        try:
+            media = tuple(float(v) for v in page.mediabox)
+        except Exception:
+            media = None
+        if visible is None or media is None or media[2] - media[0] <= 0 or media[3] - media[1] <= 0:
+            plan.sizes.append(None)
+            plan.invalid.append(idx)
+            continue
 
-        # Update cropbox
-        page.cropbox = RectangleObject([
-            0, 0,
-            float(target_width),
-            float(target_height)
-        ])
+        if int(page.get("/Rotate", 0) or 0) % 180:
+            plan.rotated += 1
+        size = (float(target_width), target_width * visible[1] / visible[0])
+        box = (0.0, 0.0) + size
+        if _same_box(media, box) and _same_box(_page_box(page), box):
+            plan.sizes.append(None)
+            plan.at_target += 1
+        else:
+            plan.sizes.append(size)
+    return plan
+
+
+def _same_box(a: Sequence[float], b: Sequence[float], tolerance: float = 0.01) -> bool:
+    return all(abs(x - y) <= tolerance for x, y in zip(a, b))
+
+
+def _scale_to(page: PageObject, size: Tuple[float, float]) -> None:
+    page.scale_to(*size)
+    page.cropbox = RectangleObject([0, 0, size[0], size[1]])
+
+
+def apply_scaling(pages: Sequence[PageObject], plan: ScalePlan) -> None:
+    """Scale the pages that the plan gives a size, so their cropbox is exactly that size."""
+    for page, size in zip(pages, plan.sizes):
+        if size:
+            _scale_to(page, size)
+
+
+def scale_page(page: PageObject, target_width: float) -> bool:
+    """
+    Scale one page in place so the visible cropbox width equals target_width.
+    Returns False if the page has no usable box (page left untouched).
+    """
+    plan = plan_scaling([page], target_width)
+    apply_scaling([page], plan)
+    return not plan.invalid
 
-        writer.add_page(page)
-        log(f"   • Page {idx}/{total} scaled", status_widget)
+
+def scale_pdf_to_width(
+    pdf_path: Path,
+    target_width: float,
+    status_widget: Optional[StatusSink] = None
+) -> None:
+    """
+    Scale all pages of pdf_path so the visible cropbox width equals target_width.
+    """
+
+    pdf_path = Path(pdf_path)
+    with span("plan scaling", file=pdf_path.name, bytes_read=pdf_path.stat().st_size) as counts:
+        reader = PdfReader(str(pdf_path))
+        writer = PdfWriter()
+        pages = list(reader.pages)
+        plan = plan_scaling(pages, target_width)
+        counts["pages"] = len(pages)
+    log(f"➡️ Scaling {pdf_path.name}: {plan.summary()}", status_widget)
+    if plan.invalid:
+        numbers = ", ".join(str(i + 1) for i in plan.invalid)
+        log(f"⚠️ Page(s) {numbers}: invalid box, not scaled.", status_widget)
+
+    with span("scale", file=pdf_path.name, pages=plan.to_scale):
+        for idx, (page, size) in enumerate(zip(pages, plan.sizes), start=1):
+            check_cancelled(status_widget)
+            report_progress(idx, len(pages), status_widget, "Scaling")
+            if size:
+                _scale_to(page, size)
+            writer.add_page(page)
 
     # Write output safely
     tmp_path = pdf_path.with_suffix(".tmp.pdf")
-    with tmp_path.open("wb") as f:
-        writer.write(f)
+    write_traced(writer, tmp_path)
     tmp_path.replace(pdf_path)
 
     log("✅ PDF scaling complete", status_widget)
@@ -144,126 +597,1187 @@ def scale_pdf_to_width(
 # ================================================================
 # PDF Merging
 # ================================================================
+def write_key_file(
+    key_file_path: Path,
+    index: List[SubmissionPdf],
+    append: bool = False,
+    first_page: int = 0,
+    target_width: float = TARGET_WIDTH,
+) -> None:
+    """
+    Write (or extend) key_file.csv for the indexed PDFs, which start at
+    melded page first_page. Each row is: folder, file, page count, first
+    melded page, SHA-256 of the source PDF, width the pages were scaled to,
+    and the source's original page boxes (visible box and mediabox) as
+    JSON. The first three columns are all that older key files have.
+    """
+    with key_file_path.open("a" if append else "w", newline="") as csv_file:
+        key_writer = csv.writer(csv_file)
+        for submission in index:
+            key_writer.writerow([
+                submission.folder.name,
+                submission.path.name,
+                submission.page_count,
+                first_page,
+                submission.sha256,
+                f"{target_width:g}",
+                json.dumps([[round(v, 2) for v in box] for box in submission.page_boxes]),
+            ])
+            first_page += submission.page_count
+
+
 def merge_pdfs(
     parent: Path,
     key_file_path: Path,
-    student_folders: List[Path],
-    status_widget: Optional[tk.Text] = None,
+    index: List[SubmissionPdf],
+    status_widget: Optional[StatusSink] = None,
 ) -> None:
-    """Merge all student PDFs into one and write key file."""
+    """Merge all indexed student PDFs into one and write key file."""
     merged = PdfWriter()
+    groups = list(by_folder(index))
 
-    with key_file_path.open("w", newline="") as csv_file:
-        key_writer = csv.writer(csv_file)
+    for i, (folder, submissions) in enumerate(groups, start=1):
+        check_cancelled(status_widget)
+        for submission in submissions:
+            with span("append", file=submission.path.name, pages=submission.page_count):
+                merged.append(submission.reader)
+
+        log(f"[{i}/{len(groups)}] Melded {folder.name}", status_widget)
+        report_progress(i, len(groups), status_widget, "Melding")
 
-        for i, folder in enumerate(student_folders, start=1):
-            pdfs = sorted(folder.glob("*.pdf"))
-            if not pdfs:
-                log(f"⚠️ No PDFs in {folder.name}. Skipping.", status_widget)
+    write_traced(merged, parent / MELDED_FILE_NAME)
+    write_key_file(key_file_path, index)
+
+
+def write_traced(writer: PdfWriter, path: Path) -> None:
+    """Serialize writer to path, as one "write" trace span."""
+    with span("write", file=path.name, pages=len(writer.pages)) as counts:
+        with path.open("wb") as f:
+            writer.write(f)
+            counts["bytes_written"] = f.tell()
+
+
+# ================================================================
+# Single-pass Meld
+# ================================================================
+def meld_single_pass(
+    parent: Path,
+    key_file_path: Path,
+    index: List[SubmissionPdf],
+    show_names: bool,
+    target_width: float = TARGET_WIDTH,
+    status_widget: Optional[StatusSink] = None,
+    cache: Optional[PageCache] = None,
+    optimiser: Optional[PdfOptimiser] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+) -> bool:
+    """
+    Merge, scale and label all indexed student PDFs in one pass.
+
+    Each page is scaled as it is appended and each PDF's first page gets its
+    label straight away, so melded_PDF.pdf is serialized exactly once.
+    Pages that came from the page cache are already scaled; newly scaled
+    submissions are added to the cache. Submissions that cannot be scaled
+    are quarantined and left out of the PDF and key file. Returns False,
+    writing nothing, if every submission was quarantined.
+    """
+    merged = PdfWriter()
+    scaling = ScalePlan(target_width)
+    groups = list(by_folder(index))
+    total_pages = sum(submission.page_count for submission in index)
+    melded = []
+
+    for i, (folder, submissions) in enumerate(groups, start=1):
+        label = student_label(folder.name, show_names)
+        if not label:
+            log(f"⚠️ Bad folder name: {folder.name}", status_widget)
+
+        saved = 0
+        for submission in submissions:
+            check_cancelled(status_widget)
+            first_page = len(merged.pages)
+            prepared = prepared_pages(submission, target_width, cache, status_widget, quarantine)
+            if prepared is None:
                 continue
+            pages, plan = prepared
+            melded.append(submission)
+            scaling.add(plan)
+            if optimiser:
+                saved += optimiser.optimise(pages)
+            with span("append", file=submission.path.name, pages=len(pages)):
+                for page in pages:
+                    merged.add_page(page)
+                if label:
+                    merged.add_annotation(first_page, label_annotation(merged.pages[first_page], label))
+            report_progress(len(merged.pages), total_pages, status_widget, "Melding")
+
+        log(f"[{i}/{len(groups)}] Melded {folder.name}{saved_note(saved)}", status_widget)
+
+    if not melded:
+        return False
+    log(f"Scaling: {scaling.summary()}", status_widget)
+
+    write_traced(merged, parent / MELDED_FILE_NAME)
+
+    # Written last so a cancelled or failed run never leaves a key file
+    # that disagrees with melded_PDF.pdf
+    write_key_file(key_file_path, melded, target_width=target_width)
+    return True
+
 
-            for pdf in pdfs:
-                size_mb = pdf.stat().st_size / 1024**2
-                if size_mb > WARNING_FILE_SIZE_MB:
-                    log(f"⚠️ {pdf.name} is {size_mb:.1f} MB.", status_widget)
+def scaled_pages(submission: SubmissionPdf, target_width: float) -> Tuple[List[PageObject], ScalePlan]:
+    """
+    A submission's pages scaled to target_width (cached pages are already
+    scaled). Also returns the scaling plan, which says how many pages were
+    already at the target width and which were left unscaled because their
+    boxes were invalid.
+    """
+    pages = list(submission.reader.pages)
+    if submission.scaled_to == target_width:
+        return pages, ScalePlan(target_width, [None] * len(pages), at_target=len(pages))
+
+    with span("scale", file=submission.path.name, pages=len(pages)) as counts:
+        plan = plan_scaling(pages, target_width)
+        apply_scaling(pages, plan)
+        counts["scaled"] = plan.to_scale
+    return pages, plan
+
+
+def prepared_pages(
+    submission: SubmissionPdf,
+    target_width: float,
+    cache: Optional[PageCache] = None,
+    status_widget: Optional[StatusSink] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+) -> Optional[Tuple[List[PageObject], ScalePlan]]:
+    """
+    scaled_pages, but a submission whose pages cannot be read or scaled is
+    quarantined (None is returned). Newly scaled pages are then added to the
+    page cache; if that fails, a warning is logged and the run carries on
+    without storing pages, since the meld itself is unaffected.
+    """
+    try:
+        pages, plan = scaled_pages(submission, target_width)
+    except Exception as e:
+        quarantine_pdf(submission.folder, submission.path, e, status_widget, quarantine)
+        return None
+
+    if cache and cache.writable and submission.scaled_to != target_width:
+        try:
+            with span("cache store", file=submission.path.name):
+                cache_scaled_pages(cache, submission, target_width)
+        except Exception as e:
+            cache.writable = False
+            log(f"⚠️ Cannot store pages in the page cache ({e}); carrying on without caching.", status_widget)
+    return pages, plan
 
-                reader = PdfReader(str(pdf))
-                if "/Annots" in reader.pages[0] and len(reader.pages[0]["/Annots"]) > WARNING_ANNOTATION_COUNT:
-                    log(f"⚠️ {pdf.name} has many annotations.", status_widget)
 
-                key_writer.writerow([folder.name, pdf.name, len(reader.pages)])
-                merged.append(str(pdf))
+def saved_note(saved: int) -> str:
+    """Suffix for a student's log line saying what optimisation saved."""
+    return f" (optimised, {format_bytes(saved)} saved)" if saved else ""
 
-            log(f"[{i}/{len(student_folders)}] Melded {folder.name}", status_widget)
 
-    merged.write(str(parent / MELDED_FILE_NAME))
+def cache_scaled_pages(cache: PageCache, submission: SubmissionPdf, target_width: float) -> None:
+    """Store a submission's freshly scaled pages (without labels) in the page cache."""
+    writer = PdfWriter()
+    for page in submission.reader.pages:
+        writer.add_page(page)
+    buffer = BytesIO()
+    writer.write(buffer)
+
+    cache.put(submission.sha256, target_width, buffer.getvalue(), {
+        "page_count": submission.page_count,
+        "page_boxes": submission.page_boxes,
+        "annotation_count": submission.annotation_count,
+    })
+
+
+# ================================================================
+# Chunked Meld
+# ================================================================
+class MemoryLimitExceeded(Exception):
+    """Raised when a chunked meld goes over its memory ceiling."""
+
+
+def plan_chunks(folder_bytes: List[int], chunk_size: int, max_bytes: Optional[float] = None) -> List[Tuple[int, int]]:
+    """
+    Split folders (given their PDF sizes) into consecutive (start, stop)
+    runs of at most chunk_size folders and, if given, max_bytes of PDFs.
+    A single folder larger than max_bytes still gets a chunk of its own.
+    """
+    chunks = []
+    start, size = 0, 0
+    for i, folder_size in enumerate(folder_bytes):
+        full = i - start >= chunk_size or (max_bytes is not None and size + folder_size > max_bytes)
+        if i > start and full:
+            chunks.append((start, i))
+            start, size = i, 0
+        size += folder_size
+    if start < len(folder_bytes):
+        chunks.append((start, len(folder_bytes)))
+    return chunks
+
+
+def chunk_byte_budget(memory_limit_mb: Optional[float]) -> Optional[float]:
+    """Bytes of source PDF one chunk may hold under the memory ceiling (None: unlimited)."""
+    if not memory_limit_mb:
+        return None
+    current = current_rss_mb()
+    if current is None:
+        return None
+    if current >= memory_limit_mb:
+        raise MemoryLimitExceeded(
+            f"Already using {format_mb(current)}, over the {format_mb(memory_limit_mb)} memory limit."
+        )
+    return (memory_limit_mb - current) * 1024**2 / SOURCE_MEMORY_FACTOR
+
+
+def meld_chunked(
+    parent: Path,
+    key_file_path: Path,
+    folders: List[Any],
+    folder_bytes: List[int],
+    index_folders: Callable[[List[Any]], List[SubmissionPdf]],
+    show_names: bool,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    memory_limit_mb: Optional[float] = None,
+    target_width: float = TARGET_WIDTH,
+    status_widget: Optional[StatusSink] = None,
+    cache: Optional[PageCache] = None,
+    optimiser: Optional[PdfOptimiser] = None,
+    journal: Optional[Journal] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+) -> bool:
+    """
+    Single-pass meld in bounded memory.
+
+    Folders are indexed, scaled and labelled a chunk at a time and each
+    chunk is streamed straight to melded_PDF.pdf, then released, so memory
+    depends on the chunk rather than the cohort. Chunks hold at most
+    chunk_size students and, with a memory ceiling, only as much source PDF
+    as should fit under it; going over the ceiling anyway stops the meld.
+    Page order and key_file.csv are the same as for meld_single_pass.
+
+    With a journal, each chunk is checkpointed once written. If the meld
+    stops part-way, the partly written files are kept, and the next run
+    with the same journal settings carries on after the last checkpoint
+    (see resume_chunks). Submissions that cannot be read or scaled are
+    quarantined and left out. Returns False, leaving the existing
+    melded PDF and key file alone, if nothing was melded.
+    """
+    melded_pdf = parent / MELDED_FILE_NAME
+    tmp_pdf = melded_pdf.with_suffix(".tmp.pdf")
+    tmp_key = key_file_path.with_suffix(".tmp.csv")
+    quarantine = quarantine if quarantine is not None else []
+    checkpoints = resume_chunks(journal, tmp_pdf, tmp_key, quarantine, status_widget)
+    done = checkpoints[-1]["stop"] if checkpoints else 0
+    chunks = [
+        (done + first, done + stop)
+        for first, stop in plan_chunks(folder_bytes[done:], chunk_size, chunk_byte_budget(memory_limit_mb))
+    ]
+    if checkpoints:
+        log(f"⏯️ Resuming: {done} of {len(folders)} folders were already melded.", status_widget)
+    log(f"Melding {len(folders) - done} folders in {len(chunks)} chunk(s).", status_widget)
+
+    scaling = ScalePlan(target_width)
+    try:
+        if not checkpoints:
+            tmp_key.write_text("")
+        with tmp_pdf.open("r+b" if checkpoints else "wb") as f:
+            if checkpoints:
+                writer = StreamingPdfWriter.resume(f, [checkpoint["writer"] for checkpoint in checkpoints])
+            else:
+                writer = StreamingPdfWriter(f)
+            for n, (first, stop) in enumerate(chunks, start=1):
+                check_cancelled(status_widget)
+                quarantined = len(quarantine)
+                index = index_folders(folders[first:stop])
+                batch = []
+                melded = []
+                for i, (folder, submissions) in enumerate(by_folder(index), start=first + 1):
+                    label = student_label(folder.name, show_names)
+                    if not label:
+                        log(f"⚠️ Bad folder name: {folder.name}", status_widget)
+                    saved = 0
+                    for submission in submissions:
+                        prepared = prepared_pages(submission, target_width, cache, status_widget, quarantine)
+                        if prepared is None:
+                            continue
+                        pages, plan = prepared
+                        melded.append(submission)
+                        scaling.add(plan)
+                        if optimiser:
+                            saved += optimiser.optimise(pages)
+                        annotations = {0: [label_annotation(pages[0], label)]} if label and pages else {}
+                        batch.append((pages, annotations))
+                    log(f"[{i}/{len(folders)}] Melded {folder.name}{saved_note(saved)}", status_widget)
+
+                first_page = writer.page_count
+                with span("write", file=melded_pdf.name, chunk=n) as counts:
+                    offset = f.tell()
+                    writer.append_batch(batch)
+                    counts.update(pages=writer.page_count - first_page, bytes_written=f.tell() - offset)
+                write_key_file(tmp_key, melded, append=True, first_page=first_page, target_width=target_width)
+                if journal:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    journal.record(
+                        "chunk",
+                        stop=stop,
+                        key_bytes=tmp_key.stat().st_size,
+                        writer=writer.checkpoint(),
+                        quarantined=[[q.folder, q.file, q.reason] for q in quarantine[quarantined:]],
+                    )
+
+                # Release this chunk's readers before measuring and starting the next
+                del index, batch, melded
+                if optimiser:
+                    optimiser.forget()
+                gc.collect()
+                rss = current_rss_mb()
+                log(f"   • Chunk {n}/{len(chunks)} written, memory {format_mb(rss)}", status_widget)
+                report_progress(stop, len(folders), status_widget, "Melding")
+                if memory_limit_mb and rss and rss > memory_limit_mb:
+                    raise MemoryLimitExceeded(
+                        f"Using {format_mb(rss)}, over the {format_mb(memory_limit_mb)} memory limit. "
+                        f"Try a smaller chunk size."
+                    )
+
+            writer.finish()
+    except BaseException:
+        if journal:
+            log("⏸️ Stopped part-way; run the meld again to carry on from the last chunk.", status_widget)
+        else:
+            _remove(tmp_pdf, tmp_key)
+        raise
+
+    if not writer.page_count:
+        _remove(tmp_pdf, tmp_key)
+        if journal:
+            journal.finish()
+        return False
+    log(f"Scaling: {scaling.summary()}", status_widget)
+
+    # The key file is moved into place last so it never disagrees with the PDF
+    tmp_pdf.replace(melded_pdf)
+    tmp_key.replace(key_file_path)
+    if journal:
+        journal.finish()
+    return True
+
+
+def resume_chunks(
+    journal: Optional[Journal],
+    tmp_pdf: Path,
+    tmp_key: Path,
+    quarantine: List[QuarantinedPdf],
+    status_widget: Optional[StatusSink] = None,
+) -> List[Dict[str, Any]]:
+    """
+    The chunk checkpoints a chunked meld can carry on from (empty to start
+    afresh). The partly written PDF and key file must still be there, at
+    least as long as the last checkpoint says; the key file is cut back to
+    that length. Submissions quarantined before are added to `quarantine`.
+    """
+    checkpoints = journal.of_kind("chunk") if journal else []
+    if not checkpoints:
+        return []
+    last = checkpoints[-1]
+    try:
+        usable = tmp_pdf.stat().st_size >= last["writer"]["offset"] and tmp_key.stat().st_size >= last["key_bytes"]
+    except OSError:
+        usable = False
+    if not usable:
+        log("⚠️ The partly melded files from the last run are missing; starting again.", status_widget)
+        journal.restart()
+        return []
+
+    with tmp_key.open("r+b") as f:
+        f.truncate(last["key_bytes"])
+    for checkpoint in checkpoints:
+        quarantine.extend(QuarantinedPdf(*item) for item in checkpoint["quarantined"])
+    return checkpoints
+
+
+def _remove(*paths: Path) -> None:
+    for path in paths:
+        if path.exists():
+            path.unlink()
+
+
+# ================================================================
+# Parallel Meld
+# ================================================================
+_worker_zip: Optional[zipfile.ZipFile] = None
+_worker_cache: Optional[PageCache] = None
+
+
+def _init_prepare_worker(zip_path: Optional[Path], cache: Optional[PageCache]) -> None:
+    """Open the download ZIP (if melding one) once per worker process."""
+    global _worker_zip, _worker_cache
+    _worker_zip = zipfile.ZipFile(zip_path) if zip_path else None
+    _worker_cache = cache
+
+
+def labelled_pdf_bytes(pages: List[PageObject], label: Optional[str]) -> bytes:
+    """A submission's (scaled) pages as a PDF, with the student label on its first page."""
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(page)
+    if label and pages:
+        writer.add_annotation(0, label_annotation(writer.pages[0], label))
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def _prepare_folder(
+    folder: Any, show_names: bool, target_width: float, trace: bool = False
+) -> Tuple[List[Tuple[SubmissionPdf, bytes, ScalePlan]], List[str], List[QuarantinedPdf], list]:
+    """
+    Worker task: index, scale and label one student folder (a ScannedFolder,
+    or a ZIP folder and its member names). Returns each submission (without
+    its reader) with its prepared PDF and scaling plan, the log messages, the
+    quarantined submissions, and the trace spans if trace=True.
+    """
+    status = MessageList()
+    prepared = []
+    quarantine: List[QuarantinedPdf] = []
+    with tracing(Tracer() if trace else None) as tracer:
+        if _worker_zip:
+            zip_folder, names = folder
+            members = {zip_folder: [_worker_zip.getinfo(name) for name in names]}
+            index = index_zip_submissions(_worker_zip, members, status, _worker_cache, quarantine)
+        else:
+            index = index_submissions([folder], status, _worker_cache, quarantine)
+
+        for submission in index:
+            scaled = prepared_pages(submission, target_width, _worker_cache, status, quarantine)
+            if scaled is None:
+                continue
+            pages, plan = scaled
+            label = student_label(submission.folder.name, show_names)
+            with span("label", file=submission.path.name, pages=len(pages)) as counts:
+                data = labelled_pdf_bytes(pages, label)
+                counts["bytes"] = len(data)
+            submission.reader = None  # scaled_to still tells the parent whether it was a cache hit
+            prepared.append((submission, data, plan))
+    return prepared, status.messages, quarantine, tracer.events if tracer else []
+
+
+def meld_parallel(
+    parent: Path,
+    key_file_path: Path,
+    folders: List[Any],
+    zip_path: Optional[Path],
+    show_names: bool,
+    workers: int,
+    target_width: float = TARGET_WIDTH,
+    status_widget: Optional[StatusSink] = None,
+    cache: Optional[PageCache] = None,
+    optimiser: Optional[PdfOptimiser] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+) -> bool:
+    """
+    Single-pass meld with each student folder prepared in a process pool.
+
+    Workers parse, check, scale and label a folder's PDFs and send each back
+    as a small PDF. The prepared folders are taken in student order, so one
+    writer here assembles them into melded_PDF.pdf exactly as
+    meld_single_pass would. Optimisation runs here, so repeated fonts and
+    images are still found across students.
+    `folders` are ScannedFolders, or (ZIP folder, member names) when melding
+    the ZIP at zip_path. Submissions the workers quarantined are added to
+    `quarantine`. Returns False, writing nothing, if nothing was melded.
+    """
+    merged = PdfWriter()
+    scaling = ScalePlan(target_width)
+    index = []
+    tracer = current_tracer()
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_prepare_worker, initargs=(zip_path, cache)
+    ) as pool:
+        futures = [
+            pool.submit(_prepare_folder, folder, show_names, target_width, tracer is not None) for folder in folders
+        ]
+        try:
+            for i, future in enumerate(futures, start=1):
+                prepared, messages, quarantined, events = future.result()
+                if tracer:
+                    tracer.merge(events)
+                for message in messages:
+                    log(message, status_widget)
+                if quarantine is not None:
+                    quarantine.extend(quarantined)
+                check_cancelled(status_widget)
+
+                saved = 0
+                for submission, data, plan in prepared:
+                    if cache:
+                        if submission.scaled_to is None:
+                            cache.misses += 1
+                        else:
+                            cache.hits += 1
+                    submission.reader = PdfReader(BytesIO(data))
+                    submission.scaled_to = target_width
+                    scaling.add(plan)
+                    pages = list(submission.reader.pages)
+                    if optimiser:
+                        saved += optimiser.optimise(pages)
+                    with span("append", file=submission.path.name, pages=len(pages)):
+                        for page in pages:
+                            merged.add_page(page)
+                    index.append(submission)
+
+                if prepared:
+                    folder = prepared[0][0].folder
+                    if not student_label(folder.name, show_names):
+                        log(f"⚠️ Bad folder name: {folder.name}", status_widget)
+                    log(f"[{i}/{len(folders)}] Melded {folder.name}{saved_note(saved)}", status_widget)
+                report_progress(i, len(folders), status_widget, "Melding")
+        finally:
+            for pending in futures:
+                pending.cancel()
+
+    if not index:
+        return False
+    log(f"Scaling: {scaling.summary()}", status_widget)
+    write_traced(merged, parent / MELDED_FILE_NAME)
+    write_key_file(key_file_path, index, target_width=target_width)
+    return True
+
+
+# ================================================================
+# Sharded Meld
+# ================================================================
+def shard_folder(parent: Path, number: int) -> Path:
+    """Folder holding shard `number` (from 1): its melded_PDF.pdf and key_file.csv."""
+    return parent / f"{SHARD_FOLDER_NAME} {number}"
+
+
+def stale_shard_folders(parent: Path, shards: int) -> List[Path]:
+    """Shard folders next to the download numbered above `shards`, left by an earlier meld with more shards."""
+    stale = []
+    for path in parent.glob(f"{SHARD_FOLDER_NAME} *"):
+        number = path.name[len(SHARD_FOLDER_NAME) + 1:]
+        if path.is_dir() and number.isdigit() and int(number) > shards:
+            stale.append((int(number), path))
+    return [path for _, path in sorted(stale)]
+
+
+def plan_shards(page_counts: List[int], shards: int) -> List[List[int]]:
+    """
+    Bin-pack folders (given their page counts) into `shards` piles of
+    roughly equal page totals: largest folder first, each onto the pile
+    with the fewest pages so far. Returns each pile's folder indexes in
+    their original (alphabetical) order.
+    """
+    piles: List[List[int]] = [[] for _ in range(shards)]
+    totals = [(0, k) for k in range(shards)]
+    for i in sorted(range(len(page_counts)), key=lambda i: -page_counts[i]):
+        pages, k = heapq.heappop(totals)
+        piles[k].append(i)
+        heapq.heappush(totals, (pages + page_counts[i], k))
+    return [sorted(pile) for pile in piles]
+
+
+def count_pages(data: bytes) -> int:
+    """Number of pages in a PDF, read from its page tree root without loading the pages."""
+    reader = PdfReader(BytesIO(data))
+    try:
+        return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+    except Exception:
+        return len(reader.pages)
+
+
+def _count_folder_pages(folder: Any) -> int:
+    """
+    Worker task: total pages of a student folder's submissions (unreadable
+    ones count as none, images one per frame).
+    """
+    if _worker_zip:
+        _, names = folder
+        files = [(name, lambda name=name: _worker_zip.read(name)) for name in names if is_submission(name)]
+    else:
+        files = [(pdf.name, pdf.read_bytes) for pdf in folder.pdfs]
+
+    total = 0
+    for name, read in files:
+        try:
+            total += image_page_count(read()) if is_image(name) else count_pages(read())
+        except Exception:
+            pass  # quarantined (and logged) when the shard is melded
+    return total
+
+
+def _meld_shard(
+    shard_dir: Path,
+    folders: List[Any],
+    show_names: bool,
+    target_width: float,
+    optimiser: Optional[PdfOptimiser] = None,
+    trace: bool = False,
+) -> Tuple[bool, List[str], List[QuarantinedPdf], Tuple[int, int, int], list]:
+    """
+    Worker task: single-pass meld of one shard's student folders into
+    shard_dir. Returns whether anything was melded, the log messages, the
+    quarantined submissions, (page cache hits, misses, bytes saved by
+    optimising), and the trace spans if trace=True.
+    """
+    status = MessageList()
+    quarantine: List[QuarantinedPdf] = []
+    cache = _worker_cache
+    before = (cache.hits, cache.misses) if cache else (0, 0)  # the cache lives as long as the worker
+    with tracing(Tracer() if trace else None) as tracer:
+        if _worker_zip:
+            members = {zip_folder: [_worker_zip.getinfo(name) for name in names] for zip_folder, names in folders}
+            index = index_zip_submissions(_worker_zip, members, status, cache, quarantine)
+        else:
+            index = index_submissions(folders, status, cache, quarantine)
+        found = False
+        if index:
+            shard_dir.mkdir(exist_ok=True)
+            found = meld_single_pass(
+                shard_dir, shard_dir / KEY_FILE_NAME, index, show_names, target_width, status, cache, optimiser, quarantine
+            )
+    counts = (
+        cache.hits - before[0] if cache else 0,
+        cache.misses - before[1] if cache else 0,
+        optimiser.total_saved if optimiser else 0,
+    )
+    return found, status.messages, quarantine, counts, tracer.events if tracer else []
+
+
+def meld_sharded(
+    parent: Path,
+    folders: List[Any],
+    zip_path: Optional[Path],
+    show_names: bool,
+    shards: int,
+    workers: int,
+    target_width: float = TARGET_WIDTH,
+    status_widget: Optional[StatusSink] = None,
+    cache: Optional[PageCache] = None,
+    optimiser: Optional[PdfOptimiser] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+) -> bool:
+    """
+    Meld the cohort into `shards` separate melded PDFs of roughly equal
+    page totals, one per marker, each in its own folder (see shard_folder)
+    with its own key file.
+
+    Page counts are read from each PDF's page tree root, students are
+    bin-packed by them (see plan_shards), and the shards are then built
+    at the same time in a process pool, each as a single-pass meld. A shard
+    with nothing melded (every submission quarantined) has any earlier
+    melded PDF and key file in its folder removed.
+    `folders` are as for meld_parallel. Returns False if nothing was melded.
+    """
+    tracer = current_tracer()
+    shards = min(shards, len(folders))
+    found = False
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_prepare_worker, initargs=(zip_path, cache)
+    ) as pool:
+        with span("count pages", folders=len(folders)) as counts:
+            page_counts = list(pool.map(_count_folder_pages, folders))
+            counts["pages"] = sum(page_counts)
+        piles = plan_shards(page_counts, shards)
+        for k, pile in enumerate(piles, start=1):
+            pages = sum(page_counts[i] for i in pile)
+            log(f"📚 {shard_folder(parent, k).name}: {len(pile)} students, {pages:,} pages", status_widget)
+
+        futures = [
+            pool.submit(
+                _meld_shard, shard_folder(parent, k), [folders[i] for i in pile],
+                show_names, target_width, optimiser, tracer is not None,
+            )
+            for k, pile in enumerate(piles, start=1)
+        ]
+        try:
+            for k, future in enumerate(futures, start=1):
+                shard_found, messages, quarantined, (hits, misses, saved), events = future.result()
+                if tracer:
+                    tracer.merge(events)
+                name = shard_folder(parent, k).name
+                for message in messages:
+                    log(f"[{name}] {message}", status_widget)
+                if quarantine is not None:
+                    quarantine.extend(quarantined)
+                if cache:
+                    cache.hits += hits
+                    cache.misses += misses
+                if optimiser:
+                    optimiser.total_saved += saved
+                found = found or shard_found
+                if shard_found:
+                    log(f"✅ {name} melded.", status_widget)
+                else:
+                    # Leave no output from an earlier meld to be mistaken for this one's
+                    shard_dir = shard_folder(parent, k)
+                    for path in (shard_dir / MELDED_FILE_NAME, shard_dir / KEY_FILE_NAME):
+                        path.unlink(missing_ok=True)
+                    log(f"❌ {name}: nothing melded; any earlier melded PDF and key file were removed.", status_widget)
+                report_progress(k, len(futures), status_widget, "Melding shards")
+                check_cancelled(status_widget)
+        finally:
+            for pending in futures:
+                pending.cancel()
+    return found
+
+
+# ================================================================
+# Incremental Meld
+# ================================================================
+def melded_folder_names(key_file_path: Path) -> set:
+    """Student folders already in an existing key file."""
+    with key_file_path.open("r", newline="") as csv_file:
+        return {row[0] for row in csv.reader(csv_file) if row}
+
+
+def meld_append(
+    melded_pdf: Path,
+    key_file_path: Path,
+    index: List[SubmissionPdf],
+    show_names: bool,
+    target_width: float = TARGET_WIDTH,
+    status_widget: Optional[StatusSink] = None,
+    cache: Optional[PageCache] = None,
+    optimiser: Optional[PdfOptimiser] = None,
+    quarantine: Optional[List[QuarantinedPdf]] = None,
+) -> bool:
+    """
+    Append new submissions, scaled and labelled, to the end of an existing
+    melded PDF and key file. Submissions that cannot be scaled are quarantined.
+
+    The pages go in as an incremental update, so the existing file (and any
+    marking already in it) is left byte-for-byte as it was and only the new
+    pages are written. If the file cannot be updated incrementally (e.g. it
+    is encrypted) it is rebuilt with the new pages added instead.
+    Returns False, changing nothing, if every submission was quarantined.
+    """
+    groups = list(by_folder(index))
+    prepared = []
+    melded = []
+    for i, (folder, submissions) in enumerate(groups, start=1):
+        check_cancelled(status_widget)
+        label = student_label(folder.name, show_names)
+        if not label:
+            log(f"⚠️ Bad folder name: {folder.name}", status_widget)
+
+        saved = 0
+        for submission in submissions:
+            scaled = prepared_pages(submission, target_width, cache, status_widget, quarantine)
+            if scaled is None:
+                continue
+            pages, plan = scaled
+            melded.append(submission)
+            if optimiser:
+                saved += optimiser.optimise(pages)
+            if plan.invalid:
+                log(f"⚠️ {submission.path.name}: {len(plan.invalid)} page(s) with invalid boxes were not scaled.", status_widget)
+            annotations = {0: [label_annotation(pages[0], label)]} if label else {}
+            prepared.append((pages, annotations))
+
+        log(f"[{i}/{len(groups)}] Prepared {folder.name}{saved_note(saved)}", status_widget)
+        report_progress(i, len(groups), status_widget, "Preparing")
+
+    if not melded:
+        return False
+    try:
+        with span("append", file=melded_pdf.name) as counts, IncrementalAppender(melded_pdf) as appender:
+            first_page = int(appender.pages_ref.get_object()["/Count"])
+            for pages, annotations in prepared:
+                appender.append_pages(pages, annotations)
+            update = appender.finish()
+            counts["pages"] = appender.page_count
+        with span("write", file=melded_pdf.name, bytes_written=len(update)), melded_pdf.open("ab") as f:
+            f.write(update)
+        log(f"➕ Appended {appender.page_count} pages as an incremental update.", status_widget)
+    except Exception as e:
+        log(f"⚠️ Incremental update not possible ({e}); rewriting {melded_pdf.name}.", status_widget)
+        writer = PdfWriter(clone_from=str(melded_pdf))
+        first_page = len(writer.pages)
+        for pages, annotations in prepared:
+            start = len(writer.pages)
+            for page in pages:
+                writer.add_page(page)
+            for annotation in annotations.get(0, []):
+                writer.add_annotation(start, annotation)
+
+        tmp_path = melded_pdf.with_suffix(".tmp.pdf")
+        write_traced(writer, tmp_path)
+        tmp_path.replace(melded_pdf)
+
+    write_key_file(key_file_path, melded, append=True, first_page=first_page, target_width=target_width)
+    return True
 
 
 # ================================================================
 # PDF Annotation
 # ================================================================
+def student_label(folder_name: str, show_names: bool) -> Optional[str]:
+    """Return the label shown on a student's first page, or None for a bad folder name."""
+    name, sid = extract_name_id(folder_name)
+    if not (name and sid):
+        return None
+    return f"{name} {sid}" if show_names else str(sid)
+
+
+def label_annotation(page: PageObject, label: str) -> FreeText:
+    """Build the red FreeText label placed at the top-left of `page`."""
+    top = float(page.mediabox.top)
+    return FreeText(
+        text=label,
+        rect=(5, top - 20, 150, top - 5),
+        font_size="8pt",
+        font_color="ff0000",
+        border_color="ff0000",
+    )
+
+
 def annotate_pdf(
     pdf_path: Path,
-    student_folders: List[Path],
+    index: List[SubmissionPdf],
     show_names: bool,
-    status_widget: Optional[tk.Text] = None,
+    status_widget: Optional[StatusSink] = None,
 ) -> None:
     """Add each student's name/ID at the top of corresponding pages."""
-    writer = PdfWriter()
-    writer.clone_document_from_reader(PdfReader(str(pdf_path)))
-
-    page_idx = 0
-    for folder in student_folders:
-        for pdf_file in folder.glob("*.pdf"):
-            num_pages = len(PdfReader(str(pdf_file)).pages)
-            page = writer.pages[page_idx]
-
-            name, sid = extract_name_id(folder.name)
-            if name and sid:
-                label = f"{name} {sid}" if show_names else str(sid)
-                annot = FreeText(
-                    text=label,
-                    rect=(5, float(page.mediabox.top) - 20, 150, float(page.mediabox.top) - 5),
-                    font_size="8pt",
-                    font_color="ff0000",
-                    border_color="ff0000",
-                )
-                writer.add_annotation(page_idx, annot)
+    with span("read", file=pdf_path.name, bytes_read=pdf_path.stat().st_size):
+        writer = PdfWriter()
+        writer.clone_document_from_reader(PdfReader(str(pdf_path)))
+
+    with span("annotate", file=pdf_path.name, labels=len(index)):
+        page_idx = 0
+        for submission in index:
+            label = student_label(submission.folder.name, show_names)
+            if label:
+                writer.add_annotation(page_idx, label_annotation(writer.pages[page_idx], label))
             else:
-                log(f"⚠️ Bad folder name: {folder.name}", status_widget)
+                log(f"⚠️ Bad folder name: {submission.folder.name}", status_widget)
 
-            page_idx += num_pages
+            page_idx += submission.page_count
 
-    with pdf_path.open("wb") as f:
-        writer.write(f)
+    write_traced(writer, pdf_path)
 
     log("Annotation complete.", status_widget)
 
 
+# ================================================================
+# PDF Navigation
+# ================================================================
+def student_bookmarks(key_file_path: Path, show_names: bool) -> List[Bookmark]:
+    """
+    One bookmark per student in a key file, at their first melded page,
+    titled with their label. Students with a bad folder name are titled
+    with the folder name if names are shown, otherwise "Student n".
+    """
+    with key_file_path.open("r", newline="") as csv_file:
+        rows = [row for row in csv.reader(csv_file) if row]
+
+    bookmarks = []
+    first_page = 0
+    for n, (folder, group) in enumerate(groupby(rows, key=lambda row: row[0]), start=1):
+        pages = sum(int(row[2]) for row in group)
+        if pages:
+            title = student_label(folder, show_names) or (folder if show_names else f"Student {n}")
+            bookmarks.append(Bookmark(title, first_page, f"{title}-"))
+        first_page += pages
+    return bookmarks
+
+
+def add_navigation(
+    melded_pdf: Path,
+    key_file_path: Path,
+    show_names: bool,
+    status_widget: Optional[StatusSink] = None,
+) -> None:
+    """
+    Bookmark each student's first page in a melded PDF and label their
+    pages ("123456-1", "123456-2", ...), so a marker can jump between
+    students in a large file. Written as a small incremental update that
+    replaces any earlier outline, so after an incremental meld it still
+    covers every student.
+    """
+    bookmarks = student_bookmarks(key_file_path, show_names)
+    try:
+        with span("navigation", file=melded_pdf.name, bookmarks=len(bookmarks)) as counts:
+            with IncrementalAppender(melded_pdf) as appender:
+                appender.set_navigation(bookmarks)
+                update = appender.finish()
+            with melded_pdf.open("ab") as f:
+                f.write(update)
+            counts["bytes_written"] = len(update)
+    except Exception as e:
+        log(f"⚠️ Could not add student bookmarks to {melded_pdf.name} ({failure_reason(e)}).", status_widget)
+        return
+    log(f"🔖 Bookmarked {len(bookmarks)} students in {melded_pdf.name}.", status_widget)
+
+
+def linearize_melded(melded_pdf: Path, status_widget: Optional[StatusSink] = None) -> None:
+    """Linearize a melded PDF for fast opening (see linearize_pdf)."""
+    with span("linearize", file=melded_pdf.name) as counts:
+        linearize_pdf(melded_pdf)
+        counts["bytes_written"] = melded_pdf.stat().st_size
+    log(f"⚡ Linearized {melded_pdf.name} for fast web view.", status_widget)
+
+
 # ================================================================
 # Main Entry
 # ================================================================
-def meld(folder: str, show_student_names: bool, status_widget: Optional[tk.Text] = None) -> None:
-    """Top-level operation: merge, scale, annotate."""
+def no_students_message(incremental: bool) -> str:
+    if incremental:
+        return "✅ No new student folders to add."
+    return "⚠️ No valid student folders found."
+
+
+def nothing_melded_message(quarantined: List[QuarantinedPdf]) -> str:
+    """Why a meld with student folders produced nothing."""
+    if quarantined:
+        return (
+            f"❌ Nothing melded: all {len(quarantined)} submission(s) were quarantined (see {QUARANTINE_FILE_NAME}). "
+            f"Existing melded files were left as they were."
+        )
+    return "⚠️ No PDFs found in any student folder."
+
+
+def meld_outputs(folder: Path, shards: int = 1, incremental: bool = False, single_pass: bool = True) -> List[Path]:
+    """The melded PDFs a meld of `folder` with these options writes (one per shard when sharded)."""
+    parent = Path(folder).parent
+    if shards > 1 and single_pass and not incremental:
+        return [shard_folder(parent, k) / MELDED_FILE_NAME for k in range(1, shards + 1)]
+    return [parent / MELDED_FILE_NAME]
+
+
+def ask_overwrite(*melded_pdfs: Path) -> bool:
+    """Ask in a dialog whether existing melded PDFs may be overwritten."""
+    from tkinter import messagebox as mb  # imported here so headless runs never load tkinter
+
+    files = "\n".join(str(path) for path in melded_pdfs)
+    return mb.askyesno(
+        "Overwrite existing PDF?",
+        f"The output file(s) already exist:\n\n{files}\n\nOverwrite them?"
+    )
+
+
+def meld(
+    folder: str,
+    show_student_names: bool,
+    status_widget: Optional[StatusSink] = None,
+    single_pass: bool = True,
+    confirm_overwrite: Optional[Callable[[Path], bool]] = None,
+    cache: Optional[PageCache] = None,
+    incremental: bool = False,
+    chunk_size: Optional[int] = None,
+    memory_limit_mb: Optional[float] = None,
+    optimiser: Optional[PdfOptimiser] = None,
+    workers: int = 1,
+    shards: int = 1,
+    linearize: bool = False,
+    resumable: bool = False,
+) -> bool:
+    """
+    Top-level operation: merge, scale, annotate.
+
+    `folder` is a Moodle download folder, or the downloaded ZIP itself, which
+    is read in place without extracting it. Output goes next to it.
+    With single_pass=False the older three-pass path (merge, then rescale the
+    whole file, then annotate it) is used, which is useful for comparison.
+    confirm_overwrite(path) decides whether an existing output may be
+    replaced; by default the user is asked in a dialog.
+    With a PageCache, submissions unchanged since an earlier meld reuse their
+    scaled pages (single-pass only).
+    With incremental=True only student folders missing from the existing
+    key file (e.g. late submissions) are melded, and they are appended to the
+    existing melded PDF, keeping any marking already done on it.
+    With a chunk_size and/or memory_limit_mb the single-pass meld is done a
+    chunk of students at a time in bounded memory (see meld_chunked).
+    With a PdfOptimiser, large images are downsampled, content streams
+    compressed and repeated fonts/images stored once (single-pass only).
+    With workers > 1 a full single-pass meld prepares each student folder in
+    a process pool (see meld_parallel).
+    A chunked meld keeps a journal (meld_journal.jsonl) next to the key file,
+    so if it stops part-way, running it again carries on where it stopped.
+    Only the chunked writer checkpoints its output, so resumable=True makes
+    a full single-pass meld chunked (DEFAULT_CHUNK_SIZE students at a time,
+    unless a chunk_size is given); `workers` then only convert images.
+    Submissions that cannot be read or scaled are quarantined: logged, left
+    out, and listed in quarantine.csv.
+    With shards > 1 (single-pass, not incremental) the cohort is split into
+    that many melded PDFs of similar page counts, for several markers, each
+    with its own key file in a "Shard N" folder (see meld_sharded). They
+    are built at the same time by `workers` processes (all cores if 1).
+    Image submissions (photos, scans) are converted to pages like PDFs,
+    using `workers` processes (needs Pillow; see ImageConverter).
+    Every melded PDF gets an outline entry and page labels for each student
+    (see add_navigation). With linearize=True it is then linearized, so
+    viewers show the first page at once (needs pikepdf; see linearize_pdf).
+    Returns False if the meld could not be done (the reason is logged).
+    """
+    if not single_pass:
+        cache = None
+        optimiser = None
+    sharded = shards > 1 and single_pass and not incremental
+    chunked = bool(chunk_size or memory_limit_mb or resumable) and single_pass and not (incremental or sharded)
+    parallel = workers > 1 and single_pass and not (chunked or incremental or sharded)
     folder = Path(folder)
     parent = folder.parent
     melded_pdf = parent / MELDED_FILE_NAME
     key_file = parent / KEY_FILE_NAME
+    outputs = meld_outputs(folder, shards, incremental, single_pass)
 
     # Validate input
-    if not folder.is_dir():
-        return log(f"❌ Folder does not exist: {folder}", status_widget)
+    is_zip = folder.is_file() and zipfile.is_zipfile(folder)
+    if not (folder.is_dir() or is_zip):
+        log(f"❌ Folder or ZIP file does not exist: {folder}", status_widget)
+        return False
 
-    if melded_pdf.exists():
+    if incremental and not (melded_pdf.exists() and key_file.exists()):
+        log(f"❌ Nothing to add to: '{melded_pdf.name}' and '{key_file.name}' must both exist.", status_widget)
+        return False
+
+    existing = [path for path in outputs if path.exists()]
+    for path in existing:
         try:
             # Open with no truncation to detect locks
-            with open(melded_pdf, "ab"):
+            with open(path, "ab"):
                 pass
         except Exception:
-            return log(f"❌ Cannot overwrite '{melded_pdf}': file is currently in use.", status_widget)
-        answer = mb.askyesno(
-            "Overwrite existing PDF?",
-            f"The output file already exists:\n\n{melded_pdf}\n\nOverwrite it?"
-        )
-        if not answer:
-            return log("❌ Meld cancelled by user (file exists).", status_widget)
+            log(f"❌ Cannot overwrite '{path}': file is currently in use.", status_widget)
+            return False
+    if existing and not incremental and not (confirm_overwrite or ask_overwrite)(existing[0]):
+        log("❌ Meld cancelled by user (file exists).", status_widget)
+        return False
 
-    # Gather valid student folders
-    students = [
-        f for f in folder.iterdir()
-        if f.is_dir() and check_number_of_files(folder, f, status_widget) in EXPECTED_NUM_FILES
-    ]
+    already_melded = melded_folder_names(key_file) if incremental else set()
+    quarantined: List[QuarantinedPdf] = []
+
+    with ExitStack() as stack:
+        # Only used where folders are indexed here; parallel and sharded melds convert images in their own pools
+        images = stack.enter_context(ImageConverter(TARGET_WIDTH, workers))
+        if is_zip:
+            zip_file = stack.enter_context(zipfile.ZipFile(folder))
+            students = zip_student_folders(zip_file, status_widget)
+            students = {f: m for f, m in students.items() if f.name not in already_melded}
+            folders = list(students.items())
+            folder_bytes = [sum(info.file_size for info in members) for _, members in folders]
+
+            def index_folders(chunk):
+                return index_zip_submissions(zip_file, dict(chunk), status_widget, cache, quarantined, images)
+        else:
+            # Gather valid student folders, listing each one once
+            students = scan_download(folder, status_widget, skip=already_melded)
+            folders = students
+            folder_bytes = [scanned.pdf_bytes for scanned in students]
 
-    if not students:
-        return log("⚠️ No valid student folders found.", status_widget)
+            def index_folders(chunk):
+                return index_submissions(chunk, status_widget, cache, quarantined, images)
 
-    students.sort(key=lambda p: p.name.lower())
+        if not students:
+            log(no_students_message(incremental), status_widget)
+            return incremental  # nothing new to add is not a failure
 
-    log(f"Starting meld from: {folder.resolve()}", status_widget)
+        log(f"Starting meld from: {folder.resolve()}", status_widget)
+        start = time.perf_counter()
+        run = stack.enter_context(span("meld", RUN, source=folder.name, folders=len(students)))
+
+        # Operations
+        if sharded:
+            mode = f"Sharded ({min(shards, len(folders))} shards)"
+            if is_zip:
+                jobs = [(f, [info.filename for info in members]) for f, members in folders]
+            else:
+                jobs = folders
+            found = meld_sharded(
+                parent, jobs, folder if is_zip else None, show_student_names, shards,
+                workers if workers > 1 else os.cpu_count() or 1, TARGET_WIDTH, status_widget, cache, optimiser,
+                quarantined,
+            )
+        elif chunked:
+            mode = "Chunked"
+            journal = stack.enter_context(Journal(key_file.with_name(MELD_JOURNAL_NAME), {
+                "source": str(folder.resolve()),
+                "folders": [f.name for f in students] if is_zip else [s.path.name for s in students],
+                "bytes": folder_bytes,
+                "show_names": show_student_names,
+                "target_width": TARGET_WIDTH,
+                "max_dpi": optimiser.max_dpi if optimiser else None,
+            }))
+            found = meld_chunked(
+                parent, key_file, folders, folder_bytes, index_folders, show_student_names,
+                chunk_size or DEFAULT_CHUNK_SIZE, memory_limit_mb, TARGET_WIDTH, status_widget, cache, optimiser,
+                journal, quarantined,
+            )
+        elif parallel:
+            mode = f"Parallel ({workers} workers)"
+            if is_zip:
+                jobs = [(f, [info.filename for info in members]) for f, members in folders]
+            else:
+                jobs = folders
+            found = meld_parallel(
+                parent, key_file, jobs, folder if is_zip else None, show_student_names, workers,
+                TARGET_WIDTH, status_widget, cache, optimiser, quarantined,
+            )
+        else:
+            # Parse every submission once; all later stages read from the index
+            index = index_folders(folders)
+            mode = "Incremental" if incremental else "Single-pass" if single_pass else "Three-pass"
+            if not index:
+                found = False
+            elif incremental:
+                found = meld_append(
+                    melded_pdf, key_file, index, show_student_names, TARGET_WIDTH, status_widget, cache, optimiser,
+                    quarantined,
+                )
+            elif single_pass:
+                found = meld_single_pass(
+                    parent, key_file, index, show_student_names, TARGET_WIDTH, status_widget, cache, optimiser,
+                    quarantined,
+                )
+            else:
+                merge_pdfs(parent, key_file, index, status_widget)
+                scale_pdf_to_width(melded_pdf, TARGET_WIDTH, status_widget)
+                annotate_pdf(melded_pdf, index, show_student_names, status_widget)
+                found = True
+        run["mode"] = mode
+        if not found:
+            write_quarantine_file(parent / QUARANTINE_FILE_NAME, quarantined)
+            log(nothing_melded_message(quarantined), status_widget)
+            return False
+        if not incremental:
+            stale = stale_shard_folders(parent, min(shards, len(folders)) if sharded else 0)
+            if stale:
+                names = ", ".join(path.name for path in stale)
+                log(f"⚠️ {names}: left from an earlier meld and not updated; delete before marking.", status_widget)
 
-    # Operations
-    merge_pdfs(parent, key_file, students, status_widget)
-    scale_pdf_to_width(melded_pdf, 595, status_widget)
-    annotate_pdf(melded_pdf, students, show_student_names, status_widget)
+        # Fewer shards than asked for are melded when there are fewer students
+        for path in outputs[:len(folders)]:
+            if not path.exists():
+                continue
+            add_navigation(path, path.parent / KEY_FILE_NAME, show_student_names, status_widget)
+            if linearize and can_linearize():
+                linearize_melded(path, status_widget)
+        if linearize and not can_linearize():
+            log("⚠️ pikepdf is not installed, so the melded PDF was not linearized.", status_widget)
 
     log(f"✅ Completed: {len(students)} folders processed.", status_widget)
+    write_quarantine_file(parent / QUARANTINE_FILE_NAME, quarantined)
+    if quarantined:
+        log(f"🚫 {len(quarantined)} submission(s) quarantined and left out; see {QUARANTINE_FILE_NAME}.", status_widget)
+    if cache:
+        log(f"♻️ Page cache: {cache.hits} PDF(s) reused, {cache.misses} scaled.", status_widget)
+    if optimiser:
+        if not optimiser.can_downsample:
+            log("⚠️ Pillow is not installed, so images were not downsampled.", status_widget)
+        log(f"🗜️ Optimisation saved {format_bytes(optimiser.total_saved)} in total.", status_widget)
+    log(
+        f"⏱️ {mode} meld took "
+        f"{time.perf_counter() - start:.1f} s, peak memory {format_mb(peak_rss_mb())}.",
+        status_widget,
+    )
+    tracer = current_tracer()
+    if tracer:
+        log(f"⏱️ Stages: {tracer.summary()}", status_widget)
+    return True
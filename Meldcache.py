@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# ================================================================
+# Constants
+# ================================================================
+DEFAULT_CACHE_DIR = Path.home() / ".moodlemeld_cache"
+DEFAULT_CACHE_SIZE_MB = 1024
+CACHE_VERSION = 2  # Bump when the stored page format changes
+STALE_TMP_SECONDS = 3600  # temporary files older than this were left by a crash
+
+
+# ================================================================
+# Page Cache
+# ================================================================
+def content_hash(data: bytes) -> str:
+    """Hash identifying a source PDF by its content, wherever it came from."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class PageCache:
+    """
+    On-disk cache of scaled submission pages, keyed by the source PDF's
+    content hash and the target width.
+
+    Each entry is a PDF holding the scaled pages plus a JSON file with what
+    the submission index records about the source (page count, boxes, ...),
+    so a hit needs neither the source parse nor the rescale. Entries are
+    evicted least-recently-used first once the cache exceeds its size cap.
+
+    Several processes (e.g. parallel meld workers) may use one cache
+    directory at once: each writes under its own temporary name, and an
+    entry that disappears or is replaced meanwhile is just a miss.
+    """
+
+    def __init__(self, directory: Path = DEFAULT_CACHE_DIR, max_mb: float = DEFAULT_CACHE_SIZE_MB) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = int(max_mb * 1024**2)
+        self.hits = 0
+        self.misses = 0
+        self.writable = True  # cleared once storing fails, so a broken cache directory is reported once
+
+    def _key(self, sha256: str, target_width: float) -> str:
+        return f"{sha256}-w{target_width:g}-v{CACHE_VERSION}"
+
+    def _paths(self, key: str):
+        return self.directory / f"{key}.pdf", self.directory / f"{key}.json"
+
+    def get(self, sha256: str, target_width: float) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached metadata (with the scaled PDF path under "pdf" and
+        its contents under "pdf_bytes") or None. The PDF is read here, so an
+        entry evicted by another process is a miss, not a missing file later.
+        A hit marks the entry as recently used.
+        """
+        pdf_path, meta_path = self._paths(self._key(sha256, target_width))
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            meta["pdf_bytes"] = pdf_path.read_bytes()
+            os.utime(pdf_path)
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        meta["pdf"] = pdf_path
+        return meta
+
+    def has(self, sha256: str, target_width: float) -> bool:
+        """Whether there is an entry, without counting a hit or miss or marking it used."""
+        pdf_path, meta_path = self._paths(self._key(sha256, target_width))
+        return pdf_path.exists() and meta_path.exists()
+
+    def put(self, sha256: str, target_width: float, pdf_bytes: bytes, meta: Dict[str, Any]) -> None:
+        """Store scaled pages and their metadata, then enforce the size cap."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        pdf_path, meta_path = self._paths(self._key(sha256, target_width))
+
+        # Write to unique temporary names first so a crash never leaves half an
+        # entry and processes storing the same entry never share a file
+        for path, content in ((pdf_path, pdf_bytes), (meta_path, json.dumps(meta).encode("utf-8"))):
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as tmp:
+                tmp.write(content)
+            try:
+                os.replace(tmp.name, path)
+            except OSError:  # e.g. another process has the entry open on Windows; it stores the same pages
+                _unlink(Path(tmp.name))
+                return
+
+        self.evict()
+
+    def evict(self) -> int:
+        """Delete least-recently-used entries until under the size cap. Returns entries removed."""
+        entries = []
+        total = 0
+        for tmp_path in self.directory.glob("*.tmp"):
+            try:
+                if time.time() - tmp_path.stat().st_mtime > STALE_TMP_SECONDS:
+                    _unlink(tmp_path)
+            except OSError:
+                pass
+        for pdf_path in self.directory.glob("*.pdf"):
+            meta_path = pdf_path.with_suffix(".json")
+            try:
+                size = pdf_path.stat().st_size + meta_path.stat().st_size
+                used = pdf_path.stat().st_mtime
+            except OSError:
+                continue
+            entries.append((used, size, pdf_path, meta_path))
+            total += size
+
+        removed = 0
+        for used, size, pdf_path, meta_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in (meta_path, pdf_path):
+                _unlink(path)
+            total -= size
+            removed += 1
+        return removed
+
+
+def _unlink(path: Path) -> None:
+    """Remove a file that another process may already have removed."""
+    try:
+        path.unlink()
+    except OSError:
+        pass
@@ -0,0 +1,257 @@
+"""
+Headless command-line interface for MoodleMeld.
+
+    python -m Meldcli meld "Module A.zip" "Module B" --names --overwrite
+    python -m Meldcli unmeld "Module A/melded_PDF.pdf" --initials MKR --zip
+    python -m Meldcli meld "Module A.zip" --shards 4
+    python -m Meldcli unmeld "Shard 1/melded_PDF.pdf" "Shard 2/melded_PDF.pdf" --shards
+    python -m Meldcli --trace meld.json --trace-format chrome --profile meld "Module A.zip"
+
+Several inputs are processed concurrently. Progress is written to stdout as
+JSON lines, one event per line. tkinter is never imported.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from Meld import meld, MELDED_FILE_NAME
+from Meldcache import PageCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE_MB
+from Meldoptimise import PdfOptimiser, DEFAULT_MAX_DPI
+from Unmeld import unmeld
+from Meldlogging import JobStatus, peak_rss_mb
+from Meldtrace import Tracer, tracing, TRACE_FORMATS
+
+# ================================================================
+# JSON-lines Progress
+# ================================================================
+_stdout_lock = threading.Lock()
+PROBLEM_MARKS = ("❌", "🚫", "⚠️")  # log messages that can explain a failed job
+
+
+def emit(job: str, event: str, **fields: Any) -> None:
+    """Write one JSON event line to stdout."""
+    record = {"time": round(time.time(), 3), "job": job, "event": event, **fields}
+    with _stdout_lock:
+        sys.stdout.write(json.dumps(record) + "\n")
+        sys.stdout.flush()
+
+
+class JsonLinesStatus(JobStatus):
+    """Job status that turns log messages and progress into JSON-line events."""
+
+    def __init__(self, job: str) -> None:
+        super().__init__()
+        self.job = job
+        self._last = (-1, "")  # percentage and phase last emitted
+        self.last_problem = ""  # last error or warning logged, to explain a failed job
+
+    def put(self, message: str) -> None:
+        message = message.strip()
+        if message.startswith(PROBLEM_MARKS):
+            self.last_problem = message
+        emit(self.job, "log", message=message)
+
+    def set_progress(self, done: int, total: int, phase: str = "") -> None:
+        super().set_progress(done, total, phase)
+        # Only emit when the whole-number percentage (or the phase) moves, not on every page
+        percent = 100 * done // total if total else 0
+        if (percent, phase) != self._last:
+            self._last = (percent, phase)
+            emit(self.job, "progress", phase=phase, done=done, total=total, percent=percent)
+
+
+# ================================================================
+# Jobs
+# ================================================================
+TraceOptions = Tuple[Path, bool, bool]  # trace file, Chrome format, cProfile
+
+
+def run_job(
+    job: str, operation: Callable[..., bool], kwargs: Dict[str, Any], trace: Optional[TraceOptions] = None
+) -> bool:
+    """
+    Run one meld/unmeld with start/finish timing events. Returns success:
+    a job that raises, or returns False (having logged why), ends with an
+    "error" event instead of "finish".
+    With trace options, the run is traced (and profiled if asked) and the
+    trace is written even if the job fails.
+    """
+    status = JsonLinesStatus(job)
+    emit(job, "start")
+    start = time.perf_counter()
+    tracer = Tracer(profile=trace[2]) if trace else None
+    try:
+        with tracing(tracer):
+            ok = operation(status_widget=status, **kwargs)
+    except Exception as e:
+        emit(job, "error", error=f"{type(e).__name__}: {e}", seconds=round(time.perf_counter() - start, 3))
+        return False
+    finally:
+        if tracer:
+            written = tracer.write(trace[0], chrome=trace[1])
+            emit(job, "trace", files=[str(path) for path in written])
+
+    if not ok:
+        emit(job, "error", error=status.last_problem or "failed", seconds=round(time.perf_counter() - start, 3))
+        return False
+    emit(
+        job,
+        "finish",
+        seconds=round(time.perf_counter() - start, 3),
+        peak_rss_mb=peak_rss_mb(),
+    )
+    return True
+
+
+def run_jobs(jobs: List[tuple], concurrency: int) -> bool:
+    """Run (job, operation, kwargs, trace) tuples, several at once if requested."""
+    if concurrency <= 1 or len(jobs) <= 1:
+        return all([run_job(*job) for job in jobs])
+
+    with ProcessPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_job, *job) for job in jobs]
+        return all([future.result() for future in futures])
+
+
+def add_trace_options(jobs: List[tuple], args: argparse.Namespace) -> List[tuple]:
+    """
+    Give each job its trace file: --trace as given for a single job, numbered
+    (meld-1.json, meld-2.json, ...) when there are several.
+    """
+    if not args.trace:
+        return [(*job, None) for job in jobs]
+    path = Path(args.trace)
+    chrome = args.trace_format == "chrome"
+    if len(jobs) == 1:
+        return [(*jobs[0], (path, chrome, args.profile))]
+    return [
+        (*job, (path.with_name(f"{path.stem}-{n}{path.suffix}"), chrome, args.profile))
+        for n, job in enumerate(jobs, start=1)
+    ]
+
+
+def meld_jobs(args: argparse.Namespace) -> List[tuple]:
+    """One meld job per input, refusing inputs that would share an output file."""
+    jobs, outputs = [], {}
+    for source in args.inputs:
+        output = (Path(source).resolve().parent / MELDED_FILE_NAME)
+        if output in outputs:
+            emit(source, "error", error=f"Writes the same {output} as {outputs[output]}")
+            continue
+        outputs[output] = source
+        kwargs = {
+            "folder": source,
+            "show_student_names": args.names,
+            "confirm_overwrite": _allow_overwrite if args.overwrite else _refuse_overwrite,
+            "cache": PageCache(args.cache_dir, args.cache_mb) if args.cache else None,
+            "incremental": args.incremental,
+            "chunk_size": args.chunk_size,
+            "memory_limit_mb": args.memory_limit_mb,
+            "optimiser": PdfOptimiser(args.max_dpi) if args.optimise else None,
+            "workers": args.workers,
+            "shards": args.shards,
+            "linearize": args.linearize,
+            "resumable": args.resumable,
+        }
+        jobs.append((source, meld, kwargs))
+    return jobs
+
+
+def unmeld_jobs(args: argparse.Namespace) -> List[tuple]:
+    """One unmeld job per melded PDF, or a single job for all of them with --shards."""
+    sources = [args.inputs] if args.shards else args.inputs
+    return [
+        (
+            " + ".join(source) if args.shards else source,
+            unmeld,
+            {
+                "pdf_to_unmeld": source,
+                "initials": args.initials,
+                "zip_unmelded_folder": args.zip,
+                "workers": args.workers,
+                "restore_size": args.restore_size,
+                "students": args.students,
+                "pattern": args.match,
+                "zip_only": args.zip_only,
+                "graft_from": args.graft_from,
+            },
+        )
+        for source in sources
+    ]
+
+
+def _allow_overwrite(_: Path) -> bool:
+    return True
+
+
+def _refuse_overwrite(path: Path) -> bool:
+    raise FileExistsError(f"{path} already exists; use --overwrite to replace it")
+
+
+# ================================================================
+# Command line
+# ================================================================
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m Meldcli", description="Meld and unmeld Moodle submissions.")
+    parser.add_argument("--jobs", type=int, default=1, help="inputs processed at the same time (default 1)")
+    parser.add_argument("--trace", type=Path, help="write a timing trace of each job to this JSON file")
+    parser.add_argument("--trace-format", choices=TRACE_FORMATS, default="json",
+                        help="span list, or Chrome trace format for chrome://tracing and Perfetto")
+    parser.add_argument("--profile", action="store_true", help="also write cProfile stats next to the trace (.prof)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    meld_parser = commands.add_parser("meld", help="merge Moodle download folders or ZIPs")
+    meld_parser.add_argument("inputs", nargs="+", help="download folders or ZIP files")
+    meld_parser.add_argument("--names", action="store_true", help="show student names as well as IDs")
+    meld_parser.add_argument("--overwrite", action="store_true", help="replace an existing melded_PDF.pdf")
+    meld_parser.add_argument("--incremental", action="store_true", help="only append students missing from key_file.csv")
+    meld_parser.add_argument("--cache", action="store_true", help="reuse scaled pages of unchanged PDFs from earlier melds")
+    meld_parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR, help="page cache location")
+    meld_parser.add_argument("--cache-mb", type=float, default=DEFAULT_CACHE_SIZE_MB, help="page cache size cap in MB")
+    meld_parser.add_argument("--chunk-size", type=int, help="meld this many students at a time, in bounded memory")
+    meld_parser.add_argument("--memory-limit-mb", type=float, help="memory ceiling for a chunked meld; stops if exceeded")
+    meld_parser.add_argument("--optimise", action="store_true", help="downsample large images, compress and deduplicate")
+    meld_parser.add_argument("--max-dpi", type=float, default=DEFAULT_MAX_DPI, help="image resolution kept by --optimise")
+    meld_parser.add_argument("--workers", type=int, default=1, help="processes preparing student folders per input")
+    meld_parser.add_argument("--shards", type=int, default=1, help="split the cohort into this many melded PDFs "
+                             "of about equal page count (Shard 1, Shard 2, ...)")
+    meld_parser.add_argument("--linearize", action="store_true", help="linearize the melded PDF for fast opening "
+                             "(needs pikepdf)")
+    meld_parser.add_argument("--resumable", action="store_true", help="journal the meld so a rerun carries on where it "
+                             "stopped (melds in chunks)")
+
+    unmeld_parser = commands.add_parser("unmeld", help="split marked PDFs back into student files")
+    unmeld_parser.add_argument("inputs", nargs="+", help="marked melded PDFs (next to their key_file.csv)")
+    unmeld_parser.add_argument("--initials", default="", help="marker initials added to each file")
+    unmeld_parser.add_argument("--zip", action="store_true", help="also zip the Unmelded folder")
+    unmeld_parser.add_argument("--zip-only", action="store_true", help="write Unmelded.zip without the Unmelded folder")
+    unmeld_parser.add_argument("--workers", type=int, default=1, help="processes writing student files per input")
+    unmeld_parser.add_argument("--restore-size", action="store_true", help="give pages back their size before melding")
+    unmeld_parser.add_argument("--students", nargs="+", default=[], help="only unmeld these student IDs or folder names")
+    unmeld_parser.add_argument("--match", help="only unmeld students whose name, ID or folder matches this regex")
+    unmeld_parser.add_argument("--graft-from", help="download folder or ZIP that was melded: add the marking to "
+                               "the original files and skip unmarked students")
+    unmeld_parser.add_argument("--shards", action="store_true", help="the inputs are shards of one meld: unmeld "
+                               "them together into one Unmelded folder")
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    jobs = meld_jobs(args) if args.command == "meld" else unmeld_jobs(args)
+    if args.profile and not args.trace:
+        args.trace = Path(f"{args.command}_trace.json")
+    jobs = add_trace_options(jobs, args)
+    expected = 1 if args.command == "unmeld" and args.shards else len(args.inputs)
+    ok = run_jobs(jobs, args.jobs) and len(jobs) == expected
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from Meldcache import PageCache, content_hash
+
+try:
+    from PIL import Image, ImageOps, ImageSequence
+except ImportError:  # Pillow is optional; without it image submissions are not melded
+    Image = None
+
+# ================================================================
+# Constants
+# ================================================================
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp")
+IMAGE_JPEG_QUALITY = 90      # photos are stored as JPEG in the converted PDF
+PDF_IMAGE_MODES = ("1", "L", "RGB", "CMYK")
+PREFETCH_PER_WORKER = 2      # images read and converting ahead of indexing, per worker
+
+
+# ================================================================
+# Image Conversion
+# ================================================================
+def is_image(name: str) -> bool:
+    """Whether a submitted file is an image that can be melded as pages."""
+    return name.lower().endswith(IMAGE_SUFFIXES)
+
+
+def can_convert_images() -> bool:
+    return Image is not None
+
+
+def image_page_count(data: bytes) -> int:
+    """Pages an image becomes: one per frame (a multi-page TIFF scan has several)."""
+    with Image.open(BytesIO(data)) as image:
+        return getattr(image, "n_frames", 1)
+
+
+def _flatten(image: "Image.Image") -> "Image.Image":
+    """An image in a mode a PDF can hold, with any transparency on white."""
+    if image.mode in PDF_IMAGE_MODES:
+        return image
+    rgba = image.convert("RGBA")
+    flat = Image.new("RGB", rgba.size, "white")
+    flat.paste(rgba, mask=rgba.getchannel("A"))
+    return flat
+
+
+def image_to_pdf(data: bytes, target_width: float, quality: int = IMAGE_JPEG_QUALITY) -> bytes:
+    """
+    Convert an image submission to a PDF with one page per frame (a
+    multi-page TIFF scan gives several), target_width points wide. Phone
+    photos are turned upright from their EXIF orientation first.
+    """
+    with Image.open(BytesIO(data)) as image:
+        frames = [_flatten(ImageOps.exif_transpose(frame.copy())) for frame in ImageSequence.Iterator(image)]
+
+    first = frames[0]
+    buffer = BytesIO()
+    first.save(
+        buffer, "PDF",
+        resolution=first.width * 72 / target_width,
+        save_all=True, append_images=frames[1:], quality=quality,
+    )
+    return buffer.getvalue()
+
+
+class ImageConverter:
+    """
+    Converts image submissions to PDFs (see image_to_pdf) in a process pool.
+
+    prefetch() queues the images about to be indexed, in indexing order.
+    Up to PREFETCH_PER_WORKER per worker are read and converting ahead at
+    any time, so a photo-heavy cohort uses every worker while memory stays
+    bounded. take() then hands each image's bytes (read once) and its PDF
+    to indexing and starts on the next image. Images the page cache already
+    holds are never converted ahead. With one worker nothing is prefetched
+    and no pool is started.
+    """
+
+    def __init__(self, target_width: float, workers: int = 1) -> None:
+        self.target_width = target_width
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._queue: Iterator[Tuple[Any, Callable[[], bytes]]] = iter(())
+        self._cache: Optional[PageCache] = None
+        self._ahead: Dict[Any, Tuple[bytes, Optional[Future]]] = {}  # key -> (image, conversion or None if cached)
+
+    def prefetch(self, reads: Iterable[Tuple[Any, Callable[[], bytes]]], cache: Optional[PageCache] = None) -> None:
+        """Queue the images read by each (key, read), replacing any earlier queue, and start on the first few."""
+        if self.workers <= 1 or not can_convert_images():
+            return
+        self._ahead.clear()
+        self._queue = iter(reads)
+        self._cache = cache
+        self._fill()
+
+    def _fill(self) -> None:
+        while len(self._ahead) < self.workers * PREFETCH_PER_WORKER:
+            key, read = next(self._queue, (None, None))
+            if read is None:
+                return
+            try:
+                data = read()
+            except Exception:
+                continue  # indexing reads it again and reports the problem
+            future = None
+            if not (self._cache and self._cache.has(content_hash(data), self.target_width)):
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                future = self._pool.submit(image_to_pdf, data, self.target_width)
+            self._ahead[key] = (data, future)
+
+    def take(self, key: Any, read: Callable[[], bytes]) -> Tuple[bytes, Callable[[], bytes]]:
+        """
+        The image queued as `key` (or read with read() if it was not) and a
+        function returning it as a PDF: the prefetched conversion, or one
+        done there and then. Only call that if the page cache misses.
+        """
+        data, future = self._ahead.pop(key, None) or (read(), None)
+        self._fill()
+        if future is not None:
+            return data, future.result
+        return data, lambda: image_to_pdf(data, self.target_width)
+
+    def close(self) -> None:
+        """Stop the pool, dropping conversions nobody asked for."""
+        self._queue = iter(())
+        self._ahead.clear()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def __enter__(self) -> "ImageConverter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
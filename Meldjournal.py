@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List
+
+# ================================================================
+# Constants
+# ================================================================
+MELD_JOURNAL_NAME = "meld_journal.jsonl"
+UNMELD_JOURNAL_NAME = "unmeld_journal.jsonl"
+QUARANTINE_FILE_NAME = "quarantine.csv"
+JOURNAL_VERSION = 1  # Bump when what is recorded changes
+
+
+# ================================================================
+# Job Journal
+# ================================================================
+class Journal:
+    """
+    Append-only record of a long meld or unmeld, kept next to key_file.csv,
+    so a run that stops part-way (crash, locked file, laptop put to sleep)
+    can be resumed by running the same job again.
+
+    The first line holds the job's settings; each later line is one record
+    of work finished (a checkpoint). Every line is flushed to disk as it is
+    written, so at most a torn last line is lost, and that is ignored. An
+    earlier journal is only resumed if its settings match; otherwise the
+    job starts afresh. finish() deletes the journal once the job is done.
+    """
+
+    def __init__(self, path: Path, settings: Dict[str, Any]) -> None:
+        self.path = Path(path)
+        self.settings = {"version": JOURNAL_VERSION, **settings}
+        self.records: List[Dict[str, Any]] = self._read_earlier()
+        self.resumed = bool(self.records)
+        if self.resumed:
+            self._file = self.path.open("a", encoding="utf-8")
+        else:
+            self._start()
+
+    def _start(self) -> None:
+        self._file = self.path.open("w", encoding="utf-8")
+        self._write(self.settings)
+
+    def _read_earlier(self) -> List[Dict[str, Any]]:
+        try:
+            lines = self.path.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break  # torn last line from a crash
+        if not records or records[0] != json.loads(json.dumps(self.settings)):
+            return []
+        return records[1:]
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, kind: str, **data: Any) -> None:
+        """Add a record of finished work."""
+        entry = {"kind": kind, **data}
+        self._write(entry)
+        self.records.append(entry)
+
+    def of_kind(self, kind: str) -> List[Dict[str, Any]]:
+        """Records of one kind, from this run and the run being resumed, in order."""
+        return [entry for entry in self.records if entry.get("kind") == kind]
+
+    def restart(self) -> None:
+        """Forget the earlier run's records (e.g. its partial output is gone) and start afresh."""
+        self.close()
+        self.records = []
+        self.resumed = False
+        self._start()
+
+    def close(self) -> None:
+        """Stop writing, keeping the journal so the job can be resumed."""
+        if not self._file.closed:
+            self._file.close()
+
+    def finish(self) -> None:
+        """The job is done: nothing is left to resume."""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+# ================================================================
+# Quarantine
+# ================================================================
+@dataclass
+class QuarantinedPdf:
+    """A submission left out of a job because it could not be processed."""
+    folder: str
+    file: str
+    reason: str
+
+    def message(self) -> str:
+        return f"🚫 Quarantined {self.folder}/{self.file}: {self.reason}"
+
+
+def write_quarantine_file(path: Path, quarantined: List[QuarantinedPdf]) -> None:
+    """List the quarantined submissions (folder, file, reason) in a CSV file, or remove an old one."""
+    if not quarantined:
+        Path(path).unlink(missing_ok=True)
+        return
+    with Path(path).open("w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        for item in quarantined:
+            writer.writerow([item.folder, item.file, item.reason])
+
+
+def failure_reason(error: BaseException) -> str:
+    """One-line description of why a submission failed."""
+    text = str(error).strip().splitlines()
+    return f"{type(error).__name__}: {text[0]}" if text else type(error).__name__
@@ -1,15 +1,189 @@
-from typing import Optional
+import os
+import queue
+import sys
+import threading
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:  # tkinter is only needed by the GUI, never by headless runs
+    import tkinter as tk
+
+# ================================================================
+# Background Job Status
+# ================================================================
+class JobCancelled(Exception):
+    """Raised inside a meld/unmeld job when the user presses Cancel."""
+
+
+class JobStatus(ABC):
+    """
+    Where a running job sends its log messages and progress counters, in
+    place of a status widget. Subclasses decide what happens to messages.
+    Progress is counted per phase ("Reading", "Melding", ...): each phase
+    has its own total, so the counters start again when the phase changes.
+    """
+
+    def __init__(self) -> None:
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._progress = (0, 0, "")
+
+    @abstractmethod
+    def put(self, message: str) -> None:
+        """Deliver one log message."""
+
+    def set_progress(self, done: int, total: int, phase: str = "") -> None:
+        with self._lock:
+            self._progress = (done, total, phase)
+
+    @property
+    def progress(self) -> Tuple[int, int, str]:
+        with self._lock:
+            return self._progress
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+
+class StatusQueue(JobStatus):
+    """
+    Thread-safe stand-in for the status widget while a job runs in the
+    background. Jobs log and report progress into it; the GUI drains it on a
+    timer, so the Tk widget is only ever touched from the main thread.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._messages: "queue.Queue[str]" = queue.Queue()
+
+    def put(self, message: str) -> None:
+        self._messages.put(message)
+
+    def drain(self, limit: int) -> List[str]:
+        """Return up to `limit` pending messages without blocking."""
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._messages.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def empty(self) -> bool:
+        return self._messages.empty()
+
+
+class MessageList(JobStatus):
+    """Job status that keeps log messages in a list, e.g. to send them back from a worker process."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.messages: List[str] = []
+
+    def put(self, message: str) -> None:
+        self.messages.append(message)
+
+
+StatusSink = Union["tk.Text", JobStatus]
 
-import tkinter as tk
 
 # ================================================================
 # Logging Helper
 # ================================================================
-def log(message: str, status_widget: Optional[tk.Text] = None) -> None:
-    """Log message to status_widget if provided, else print."""
-    if status_widget:
-        status_widget.insert(tk.END, message + "\n")
-        status_widget.see(tk.END)
+def log(message: str, status_widget: Optional[StatusSink] = None) -> None:
+    """Log message to status_widget (widget or job status) if provided, else print."""
+    if isinstance(status_widget, JobStatus):
+        status_widget.put(message)
+    elif status_widget:
+        status_widget.insert("end", message + "\n")
+        status_widget.see("end")
         status_widget.update_idletasks()
     else:
-        print(message)
\ No newline at end of file
+        print(message)
+
+
+def report_progress(done: int, total: int, status_widget: Optional[StatusSink] = None, phase: str = "") -> None:
+    """Update the progress counters of a background job for the named phase (no-op otherwise)."""
+    if isinstance(status_widget, JobStatus):
+        status_widget.set_progress(done, total, phase)
+
+
+def check_cancelled(status_widget: Optional[StatusSink] = None) -> None:
+    """Raise JobCancelled if the user has cancelled the running job."""
+    if isinstance(status_widget, JobStatus) and status_widget.cancelled:
+        raise JobCancelled()
+
+
+# ================================================================
+# Resource Reporting
+# ================================================================
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process in MB, or None if unavailable."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return _peak_working_set_mb()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    """Resident memory of this process right now in MB, or None if unavailable."""
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm") as statm:
+                resident_pages = int(statm.read().split()[1])
+            return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == "win32":
+        counters = _process_memory_counters()
+        return counters.WorkingSetSize / 1024**2 if counters else None
+    return peak_rss_mb()  # macOS has no cheap current figure; the peak is an upper bound
+
+
+def _peak_working_set_mb() -> Optional[float]:
+    """Peak working set via the Win32 API (the Windows equivalent of peak RSS)."""
+    counters = _process_memory_counters()
+    return counters.PeakWorkingSetSize / 1024**2 if counters else None
+
+
+def _process_memory_counters():
+    """PROCESS_MEMORY_COUNTERS for this process from the Win32 API, or None."""
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return None
+        return counters
+    except Exception:
+        return None
+
+
+def format_mb(value: Optional[float]) -> str:
+    """Format a size in MB for log messages."""
+    return "n/a" if value is None else f"{value:.0f} MB"
@@ -0,0 +1,228 @@
+import hashlib
+from io import BytesIO
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from pypdf import PageObject
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+)
+
+from Meldtrace import span
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it images are left as they are
+    Image = None
+
+# ================================================================
+# Constants
+# ================================================================
+DEFAULT_MAX_DPI = 150        # images sharper than this on the page are downsampled
+JPEG_QUALITY = 75
+MIN_DOWNSAMPLE = 0.9         # ignore images that would shrink by less than 10%
+FINGERPRINT_DEPTH = 8        # how deep font/image objects are compared for duplicates
+
+
+# ================================================================
+# Optimiser
+# ================================================================
+class PdfOptimiser:
+    """
+    Makes scaled submission pages cheaper to store before they are melded.
+
+    - Content streams left uncompressed (e.g. by rescaling) are Flate-compressed.
+    - Images with a higher resolution on the page than max_dpi are
+      downsampled and stored as JPEG (needs Pillow; skipped without it).
+    - Fonts and images identical to ones already seen in an earlier
+      submission are replaced by references to that first copy, so the
+      melded PDF stores them once.
+
+    Objects are changed in place, so the same optimiser must see every
+    submission of one meld in order. Page count and order never change.
+    """
+
+    def __init__(self, max_dpi: float = DEFAULT_MAX_DPI, jpeg_quality: int = JPEG_QUALITY, dedupe: bool = True) -> None:
+        self.max_dpi = max_dpi
+        self.jpeg_quality = jpeg_quality
+        self.dedupe = dedupe
+        self.total_saved = 0
+        self._seen: Dict[str, IndirectObject] = {}   # fingerprint -> first copy
+        self._done: Set[Tuple[int, int]] = set()     # images already downsampled or kept
+        self._merged: Set[Tuple[int, int]] = set()   # duplicates already counted as saved
+
+    @property
+    def can_downsample(self) -> bool:
+        return Image is not None
+
+    def optimise(self, pages: Sequence[PageObject]) -> int:
+        """Optimise one submission's pages in place. Returns the bytes saved."""
+        saved = 0
+        with span("optimise", pages=len(pages)) as counts:
+            for page in pages:
+                saved += self._compress_contents(page)
+                resources = page.get("/Resources")
+                if resources is None:
+                    continue
+                resources = resources.get_object()
+                if self.can_downsample:
+                    saved += self._downsample_images(page, resources)
+                if self.dedupe:
+                    saved += self._dedupe_resources(resources)
+            counts["bytes_saved"] = saved
+        self.total_saved += saved
+        return saved
+
+    def forget(self) -> None:
+        """Stop deduplicating against earlier submissions, releasing their readers."""
+        self._seen.clear()
+        self._done.clear()
+        self._merged.clear()
+
+    # ---- Content streams ----
+    def _compress_contents(self, page: PageObject) -> int:
+        contents = page.get("/Contents")
+        if contents is None:
+            return 0
+        streams = contents.get_object()
+        streams = [s.get_object() for s in streams] if isinstance(streams, ArrayObject) else [streams]
+        if all("/Filter" in stream for stream in streams):
+            return 0
+
+        merged = page.get_contents()
+        if merged is None:
+            return 0
+        before = len(merged.get_data())
+        compressed = merged.flate_encode()
+        page[NameObject("/Contents")] = compressed
+        return max(before - len(compressed._data), 0)
+
+    # ---- Images ----
+    def _downsample_images(self, page: PageObject, resources: DictionaryObject) -> int:
+        xobjects = resources.get("/XObject")
+        if xobjects is None:
+            return 0
+
+        # Conservative DPI estimate: as if each image filled the whole page
+        page_width_in = float(page.mediabox.width) / 72
+        page_height_in = float(page.mediabox.height) / 72
+        saved = 0
+        for name, ref in xobjects.get_object().items():
+            if not isinstance(ref, IndirectObject):
+                continue
+            key = (id(ref.pdf), ref.idnum)
+            image = ref.get_object()
+            if key in self._done or image.get("/Subtype") != "/Image":
+                continue
+            self._done.add(key)
+
+            width, height = int(image["/Width"]), int(image["/Height"])
+            dpi = max(width / page_width_in, height / page_height_in)
+            factor = self.max_dpi / dpi
+            if factor >= MIN_DOWNSAMPLE or not _can_recode(image):
+                continue
+            saved += self._recode_image(page, name, image, factor)
+        return saved
+
+    def _recode_image(self, page: PageObject, name: str, image: StreamObject, factor: float) -> int:
+        try:
+            decoded = page.images[name].image
+        except Exception:  # unsupported filter or colour space: leave it alone
+            return 0
+        if decoded is None or decoded.mode not in ("L", "RGB"):
+            return 0
+
+        size = (max(1, round(decoded.width * factor)), max(1, round(decoded.height * factor)))
+        buffer = BytesIO()
+        decoded.resize(size, Image.LANCZOS).save(buffer, "JPEG", quality=self.jpeg_quality, optimize=True)
+        before = len(image._data)
+        if buffer.tell() >= before:
+            return 0
+
+        # Rewrite the image object itself so every page using it gets the smaller copy
+        image._data = buffer.getvalue()
+        if isinstance(image, EncodedStreamObject):
+            image.decoded_self = None
+        for key in ("/DecodeParms", "/Decode"):
+            if key in image:
+                del image[key]
+        image[NameObject("/Width")] = NumberObject(size[0])
+        image[NameObject("/Height")] = NumberObject(size[1])
+        image[NameObject("/BitsPerComponent")] = NumberObject(8)
+        image[NameObject("/ColorSpace")] = NameObject("/DeviceGray" if decoded.mode == "L" else "/DeviceRGB")
+        image[NameObject("/Filter")] = NameObject("/DCTDecode")
+        return before - len(image._data)
+
+    # ---- Duplicates ----
+    def _dedupe_resources(self, resources: DictionaryObject) -> int:
+        saved = 0
+        for category in ("/Font", "/XObject"):
+            entries = resources.get(category)
+            if entries is None:
+                continue
+            entries = entries.get_object()
+            for name, ref in list(entries.items()):
+                if not isinstance(ref, IndirectObject):
+                    continue
+                target = ref.get_object()
+                if category == "/XObject" and target.get("/Subtype") != "/Image":
+                    continue
+
+                sizes: List[int] = []
+                key = fingerprint(target, sizes)
+                first = self._seen.setdefault(key, ref)
+                if first.pdf is not ref.pdf or first.idnum != ref.idnum:
+                    entries[NameObject(name)] = first
+                    if (id(ref.pdf), ref.idnum) not in self._merged:
+                        self._merged.add((id(ref.pdf), ref.idnum))
+                        saved += sum(sizes)
+        return saved
+
+
+def _can_recode(image: StreamObject) -> bool:
+    """Only plain images are re-encoded: no masks, and not bilevel scans (which compress better as they are)."""
+    if any(key in image for key in ("/SMask", "/Mask", "/ImageMask")):
+        return False
+    return int(image.get("/BitsPerComponent", 8)) == 8
+
+
+def fingerprint(obj: PdfObject, sizes: Optional[List[int]] = None, depth: int = 0) -> str:
+    """
+    A digest identifying an object by value, following references, so equal
+    fonts or images from different files get the same fingerprint. Stream
+    sizes met along the way are appended to `sizes`.
+    """
+    if depth > FINGERPRINT_DEPTH:
+        return "…"
+    if isinstance(obj, IndirectObject):
+        return fingerprint(obj.get_object(), sizes, depth + 1)
+    if isinstance(obj, StreamObject):
+        data = obj._data if isinstance(obj, EncodedStreamObject) else obj.get_data()
+        if sizes is not None:
+            sizes.append(len(data))
+        entries = {k: v for k, v in obj.items() if k != "/Length"}
+        digest = hashlib.sha256(data).hexdigest()
+        return f"S{digest}{fingerprint(DictionaryObject(entries), sizes, depth + 1)}"
+    if isinstance(obj, DictionaryObject):
+        items = "".join(f"{k}:{fingerprint(v, sizes, depth + 1)};" for k, v in sorted(obj.items()))
+        return "<" + hashlib.sha256(items.encode()).hexdigest() + ">"
+    if isinstance(obj, ArrayObject):
+        return "[" + ",".join(fingerprint(item, sizes, depth + 1) for item in obj) + "]"
+    return repr(obj)
+
+
+def format_bytes(count: int) -> str:
+    """Human-readable byte count for log messages."""
+    for unit in ("B", "KB"):
+        if count < 1024:
+            return f"{count:.0f} {unit}"
+        count /= 1024
+    if count < 1024:
+        return f"{count:.1f} MB"
+    return f"{count / 1024:.1f} GB"
@@ -0,0 +1,156 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from Meldlogging import current_rss_mb, peak_rss_mb
+
+# ================================================================
+# Constants
+# ================================================================
+TRACE_FORMATS = ("json", "chrome")
+
+STAGE = "stage"  # one step of the work, usually for one file; stages do not nest
+RUN = "run"      # a whole meld or unmeld
+
+
+# ================================================================
+# Tracer
+# ================================================================
+class Tracer:
+    """
+    Collects timed spans for a meld or unmeld: stages (indexing, scaling,
+    writing, ...), mostly one per file, each with whatever counts it was
+    given (file, pages, bytes read or written) and the memory in use when it
+    ended.
+
+    Spans are kept as Chrome trace "complete" events with wall-clock
+    timestamps, so spans recorded in worker processes can be merged in.
+    With profile=True, cProfile also runs while the tracer is active.
+    """
+
+    def __init__(self, profile: bool = False) -> None:
+        self.events: List[Dict[str, Any]] = []
+        self.profiler = cProfile.Profile() if profile else None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, cat: str = STAGE, **args: Any) -> Iterator[Dict[str, Any]]:
+        """Time the enclosed block. The yielded dict can be filled in with counts as they become known."""
+        start = time.time()
+        try:
+            yield args
+        finally:
+            end = time.time()
+            rss = current_rss_mb()
+            if rss is not None:
+                args["rss_mb"] = round(rss, 1)
+            event = {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": round(start * 1e6),
+                "dur": round((end - start) * 1e6),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def merge(self, events: List[Dict[str, Any]]) -> None:
+        """Add spans recorded by another tracer (e.g. in a worker process)."""
+        with self._lock:
+            self.events.extend(events)
+
+    def stage_totals(self) -> Dict[str, float]:
+        """Seconds spent in each stage, in the order the stages first started."""
+        totals: Dict[str, float] = {}
+        for event in sorted(self.events, key=lambda e: e["ts"]):
+            if event["cat"] == STAGE:
+                totals[event["name"]] = totals.get(event["name"], 0) + event["dur"] / 1e6
+        return totals
+
+    def summary(self) -> str:
+        """One line giving the time per stage, for the log."""
+        return ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.stage_totals().items())
+
+    def to_json(self, chrome: bool = False) -> Dict[str, Any]:
+        """The trace as JSON data: Chrome trace format, or MoodleMeld's own span list."""
+        events = sorted(self.events, key=lambda e: e["ts"])
+        if chrome:
+            return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+        origin = events[0]["ts"] if events else 0
+        return {
+            "spans": [
+                {
+                    "name": e["name"],
+                    "cat": e["cat"],
+                    "start_s": (e["ts"] - origin) / 1e6,
+                    "seconds": e["dur"] / 1e6,
+                    "pid": e["pid"],
+                    **e["args"],
+                }
+                for e in events
+            ],
+            "stage_seconds": self.stage_totals(),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    def write(self, path: Path, chrome: bool = False) -> List[Path]:
+        """
+        Write the trace to path (and, when profiling, the cProfile stats next
+        to it with a .prof suffix). Returns the files written.
+        """
+        path = Path(path)
+        path.write_text(json.dumps(self.to_json(chrome), indent=1), encoding="utf-8")
+        written = [path]
+        if self.profiler:
+            profile_path = path.with_suffix(".prof")
+            self.profiler.dump_stats(str(profile_path))
+            written.append(profile_path)
+        return written
+
+
+# ================================================================
+# Active Tracer
+# ================================================================
+_current: ContextVar[Optional[Tracer]] = ContextVar("moodlemeld_tracer", default=None)
+
+
+@contextmanager
+def tracing(tracer: Optional[Tracer]) -> Iterator[Optional[Tracer]]:
+    """Make `tracer` the one span() records into for the enclosed block (None: no tracing)."""
+    token = _current.set(tracer)
+    if tracer and tracer.profiler:
+        tracer.profiler.enable()
+    try:
+        yield tracer
+    finally:
+        if tracer and tracer.profiler:
+            tracer.profiler.disable()
+        _current.reset(token)
+
+
+def current_tracer() -> Optional[Tracer]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, cat: str = STAGE, **args: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time the enclosed block into the active tracer, if there is one.
+    Without a tracer this only yields the (unused) counts dict.
+    """
+    tracer = _current.get()
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, cat, **args) as counts:
+        yield counts
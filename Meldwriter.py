@@ -0,0 +1,840 @@
+import os
+import re
+import zlib
+from io import BytesIO
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+from pypdf import PdfReader, PageObject
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+    TextStringObject,
+)
+
+try:
+    import pikepdf
+except ImportError:  # pikepdf is optional; without it melded files are not linearized
+    pikepdf = None
+
+# ================================================================
+# Constants
+# ================================================================
+MAX_XREF_TABLE_OFFSET = 10**10  # xref table offsets have 10 digits
+
+
+# ================================================================
+# Object Copier
+# ================================================================
+class ObjectCopier:
+    """
+    Writes PDF objects to a stream as soon as they are added.
+
+    Objects from any number of source readers are renumbered into the output
+    and everything they reference is copied with them (once per source object).
+    Encoded streams are copied as raw bytes, never decoded. Objects of a
+    `keep` reader are referenced, not copied: that is the file an incremental
+    update is appended to. Objects of a reader with a RawObjectSource are
+    copied as bytes, with only their references rewritten, without being parsed.
+    """
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        first_number: int,
+        offset: int = 0,
+        keep: Optional[PdfReader] = None,
+        raw_sources: Sequence["RawObjectSource"] = (),
+    ) -> None:
+        self.stream = stream
+        self.offset = offset  # position of stream's start within the output file
+        self.next_number = first_number
+        self.positions: Dict[Tuple[int, int], int] = {}  # (number, generation) -> file offset
+        self._keep = keep
+        self._numbers: Dict[Tuple[int, int, int], int] = {}
+        self._sources: List[object] = []  # keeps readers alive so their id()s stay unique
+        self._pending: List[Tuple[int, IndirectObject]] = []
+        self._raw = {id(source.reader): source for source in raw_sources}
+
+    def tell(self) -> int:
+        return self.offset + self.stream.tell()
+
+    def reserve(self) -> IndirectObject:
+        """Allocate an object number to be written later."""
+        number = self.next_number
+        self.next_number += 1
+        return IndirectObject(number, 0, None)
+
+    def alias(self, source: IndirectObject, target: IndirectObject) -> None:
+        """Make references to `source` point at `target` in the output."""
+        self._sources.append(source.pdf)
+        self._numbers[(id(source.pdf), source.idnum, source.generation)] = target.idnum
+
+    def copy(self, obj: PdfObject, skip: Sequence[str] = ()) -> PdfObject:
+        """Copy `obj` for the output, queueing every indirect object it references."""
+        if isinstance(obj, IndirectObject):
+            return self._reference(obj)
+        if isinstance(obj, StreamObject):
+            if isinstance(obj, EncodedStreamObject):
+                result: StreamObject = EncodedStreamObject()
+                result._data = obj._data
+            else:
+                result = DecodedStreamObject()
+                result.set_data(obj.get_data())
+            for key, value in obj.items():
+                if key != "/Length":
+                    result[NameObject(key)] = self._copy_value(value)
+            return result
+        if isinstance(obj, DictionaryObject):
+            result_dict = DictionaryObject()
+            for key, value in obj.items():
+                if key not in skip:
+                    result_dict[NameObject(key)] = self._copy_value(value)
+            return result_dict
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy_value(item) for item in obj)
+        return obj
+
+    def _copy_value(self, value: PdfObject) -> PdfObject:
+        # Streams must be indirect objects; pypdf edits (e.g. scaling) leave them direct
+        if isinstance(value, StreamObject):
+            return self.add(value)
+        return self.copy(value)
+
+    def _reference(self, ref: IndirectObject) -> PdfObject:
+        if self._keep is not None and ref.pdf is self._keep:
+            return IndirectObject(ref.idnum, ref.generation, None)
+
+        key = (id(ref.pdf), ref.idnum, ref.generation)
+        if key in self._numbers:
+            return IndirectObject(self._numbers[key], 0, None)
+
+        # Other pages (e.g. link destinations) would drag in their whole page
+        # tree; only pages that were explicitly appended are kept
+        raw = self._raw.get(id(ref.pdf))
+        if raw is not None:
+            if (ref.idnum, ref.generation) in raw.page_tree:
+                return NullObject()
+        else:
+            target = ref.get_object()
+            if isinstance(target, DictionaryObject) and target.get("/Type") in ("/Page", "/Pages"):
+                return NullObject()
+
+        new_ref = self.reserve()
+        self._sources.append(ref.pdf)
+        self._numbers[key] = new_ref.idnum
+        self._pending.append((new_ref.idnum, ref))
+        return new_ref
+
+    def forget_sources(self) -> None:
+        """
+        Drop the mapping from source objects to output numbers, releasing the
+        source readers. Only safe once nothing written later refers to them.
+        """
+        self._numbers.clear()
+        self._sources.clear()
+
+    def write(self, ref: IndirectObject, obj: PdfObject) -> None:
+        """Write an already-copied object under `ref`, then everything it pulled in."""
+        self._write_object(ref.idnum, ref.generation, obj)
+        self._flush()
+
+    def _flush(self) -> None:
+        while self._pending:
+            number, source = self._pending.pop()
+            raw = self._raw.get(id(source.pdf))
+            if raw is None or not self._write_raw(number, raw, source):
+                self._write_object(number, 0, self.copy(source.get_object()))
+
+    def add(self, obj: PdfObject) -> IndirectObject:
+        """Copy and write `obj` as a new indirect object."""
+        ref = self.reserve()
+        self.write(ref, self.copy(obj))
+        return ref
+
+    def _write_object(self, number: int, generation: int, obj: PdfObject) -> None:
+        self.positions[(number, generation)] = self.tell()
+        self.stream.write(f"{number} {generation} obj\n".encode())
+        obj.write_to_stream(self.stream)
+        self.stream.write(b"\nendobj\n")
+
+    def _write_raw(
+        self, number: int, raw: "RawObjectSource", source: IndirectObject, parent: Optional[IndirectObject] = None
+    ) -> bool:
+        """
+        Copy an object's bytes with its references renumbered (and, for a
+        page, its /Parent replaced). False if it must be parsed instead.
+        """
+        parts = raw.read(source.idnum, source.generation)
+        if parts is None:
+            return False
+
+        def renumber(idnum: int, generation: int) -> bytes:
+            new = self._reference(IndirectObject(idnum, generation, source.pdf))
+            return b"%d 0 R" % new.idnum if isinstance(new, IndirectObject) else b"null"
+
+        head, data = parts
+        try:
+            head = rewrite_references(head, renumber)
+        except ValueError:
+            return False
+        if parent is not None:
+            # The old parent is part of the page tree, so it was rewritten to null
+            head, found = _PARENT.subn(b"/Parent %d 0 R" % parent.idnum, head, count=1)
+            if not found:
+                return False
+
+        self.positions[(number, 0)] = self.tell()
+        self.stream.write(b"%d 0 obj\n" % number)
+        self.stream.write(head)
+        if data is not None:
+            self.stream.write(b"stream\n")
+            self.stream.write(data)
+            self.stream.write(b"\nendstream")
+        self.stream.write(b"\nendobj\n")
+        return True
+
+    def append_pages(
+        self,
+        pages: Sequence[Union[PageObject, IndirectObject]],
+        parent: IndirectObject,
+        annotations: Optional[Dict[int, List[DictionaryObject]]] = None,
+    ) -> List[IndirectObject]:
+        """
+        Write `pages` (page objects, or references to them) under the page
+        tree node `parent`, with any extra annotations per page index.
+        Returns the new page references.
+        """
+        sources = [page if isinstance(page, IndirectObject) else page.indirect_reference for page in pages]
+        refs = [self.reserve() for _ in pages]
+        # Alias every page first so links between them survive
+        for source, ref in zip(sources, refs):
+            if source is not None:
+                self.alias(source, ref)
+
+        for idx, (page, source, ref) in enumerate(zip(pages, sources, refs)):
+            extra = (annotations or {}).get(idx, [])
+            raw = self._raw.get(id(source.pdf)) if source is not None else None
+            if not extra and raw is not None and raw.copies_pages:
+                if self._write_raw(ref.idnum, raw, source, parent):
+                    self._flush()
+                    continue
+            if isinstance(page, IndirectObject):
+                page = page.get_object()
+            page_copy = self.copy(page, skip=("/Parent", "/Annots") if extra else ("/Parent",))
+            page_copy[NameObject("/Parent")] = parent
+            if extra:
+                annots = ArrayObject(self.copy(item) for item in page.get("/Annots", ArrayObject()))
+                for annotation in extra:
+                    annotation_copy = self.copy(annotation)
+                    annotation_copy[NameObject("/P")] = ref
+                    annotation_ref = self.reserve()
+                    self.write(annotation_ref, annotation_copy)
+                    annots.append(annotation_ref)
+                page_copy[NameObject("/Annots")] = annots
+            self.write(ref, page_copy)
+        return refs
+
+    def pages_node(self, kids: List[IndirectObject], count: int, parent: Optional[PdfObject] = None) -> DictionaryObject:
+        """A /Pages tree node for `kids` holding `count` pages in total."""
+        node = DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(kids),
+            NameObject("/Count"): NumberObject(count),
+        })
+        if parent is not None:
+            node[NameObject("/Parent")] = parent
+        return node
+
+
+# ================================================================
+# Raw Object Access
+# ================================================================
+_TOKENS = re.compile(
+    rb"(?P<string>\()"                                             # literal string (see _string_end)
+    rb"|<(?!<)[0-9A-Fa-f\s]*>"                                    # hex string
+    rb"|%[^\r\n]*"                                                # comment
+    rb"|(?<![\w.+-])(?P<num>\d+)\s+(?P<gen>\d+)\s+R(?!\w)"        # reference
+    rb"|(?P<end>\bstream(?:\r\n|\n|\r)|\bendobj\b)"               # end of the object's dictionary
+    rb"|(?P<unsure>\)|(?<!<)<(?!<))",                             # stray ) or a malformed hex string
+    re.S,
+)
+_STRING_DELIMITERS = re.compile(rb"[\\()]")
+_OBJECT_HEADER = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj")
+_LENGTH = re.compile(rb"/Length\s+(\d+)(?:\s+(\d+)\s+R)?")
+_PARENT = re.compile(rb"/Parent\s+null\b")
+_TYPE = re.compile(rb"/Type\s*/(Pages|Page)(?!\w)")
+_KIDS = re.compile(rb"/Kids\s*\[([^\]]*)\]")
+_REFERENCE = re.compile(rb"(\d+)\s+(\d+)\s+R")
+INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+_INHERITED = re.compile(rb"/(?:Resources|MediaBox|CropBox|Rotate)(?!\w)")
+_END_STREAM = re.compile(rb"\s*endstream")
+
+
+def _string_end(data, start: int) -> int:
+    """
+    The index just past the literal string opening at data[start], counting
+    balanced parentheses to any depth and skipping escaped characters.
+    Raises ValueError if the string never closes.
+    """
+    depth = 0
+    pos = start
+    while True:
+        delimiter = _STRING_DELIMITERS.search(data, pos)
+        if delimiter is None:
+            raise ValueError("unterminated literal string")
+        char = data[delimiter.start()]
+        if char == 0x5C:  # backslash: the next byte is escaped, whatever it is
+            pos = delimiter.start() + 2
+            continue
+        depth += 1 if char == 0x28 else -1
+        pos = delimiter.end()
+        if depth == 0:
+            return pos
+
+
+def _tokens(data, start: int = 0) -> Iterator[re.Match]:
+    """
+    The references and end-of-object keywords in data from `start`, skipping
+    strings and comments. Raises ValueError where the syntax is not
+    understood, so the caller can parse the object instead.
+    """
+    pos = start
+    while True:
+        token = _TOKENS.search(data, pos)
+        if token is None:
+            return
+        if token.group("unsure"):
+            raise ValueError(f"unexpected {token.group(0)!r} at {token.start()}")
+        if token.group("string"):
+            pos = _string_end(data, token.start())
+            continue
+        pos = token.end()
+        if token.group("num") or token.group("end"):
+            yield token
+
+
+def rewrite_references(head: bytes, renumber) -> bytes:
+    """
+    Replace every `n g R` outside strings and comments with renumber(n, g).
+    Raises ValueError if `head` cannot be tokenized with confidence.
+    """
+    parts = []
+    last = 0
+    for token in _tokens(head):
+        if token.group("end"):
+            raise ValueError(f"{token.group(0)!r} inside an object's dictionary")
+        parts += [head[last:token.start()], renumber(int(token.group("num")), int(token.group("gen")))]
+        last = token.end()
+    parts.append(head[last:])
+    return b"".join(parts)
+
+
+class RawObjectSource:
+    """
+    Byte-level access to the objects of an unencrypted PDF through its
+    cross-reference table, so they can be copied without being parsed.
+
+    `data` is the whole file (e.g. an mmap). Objects that are in object
+    streams, or that do not look as expected, are not available raw; read()
+    returns None and the caller falls back to parsing them. Page dictionaries
+    are only copied raw if none of their attributes are inherited from the
+    page tree. The reader's objects must not have been changed in memory.
+    """
+
+    def __init__(self, reader: PdfReader, data) -> None:
+        self.reader = reader
+        self.data = data
+        free = reader.xref_free_entry
+        self.offsets = {
+            (idnum, generation): offset
+            for generation, entries in reader.xref.items()
+            for idnum, offset in entries.items()
+            if idnum not in reader.xref_objStm and not free.get(generation, {}).get(idnum, False)
+        }
+
+        # The page tree, which must never be followed into from a page's resources
+        self.page_tree: Set[Tuple[int, int]] = set()
+        self.copies_pages = True
+        self.pages = self._walk_page_tree()
+        if self.pages is None:
+            self._flatten_page_tree()
+
+    def _walk_page_tree(self) -> Optional[List[IndirectObject]]:
+        """Page references in order, found from the raw page tree nodes (None if that fails)."""
+        try:
+            pages_ref = self.reader.trailer["/Root"].raw_get("/Pages")
+        except Exception:
+            return None
+        pages: List[IndirectObject] = []
+        stack = [(pages_ref.idnum, pages_ref.generation)]
+        while stack:
+            key = stack.pop()
+            parts = self.read(*key)
+            if key in self.page_tree or parts is None or parts[1] is not None:
+                return None
+            self.page_tree.add(key)
+            head = parts[0]
+            node_type = _TYPE.search(head)
+            if node_type is None:
+                return None
+            if node_type.group(1) == b"Page":
+                pages.append(IndirectObject(key[0], key[1], self.reader))
+                continue
+            kids = _KIDS.search(head)
+            if kids is None:
+                return None
+            if _INHERITED.search(head):
+                self.copies_pages = False
+            refs = [(int(n), int(g)) for n, g in _REFERENCE.findall(kids.group(1))]
+            stack.extend(reversed(refs))
+        return pages
+
+    def _flatten_page_tree(self) -> None:
+        """Fallback: let the reader parse the page tree."""
+        self.page_tree.clear()
+        self.pages = []
+        for page in self.reader.pages:
+            ref = page.indirect_reference
+            self.pages.append(ref)
+            while ref is not None and (ref.idnum, ref.generation) not in self.page_tree:
+                self.page_tree.add((ref.idnum, ref.generation))
+                node = ref.get_object()
+                if node is not page and any(key in node for key in INHERITABLE):
+                    self.copies_pages = False
+                ref = node.raw_get("/Parent") if "/Parent" in node else None
+
+    @classmethod
+    def for_reader(cls, reader: PdfReader, data) -> Optional["RawObjectSource"]:
+        """A raw source for `reader`, or None if its bytes cannot be copied as they are."""
+        if reader.is_encrypted:
+            return None
+        return cls(reader, data)
+
+    def read(self, idnum: int, generation: int) -> Optional[Tuple[bytes, Optional[bytes]]]:
+        """
+        The object's bytes as (dictionary or value, stream data or None),
+        or None if it is not available raw.
+        """
+        offset = self.offsets.get((idnum, generation))
+        if offset is None:
+            return None
+        header = _OBJECT_HEADER.match(self.data, offset)
+        if not header or int(header.group(1)) != idnum:
+            return None
+
+        start = header.end()
+        try:
+            token = next((token for token in _tokens(self.data, start) if token.group("end")), None)
+        except ValueError:
+            return None
+        if token is None:
+            return None
+        head = self.data[start:token.start()]
+        if token.group("end").startswith(b"endobj"):
+            return head, None
+
+        length = self._length(head)
+        if length is None or not _END_STREAM.match(self.data, token.end() + length):
+            return None
+        return head, self.data[token.end():token.end() + length]
+
+    def _length(self, head: bytes) -> Optional[int]:
+        match = _LENGTH.search(head)
+        if not match:
+            return None
+        if match.group(2) is None:
+            return int(match.group(1))
+        try:
+            return int(self.reader.get_object(IndirectObject(int(match.group(1)), int(match.group(2)), self.reader)))
+        except Exception:
+            return None
+
+
+# ================================================================
+# Cross-reference sections
+# ================================================================
+def _subsections(numbers: List[int]) -> List[Tuple[int, int]]:
+    """Group sorted object numbers into (first, count) runs."""
+    runs: List[Tuple[int, int]] = []
+    for number in numbers:
+        if runs and runs[-1][0] + runs[-1][1] == number:
+            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+        else:
+            runs.append((number, 1))
+    return runs
+
+
+def write_xref_table(copier: ObjectCopier, trailer: DictionaryObject) -> None:
+    """
+    Write a classic xref table for the copier's objects, then the trailer.
+    Every table, an incremental update's too, starts with the free entry
+    for object 0, as strict readers expect.
+    """
+    xref_position = copier.tell()
+    entries = {number: (position, generation) for (number, generation), position in copier.positions.items()}
+    entries[0] = (0, 65535)
+    if xref_position >= MAX_XREF_TABLE_OFFSET:
+        raise ValueError(
+            f"The PDF is too large ({xref_position:,} bytes) for a cross-reference table, "
+            f"which can only address {MAX_XREF_TABLE_OFFSET:,} bytes."
+        )
+    stream = copier.stream
+
+    stream.write(b"xref\n")
+    for first, count in _subsections(sorted(entries)):
+        stream.write(f"{first} {count}\n".encode())
+        for number in range(first, first + count):
+            position, generation = entries[number]
+            kind = "f" if number == 0 else "n"
+            stream.write(f"{position:010d} {generation:05d} {kind}\r\n".encode())
+
+    trailer[NameObject("/Size")] = NumberObject(copier.next_number)
+    stream.write(b"trailer\n")
+    trailer.write_to_stream(stream)
+    stream.write(f"\nstartxref\n{xref_position}\n%%EOF\n".encode())
+
+
+def write_xref_stream(copier: ObjectCopier, trailer: DictionaryObject) -> None:
+    """Write a cross-reference stream (with the trailer entries) for the copier's objects."""
+    xref_ref = copier.reserve()
+    xref_position = copier.tell()
+    entries = {number: (position, generation) for (number, generation), position in copier.positions.items()}
+    entries[xref_ref.idnum] = (xref_position, 0)
+
+    numbers = sorted(entries)
+    # Offsets take 4 bytes unless the file has grown past 4 GiB
+    width = max(4, (max(position for position, _ in entries.values()).bit_length() + 7) // 8)
+    rows = b"".join(
+        b"\x01" + entries[n][0].to_bytes(width, "big") + entries[n][1].to_bytes(2, "big") for n in numbers
+    )
+    xref = EncodedStreamObject()
+    xref._data = zlib.compress(rows)
+    for key, value in trailer.items():
+        xref[NameObject(key)] = value
+    xref[NameObject("/Type")] = NameObject("/XRef")
+    xref[NameObject("/Size")] = NumberObject(copier.next_number)
+    xref[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)])
+    xref[NameObject("/Index")] = ArrayObject(
+        NumberObject(v) for run in _subsections(numbers) for v in run
+    )
+    xref[NameObject("/Filter")] = NameObject("/FlateDecode")
+
+    copier.stream.write(f"{xref_ref.idnum} 0 obj\n".encode())
+    xref.write_to_stream(copier.stream)
+    copier.stream.write(f"\nendobj\nstartxref\n{xref_position}\n%%EOF\n".encode())
+
+
+# ================================================================
+# Streaming Output
+# ================================================================
+class StreamingPdfWriter:
+    """
+    Writes a new PDF file front to back while pages are added.
+
+    Each batch of pages becomes its own page tree node and is written
+    straight to the file, after which its source readers can be released,
+    so memory use depends on the largest batch rather than the whole output.
+    The root page tree, catalog and xref table are written by finish().
+    """
+
+    HEADER = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+
+    def __init__(self, stream: BinaryIO, raw_sources: Sequence[RawObjectSource] = ()) -> None:
+        # `stream` must be positioned at the start of the new file
+        stream.write(self.HEADER)
+        self.copier = ObjectCopier(stream, 1, raw_sources=raw_sources)
+        self.root_ref = self.copier.reserve()
+        self.pages_ref = self.copier.reserve()
+        self.nodes: List[IndirectObject] = []
+        self.page_count = 0
+        self._checkpointed = 0  # objects already included in a checkpoint
+
+    def checkpoint(self) -> Dict[str, Any]:
+        """
+        What resume() needs to carry on from here: the file offset, the next
+        object number, the page tree so far, and the objects written since
+        the previous checkpoint. Only meaningful between batches.
+        """
+        copier = self.copier
+        positions = list(copier.positions.items())[self._checkpointed:]
+        self._checkpointed += len(positions)
+        return {
+            "offset": copier.tell(),
+            "next_number": copier.next_number,
+            "root": self.root_ref.idnum,
+            "pages": self.pages_ref.idnum,
+            "nodes": [node.idnum for node in self.nodes],
+            "page_count": self.page_count,
+            "positions": [[number, generation, position] for (number, generation), position in positions],
+        }
+
+    @classmethod
+    def resume(
+        cls, stream: BinaryIO, checkpoints: Sequence[Dict[str, Any]], raw_sources: Sequence[RawObjectSource] = ()
+    ) -> "StreamingPdfWriter":
+        """
+        A writer carrying on from the last of `checkpoints` (all of them, in
+        order), in the partly written file `stream` (opened for reading and
+        writing). Anything written after that checkpoint is truncated away.
+        """
+        last = checkpoints[-1]
+        stream.seek(last["offset"])
+        stream.truncate()
+
+        writer = cls.__new__(cls)
+        writer.copier = ObjectCopier(stream, last["next_number"], raw_sources=raw_sources)
+        for checkpoint in checkpoints:
+            for number, generation, position in checkpoint["positions"]:
+                writer.copier.positions[(number, generation)] = position
+        writer.root_ref = IndirectObject(last["root"], 0, None)
+        writer.pages_ref = IndirectObject(last["pages"], 0, None)
+        writer.nodes = [IndirectObject(number, 0, None) for number in last["nodes"]]
+        writer.page_count = last["page_count"]
+        writer._checkpointed = len(writer.copier.positions)
+        return writer
+
+    def append_batch(
+        self, batches: Sequence[Tuple[Sequence[Union[PageObject, IndirectObject]], Dict[int, List[DictionaryObject]]]]
+    ) -> None:
+        """
+        Write one page tree node holding each (pages, annotations) pair in
+        order, then forget the sources so their readers can be freed.
+        """
+        copier = self.copier
+        node_ref = copier.reserve()
+        kids: List[IndirectObject] = []
+        count = 0
+        for pages, annotations in batches:
+            kids.extend(copier.append_pages(pages, node_ref, annotations))
+            count += len(pages)
+        copier.write(node_ref, copier.pages_node(kids, count, self.pages_ref))
+        copier.forget_sources()
+
+        self.nodes.append(node_ref)
+        self.page_count += count
+
+    def finish(self) -> None:
+        """
+        Write the root page tree, the catalog and the xref table (an xref
+        stream if the file is too large for a table).
+        """
+        copier = self.copier
+        copier.write(self.pages_ref, copier.pages_node(self.nodes, self.page_count))
+        copier.write(self.root_ref, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): self.pages_ref,
+        }))
+        trailer = DictionaryObject({NameObject("/Root"): self.root_ref})
+        if copier.tell() < MAX_XREF_TABLE_OFFSET:
+            write_xref_table(copier, trailer)
+        else:
+            write_xref_stream(copier, trailer)
+
+
+# ================================================================
+# Incremental Update
+# ================================================================
+def last_startxref(data_tail: bytes) -> int:
+    """Offset of the last cross-reference section, from the end of a PDF file."""
+    matches = re.findall(rb"startxref\s+(\d+)", data_tail)
+    if not matches:
+        raise ValueError("No startxref found; not a complete PDF file.")
+    return int(matches[-1])
+
+
+class Bookmark(NamedTuple):
+    """An outline entry at `page` (from 0); the pages from there on are labelled `label` 1, 2, ..."""
+    title: str
+    page: int
+    label: str
+
+
+class IncrementalAppender:
+    """
+    Builds an incremental update that appends pages (or annotations on
+    existing pages) to an existing PDF.
+
+    The original file is never rewritten: only new objects, new versions of
+    the pages and page tree nodes that changed and a cross-reference section
+    are produced, so the cost depends on what is added, not on the size of
+    the file.
+    """
+
+    def __init__(self, pdf: Union[Path, BinaryIO]) -> None:
+        # A path is opened as a file (not read into memory) so only the parts needed are loaded;
+        # an open file (e.g. a BytesIO) is used as it is and closed with the appender
+        self._file = pdf if hasattr(pdf, "read") else open(pdf, "rb")
+        try:
+            self.reader = PdfReader(self._file)
+            if self.reader.is_encrypted:
+                raise ValueError("Encrypted PDFs cannot be appended to incrementally.")
+
+            file_size = self._file.seek(0, os.SEEK_END)
+            self._file.seek(max(file_size - 1024, 0))
+            self.prev_xref = last_startxref(self._file.read())
+            self._file.seek(self.prev_xref)
+            self.xref_is_stream = not self._file.read(4).startswith(b"xref")
+        except Exception:
+            self._file.close()
+            raise
+
+        self.buffer = BytesIO()
+        self.buffer.write(b"\n")
+        self.copier = ObjectCopier(self.buffer, int(self.reader.trailer["/Size"]), offset=file_size, keep=self.reader)
+        self.pages_ref = self.reader.trailer["/Root"].raw_get("/Pages")
+        self.node_ref: Optional[IndirectObject] = None  # new page tree node holding all appended pages
+        self.kids: List[IndirectObject] = []
+        self.page_count = 0
+
+    def append_pages(
+        self, pages: Sequence[PageObject], annotations: Optional[Dict[int, List[DictionaryObject]]] = None
+    ) -> None:
+        if self.node_ref is None:
+            self.node_ref = self.copier.reserve()
+        self.kids.extend(self.copier.append_pages(pages, self.node_ref, annotations))
+        self.page_count += len(pages)
+
+    def add_annotations(
+        self, page_number: int, annotations: Sequence[PdfObject], contents: Optional[Sequence[DictionaryObject]] = None
+    ) -> None:
+        """
+        Add annotations (references to them, or direct dictionaries, usually
+        from another PDF) to an existing page, by writing a new version of
+        the page. References between them, such as a comment's popup, are kept.
+        `contents`, if given, is written for each annotation instead of its
+        own dictionary (e.g. a copy with changed coordinates). Call once per page.
+        """
+        copier = self.copier
+        page = self.reader.pages[page_number]
+        page_ref = IndirectObject(page.indirect_reference.idnum, page.indirect_reference.generation, None)
+        refs = [copier.reserve() for _ in annotations]
+        # Alias every annotation first so references between them survive
+        for annotation, ref in zip(annotations, refs):
+            if isinstance(annotation, IndirectObject):
+                copier.alias(annotation, ref)
+
+        for annotation, content, ref in zip(annotations, contents or annotations, refs):
+            annotation_copy = copier.copy(content.get_object())
+            annotation_copy[NameObject("/P")] = page_ref
+            copier.write(ref, annotation_copy)
+
+        page_copy = copier.copy(page, skip=("/Annots",))
+        annots = copier.copy(ArrayObject(page.get("/Annots", ArrayObject())))
+        page_copy[NameObject("/Annots")] = ArrayObject(list(annots) + refs)
+        copier.write(page_ref, page_copy)
+
+    def set_navigation(self, bookmarks: Sequence[Bookmark]) -> None:
+        """
+        Replace the document outline and page labels with one entry per
+        bookmark (in page order, at most one per page), by writing a new
+        version of the catalog. Pages before the first bookmark keep plain
+        numbers. Viewers are asked to open with the outline showing.
+        """
+        copier = self.copier
+        pages = self.reader.pages
+        outline_ref = copier.reserve()
+        item_refs = [copier.reserve() for _ in bookmarks]
+        for n, (bookmark, ref) in enumerate(zip(bookmarks, item_refs)):
+            page_ref = pages[bookmark.page].indirect_reference
+            item = DictionaryObject({
+                NameObject("/Title"): TextStringObject(bookmark.title),
+                NameObject("/Parent"): outline_ref,
+                NameObject("/Dest"): ArrayObject([
+                    IndirectObject(page_ref.idnum, page_ref.generation, None), NameObject("/Fit")
+                ]),
+            })
+            if n > 0:
+                item[NameObject("/Prev")] = item_refs[n - 1]
+            if n + 1 < len(item_refs):
+                item[NameObject("/Next")] = item_refs[n + 1]
+            copier.write(ref, item)
+
+        outline = DictionaryObject({
+            NameObject("/Type"): NameObject("/Outlines"),
+            NameObject("/Count"): NumberObject(len(item_refs)),
+        })
+        if item_refs:
+            outline[NameObject("/First")] = item_refs[0]
+            outline[NameObject("/Last")] = item_refs[-1]
+        copier.write(outline_ref, outline)
+
+        labels = ArrayObject()
+        if not bookmarks or bookmarks[0].page > 0:
+            labels += [NumberObject(0), DictionaryObject({NameObject("/S"): NameObject("/D")})]
+        for bookmark in bookmarks:
+            labels += [NumberObject(bookmark.page), DictionaryObject({
+                NameObject("/S"): NameObject("/D"),
+                NameObject("/P"): TextStringObject(bookmark.label),
+            })]
+
+        root = self.reader.trailer.raw_get("/Root")
+        catalog = copier.copy(root.get_object(), skip=("/Outlines", "/PageLabels", "/PageMode"))
+        catalog[NameObject("/Outlines")] = outline_ref
+        catalog[NameObject("/PageLabels")] = DictionaryObject({NameObject("/Nums"): labels})
+        catalog[NameObject("/PageMode")] = NameObject("/UseOutlines")
+        copier.write(IndirectObject(root.idnum, root.generation, None), catalog)
+
+    def __enter__(self) -> "IncrementalAppender":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._file.close()
+
+    def finish(self) -> bytes:
+        """
+        Close the update and return the bytes to append to the original file.
+        The cross-reference section matches the style of the file's last one,
+        except that a file too large for an xref table gets an xref stream.
+        """
+        copier = self.copier
+        if self.node_ref is not None:
+            copier.write(self.node_ref, copier.pages_node(self.kids, self.page_count, self.pages_ref))
+
+            source = self.pages_ref.get_object()
+            root_pages = copier.copy(source, skip=("/Kids", "/Count"))
+            root_pages[NameObject("/Kids")] = ArrayObject(list(copier.copy(ArrayObject(source["/Kids"]))) + [self.node_ref])
+            root_pages[NameObject("/Count")] = NumberObject(int(source["/Count"]) + self.page_count)
+            copier.write(self.pages_ref, root_pages)
+
+        trailer = DictionaryObject({
+            NameObject("/Root"): self.reader.trailer.raw_get("/Root"),
+            NameObject("/Prev"): NumberObject(self.prev_xref),
+        })
+        for key in ("/Info", "/ID"):
+            if key in self.reader.trailer:
+                trailer[NameObject(key)] = copier.copy(self.reader.trailer.raw_get(key))
+
+        if self.xref_is_stream or copier.tell() >= MAX_XREF_TABLE_OFFSET:
+            write_xref_stream(copier, trailer)
+        else:
+            write_xref_table(copier, trailer)
+        return self.buffer.getvalue()
+
+
+# ================================================================
+# Linearization
+# ================================================================
+def can_linearize() -> bool:
+    return pikepdf is not None
+
+
+def linearize_pdf(path: Path) -> None:
+    """
+    Rewrite the PDF at `path` linearized ("fast web view", with qpdf via
+    pikepdf): the first page and the objects it needs come first, and hint
+    tables let a viewer fetch any other page without reading the whole file.
+    """
+    path = Path(path)
+    tmp_path = path.with_suffix(".tmp.pdf")
+    with pikepdf.open(path) as pdf:
+        pdf.save(tmp_path, linearize=True)
+    tmp_path.replace(path)
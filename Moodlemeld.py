@@ -1,18 +1,27 @@
 import os
+import multiprocessing
+import threading
 import traceback
 import zipfile
-import tempfile
-import shutil
 import sys
 import subprocess
-from typing import Optional
+from pathlib import Path
+from typing import Callable, List, Optional
 
 import tkinter as tk
 from tkinter import ttk, filedialog as fd, messagebox as mb
 
-from Meld import meld
-from Unmeld import unmeld
-from Meldlogging import log
+from Meld import meld, meld_outputs, ask_overwrite, DEFAULT_CHUNK_SIZE
+from Unmeld import unmeld, read_key_file, KEY_FILE_NAME
+from Meldcache import PageCache
+from Meldoptimise import PdfOptimiser
+from Meldlogging import log, StatusQueue, JobCancelled
+
+# ================================================================
+# Constants
+# ================================================================
+POLL_INTERVAL_MS = 100  # How often the log queue is drained into the window
+LOG_BATCH_SIZE = 200    # Most log lines inserted per drain
 
 # ================================================================
 # Main Entry
@@ -36,11 +45,76 @@ def moodlemeld(initials: Optional[str] = None) -> None:
     # ================================================================
     # Error reporting
     # ================================================================
-    def show_error(title: str, err: Exception):
-        tb = traceback.format_exc()
+    def show_error(title: str, err: Exception, tb: Optional[str] = None):
+        tb = tb or traceback.format_exc()
         mb.showerror(title, f"{err}\n\nDetails:\n{tb}")
         log(f"Error: {err}", status_text)
 
+
+    # ================================================================
+    # Background jobs
+    # ================================================================
+    job_status: Optional[StatusQueue] = None
+    job_thread: Optional[threading.Thread] = None
+    job_error = None  # (title, exception, traceback) from the worker thread
+
+    def start_job(error_title: str, target: Callable[[StatusQueue], None]):
+        """Run target(status) on a worker thread; the window stays responsive."""
+        nonlocal job_status, job_thread, job_error
+        if job_thread is not None:
+            return
+
+        status = StatusQueue()
+
+        def run():
+            nonlocal job_error
+            try:
+                target(status)
+            except JobCancelled:
+                log("❌ Cancelled.", status)
+            except Exception as e:
+                job_error = (error_title, e, traceback.format_exc())
+                log(f"❌ Error: {e}", status)
+
+        job_status, job_error = status, None
+        job_thread = threading.Thread(target=run, daemon=True)
+        set_running(True)
+        job_thread.start()
+
+    def cancel_job():
+        if job_status is not None:
+            job_status.cancel()
+            log("Cancelling...", status_text)
+
+    def poll_job():
+        """Drain queued log lines in one batch and update the progress bar."""
+        nonlocal job_status, job_thread
+        if job_status is not None:
+            batch = job_status.drain(LOG_BATCH_SIZE)
+            if batch:
+                status_text.insert(tk.END, "\n".join(batch) + "\n")
+                status_text.see(tk.END)
+
+            done, total, phase = job_status.progress
+            progress.configure(maximum=max(total, 1), value=done)
+            progress_phase.set(phase)
+
+            if not job_thread.is_alive() and job_status.empty():
+                job_status, job_thread = None, None
+                set_running(False)
+                if job_error:
+                    show_error(*job_error)
+
+        root.after(POLL_INTERVAL_MS, poll_job)
+
+    def set_running(running: bool):
+        for button in job_buttons:
+            button.state(["disabled"] if running else ["!disabled"])
+        cancel_button.state(["!disabled"] if running else ["disabled"])
+        if not running:
+            progress.configure(value=0)
+            progress_phase.set("")
+
         
     # ================================================================
     # Select a folder to be melded
@@ -65,47 +139,37 @@ def moodlemeld(initials: Optional[str] = None) -> None:
         with open(last_dir_file, "w", encoding="utf-8") as f:
             f.write(last_dir)
         
-        if os.path.isdir(path): # If it's a directory
-            folder = path
-        elif path.lower().endswith(".zip"): # If it's a ZIP file — extract next to the ZIP
-            try:
-                zip_dir = os.path.dirname(path)
-                base_name = os.path.splitext(os.path.basename(path))[0]
-                temp_dir = os.path.join(zip_dir, f"{base_name}_unzipped")
-                # If folder exists (from a previous run), wipe it first
-                if os.path.exists(temp_dir):
-                    try:
-                        shutil.rmtree(temp_dir)
-                    except PermissionError:
-                        log(f"⚠ Unzip folder was previously created and is noein use (probably by OneDrive): {temp_dir}", status_text)
-                        log(f"To make meld work, delete this folder manually.", status_text)
-                        return
-                os.makedirs(temp_dir)
-    
-                with zipfile.ZipFile(path, "r") as z:
-                    z.extractall(temp_dir)
-                folder = temp_dir
-                log(f"📦 Extracted ZIP to: {temp_dir}", status_text)
-            except Exception as e:
-                show_error("Failed to unzip file", e)
-                log(f"❌ Failed to unzip: {e}", status_text)
-                return
-        else:
+        # Folders are melded in place; ZIP files are read directly without extracting
+        if not (os.path.isdir(path) or zipfile.is_zipfile(path)):
             show_error("Invalid selection", "Please choose a folder or ZIP file.")
             return
-            filename
-            
+        folder = path
+
+        # Ask here, on the main thread, rather than from inside the job
+        incremental = add_new_only.get()
+        existing = [path for path in meld_outputs(Path(folder), shard_count.get(), incremental) if path.exists()]
+        if existing and not incremental and not ask_overwrite(*existing):
+            log("❌ Meld cancelled by user (file exists).", status_text)
+            return
+
         # ---- Run meld() ----
-        try:
+        show_names = show_student_names.get()
+        cache = PageCache() if use_page_cache.get() else None
+        chunk_size = DEFAULT_CHUNK_SIZE if low_memory.get() else None
+        optimiser = PdfOptimiser() if shrink_output.get() else None
+        workers, shards = worker_processes.get(), shard_count.get()
+        linearize = linearize_output.get()
+
+        def job(status: StatusQueue):
             meld(
-                folder,
-                show_student_names.get(),
-                status_widget=status_text
+                folder, show_names, status_widget=status,
+                confirm_overwrite=lambda _: True, cache=cache, incremental=incremental,
+                chunk_size=chunk_size, optimiser=optimiser, workers=workers, shards=shards,
+                linearize=linearize,
             )
-            log("Done.", status_text)
-        except Exception as e:
-            show_error("Melding failed", e)
-            log(f"❌ Error: {e}", status_text)
+            log("Done.", status)
+
+        start_job("Melding failed", job)
     
     
     # ================================================================
@@ -115,29 +179,100 @@ def moodlemeld(initials: Optional[str] = None) -> None:
         nonlocal last_dir
         
         filetypes = (('PDF files', '*.pdf'), ('All files', '*.*'))
-        filename = fd.askopenfilename(
-            title='Choose file to unmeld',
+        filenames = fd.askopenfilenames(
+            title='Choose file to unmeld (or all the shards of one meld)',
             initialdir=last_dir,
             filetypes=filetypes
         )
-        if not filename:
+        if not filenames:
             return
 
         # update memory
-        last_dir = os.path.dirname(filename)
+        last_dir = os.path.dirname(filenames[0])
         with open(last_dir_file, "w", encoding="utf-8") as f:
             f.write(last_dir)
         
+        students = []
+        if choose_students.get():
+            folders = []
+            for name in filenames:
+                key_file = Path(name).parent / KEY_FILE_NAME
+                if not key_file.exists():
+                    show_error("Key file not found", f"{key_file} does not exist.")
+                    return
+                folders += [row.folder for row in read_key_file(key_file)]
+            students = pick_students(folders)
+            if not students:
+                return
+
+        graft_from = None
+        if graft_marking.get():
+            graft_from = ask_download('Choose the Moodle download that was melded')
+            if not graft_from:
+                return
+
         # ---- Run unmeld() ----
-        try:
+        initials, zip_folder, workers = marker_initials.get(), zip_unmelded_folder.get(), worker_processes.get()
+        restore_size, zip_only = restore_page_sizes.get(), zip_only_output.get()
+
+        def job(status: StatusQueue):
             unmeld(
-                filename,
-                marker_initials.get(),
-                zip_unmelded_folder.get(),
-                status_widget=status_text
+                list(filenames), initials, zip_folder, status_widget=status, workers=workers,
+                restore_size=restore_size, students=students, zip_only=zip_only, graft_from=graft_from,
+            )
+
+        start_job("Unmelding failed", job)
+
+
+    def ask_download(title: str) -> Optional[str]:
+        """Ask for a Moodle download, as a ZIP file or a folder; None if cancelled."""
+        is_zip = mb.askyesnocancel(title, "Is the download a ZIP file?\n\nChoose No to pick a folder instead.")
+        if is_zip is None:
+            return None
+        if is_zip:
+            path = fd.askopenfilename(
+                title=title, initialdir=last_dir, filetypes=(("ZIP files", "*.zip"), ("All files", "*.*"))
             )
-        except Exception as e:
-            show_error("Unmelding failed", e)
+        else:
+            path = fd.askdirectory(title=title, initialdir=last_dir)
+        if not path:
+            return None
+        if not (os.path.isdir(path) or zipfile.is_zipfile(path)):
+            show_error("Invalid selection", "Please choose a folder or ZIP file.")
+            return None
+        return path
+
+    
+    def pick_students(folders: List[str]) -> List[str]:
+        """Let the user choose students from the key file; returns their folder names (empty if cancelled)."""
+        dialog = tk.Toplevel(root)
+        dialog.title("Choose students to unmeld")
+        dialog.transient(root)
+        chosen: List[str] = []
+
+        ttk.Label(dialog, text="Select students (Ctrl/Shift-click for several):")\
+            .grid(row=0, column=0, columnspan=3, sticky='w', padx=5, pady=5)
+        listbox = tk.Listbox(dialog, selectmode=tk.EXTENDED, height=15, width=50)
+        scroll = ttk.Scrollbar(dialog, orient="vertical", command=listbox.yview)
+        listbox.configure(yscrollcommand=scroll.set)
+        for folder in folders:
+            listbox.insert(tk.END, folder)
+        listbox.grid(row=1, column=0, columnspan=2, sticky='nsew', padx=(5, 0))
+        scroll.grid(row=1, column=2, sticky='ns', padx=(0, 5))
+
+        def ok():
+            chosen.extend(folders[i] for i in listbox.curselection())
+            dialog.destroy()
+
+        ttk.Button(dialog, text="Unmeld selected", command=ok).grid(row=2, column=0, sticky='ew', padx=5, pady=5)
+        ttk.Button(dialog, text="Cancel", command=dialog.destroy).grid(row=2, column=1, sticky='ew', padx=5, pady=5)
+        dialog.rowconfigure(1, weight=1)
+        dialog.columnconfigure(0, weight=1)
+        dialog.columnconfigure(1, weight=1)
+
+        dialog.grab_set()
+        root.wait_window(dialog)
+        return chosen
 
     
     # ================================================================
@@ -158,10 +293,10 @@ def moodlemeld(initials: Optional[str] = None) -> None:
     # ================================================================
     def create_widgets():
         # Meld, Unmeld, and Open Working Directory buttons
-        ttk.Button(root, text='Meld...', command=select_meld)\
-            .grid(row=1, column=1, sticky='ew', padx=5, pady=5)
-        ttk.Button(root, text='Unmeld...', command=select_unmeld)\
-            .grid(row=1, column=2, sticky='ew', padx=5, pady=5)
+        for column, (text, command) in enumerate((('Meld...', select_meld), ('Unmeld...', select_unmeld)), start=1):
+            button = ttk.Button(root, text=text, command=command)
+            button.grid(row=1, column=column, sticky='ew', padx=5, pady=5)
+            job_buttons.append(button)
         ttk.Button(root, text='Open working directory', command=open_working_dir)\
             .grid(row=1, column=3, sticky='ew', padx=5, pady=5)
     
@@ -169,6 +304,15 @@ def moodlemeld(initials: Optional[str] = None) -> None:
         ttk.Label(root, text="Marker initials:").grid(row=2, column=1, sticky='e', pady=(5, 10))
         ttk.Entry(root, width=5, textvariable=marker_initials)\
             .grid(row=2, column=2, sticky='w', pady=(5, 10))
+
+        # Worker processes for melding and unmelding
+        ttk.Label(root, text="Worker processes:").grid(row=5, column=1, sticky='e')
+        ttk.Spinbox(root, from_=1, to=os.cpu_count() or 1, width=3, textvariable=worker_processes)\
+            .grid(row=5, column=2, sticky='w')
+        shards_frame = ttk.Frame(root)
+        shards_frame.grid(row=5, column=3, sticky='w', padx=5)
+        ttk.Label(shards_frame, text="Shards:").pack(side='left')
+        ttk.Spinbox(shards_frame, from_=1, to=20, width=3, textvariable=shard_count).pack(side='left')
     
         # Checkbuttons
         ttk.Checkbutton(root, text="Show student names on melded file",
@@ -176,16 +320,50 @@ def moodlemeld(initials: Optional[str] = None) -> None:
             .grid(row=3, column=1, columnspan=3, sticky='w', padx=5)
         ttk.Checkbutton(root, text="Zip unmelded folder",
                         variable=zip_unmelded_folder)\
-            .grid(row=4, column=1, columnspan=3, sticky='w', padx=5)
+            .grid(row=4, column=1, columnspan=2, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="ZIP only",
+                        variable=zip_only_output)\
+            .grid(row=4, column=3, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="Reuse scaled pages from earlier melds",
+                        variable=use_page_cache)\
+            .grid(row=6, column=1, columnspan=3, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="Only add new students to existing melded file",
+                        variable=add_new_only)\
+            .grid(row=7, column=1, columnspan=3, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="Low-memory, resumable meld (for very large cohorts)",
+                        variable=low_memory)\
+            .grid(row=8, column=1, columnspan=3, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="Shrink melded file (downsample large scans)",
+                        variable=shrink_output)\
+            .grid(row=9, column=1, columnspan=3, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="Fast-opening melded file (needs pikepdf)",
+                        variable=linearize_output)\
+            .grid(row=10, column=1, columnspan=3, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="Restore original page sizes when unmelding",
+                        variable=restore_page_sizes)\
+            .grid(row=11, column=1, columnspan=3, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="Choose which students to unmeld",
+                        variable=choose_students)\
+            .grid(row=12, column=1, columnspan=3, sticky='w', padx=5)
+        ttk.Checkbutton(root, text="Add marking to the original submissions",
+                        variable=graft_marking)\
+            .grid(row=13, column=1, columnspan=3, sticky='w', padx=5)
     
         # Text box and Scrollbar
         scroll = ttk.Scrollbar(root, orient="vertical", command=status_text.yview)
         status_text.configure(yscrollcommand=scroll.set)
     
-        status_text.grid(row=6, column=1, columnspan=3, padx=5, pady=10, sticky='nsew')
-        scroll.grid(row=6, column=4, sticky='ns')
+        status_text.grid(row=14, column=1, columnspan=3, padx=5, pady=10, sticky='nsew')
+        scroll.grid(row=14, column=4, sticky='ns')
     
-        root.rowconfigure(6, weight=1)
+        root.rowconfigure(14, weight=1)
+
+        # Progress bar (with the phase it counts) and Cancel button
+        ttk.Label(root, textvariable=progress_phase, width=14)\
+            .grid(row=15, column=1, sticky='w', padx=5, pady=(0, 10))
+        progress.grid(row=15, column=2, padx=5, pady=(0, 10), sticky='ew')
+        cancel_button.grid(row=15, column=3, sticky='ew', padx=5, pady=(0, 10))
+        cancel_button.state(["disabled"])
 
     root = tk.Tk()
     root.title('MoodleMeld')
@@ -193,7 +371,7 @@ def moodlemeld(initials: Optional[str] = None) -> None:
         root.iconbitmap('MoodleMeld.ico')
     except:
         pass
-    root.geometry('400x300')
+    root.geometry('400x500')
     root.resizable(True, True)
     root.columnconfigure(1, weight=1)
     root.columnconfigure(2, weight=1)
@@ -203,11 +381,29 @@ def moodlemeld(initials: Optional[str] = None) -> None:
     marker_initials      = tk.StringVar(value=initials)
     show_student_names   = tk.BooleanVar(value=True)
     zip_unmelded_folder  = tk.BooleanVar(value=True)
+    worker_processes     = tk.IntVar(value=os.cpu_count() or 1)
+    shard_count          = tk.IntVar(value=1)
+    use_page_cache       = tk.BooleanVar(value=True)
+    add_new_only         = tk.BooleanVar(value=False)
+    low_memory           = tk.BooleanVar(value=False)
+    shrink_output        = tk.BooleanVar(value=False)
+    linearize_output     = tk.BooleanVar(value=False)
+    restore_page_sizes   = tk.BooleanVar(value=False)
+    choose_students      = tk.BooleanVar(value=False)
+    zip_only_output      = tk.BooleanVar(value=False)
+    graft_marking        = tk.BooleanVar(value=False)
+    progress_phase       = tk.StringVar(value="")
 
     status_text = tk.Text(root, height=6, width=30, wrap='word')
+    progress = ttk.Progressbar(root, mode='determinate')
+    cancel_button = ttk.Button(root, text='Cancel', command=cancel_job)
+    job_buttons = []
 
     create_widgets()
 
+    root.after(POLL_INTERVAL_MS, poll_job)
     root.mainloop()
 
-moodlemeld(initials="MKR")
\ No newline at end of file
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Needed for worker processes in the frozen executable
+    moodlemeld(initials="MKR")
\ No newline at end of file
@@ -1,12 +1,26 @@
 import csv
-import shutil
-from pathlib import Path
-from typing import Optional
-from pypdf import PdfReader, PdfWriter
+import json
+import mmap
+import os
+import re
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Collection, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+from pypdf import PageObject, PdfReader, PdfWriter
 from pypdf.annotations import FreeText
-import tkinter as tk
+from pypdf.generic import ArrayObject, DictionaryObject, FloatObject, NameObject, PdfObject, RectangleObject
 
-from Meldlogging import log
+from Meld import extract_name_id, student_label
+from Meldcache import content_hash
+from Meldimages import is_image
+from Meldjournal import Journal, failure_reason, UNMELD_JOURNAL_NAME
+from Meldlogging import log, report_progress, check_cancelled, StatusSink
+from Meldtrace import Tracer, span, tracing, current_tracer, RUN
+from Meldwriter import IncrementalAppender, StreamingPdfWriter, RawObjectSource
 
 # ================================================================
 # Constants
@@ -14,6 +28,7 @@ from Meldlogging import log
 KEY_FILE_NAME = "key_file.csv"
 UNMELDED_FOLDER_NAME = "Unmelded"
 MAX_FILE_NAME_CHARS = 20  # Limit to avoid overly long paths
+CHUNKS_PER_WORKER = 4  # Smaller runs keep progress flowing in order
 
 
 # ================================================================
@@ -25,16 +40,9 @@ def safe_open_w(path: Path):
     return open(path, "wb")
 
 
-def annotate(pdf_path: Path, initials: str) -> None:
-    """Annotate the first page of a PDF with the marker's initials (if provided)."""
-    if not initials:
-        return
-
-    reader = PdfReader(str(pdf_path))
-    writer = PdfWriter()
-    writer.clone_document_from_reader(reader)
-
-    annotation = FreeText(
+def initials_annotation(initials: str) -> FreeText:
+    """Build the marker's initials annotation for the bottom-left of a first page."""
+    return FreeText(
         text=initials,
         rect=(20, 20, 60, 40),
         font="Helvetica",
@@ -43,93 +51,905 @@ def annotate(pdf_path: Path, initials: str) -> None:
         font_color="ff0000",
         border_color="ff0000",
     )
-    writer.add_annotation(page_number=0, annotation=annotation)
 
-    with open(pdf_path, "wb") as f:
-        writer.write(f)
+
+def annotate(pdf_path: Path, initials: str) -> None:
+    """
+    Annotate the first page of an existing PDF with the marker's initials (if provided).
+    unmeld() adds the initials while splitting; this rewrites a finished file.
+    """
+    if not initials:
+        return
+
+    with span("annotate", file=Path(pdf_path).name) as counts:
+        reader = PdfReader(str(pdf_path))
+        writer = PdfWriter()
+        writer.clone_document_from_reader(reader)
+        writer.add_annotation(page_number=0, annotation=initials_annotation(initials))
+
+        with open(pdf_path, "wb") as f:
+            writer.write(f)
+            counts["bytes_written"] = f.tell()
 
 
 # ================================================================
-# Main unmeld function
+# Key file
 # ================================================================
-def unmeld(
-    pdf_to_unmeld: str,
-    initials: str = "",
-    zip_unmelded_folder: bool = False,
-    status_widget: Optional[tk.Text] = None
+PageBoxes = Tuple[float, ...]  # visible box, then mediabox (left, bottom, right, top each; older key files: visible box only)
+
+
+class KeyRow(NamedTuple):
+    """One key file row: a student PDF and where its pages are in the melded PDF."""
+    row: int
+    folder: str
+    file: str
+    pages: int
+    first_page: int
+    sha256: str = ""
+    scaled_to: Optional[float] = None
+    boxes: Tuple[PageBoxes, ...] = ()  # original page boxes of the source PDF
+
+
+def read_key_file(key_file_path: Path, status_widget: Optional[StatusSink] = None) -> List[KeyRow]:
+    """
+    Read key_file.csv into rows with the melded page each student starts on.
+    Rows written by older versions (folder, file, pages only) start where the
+    previous row ended. Malformed rows are logged and skipped.
+    """
+    with key_file_path.open("r", newline="") as keyfile:
+        key_reader = list(csv.reader(keyfile))
+    log(f"Found {len(key_reader)} student entries in {KEY_FILE_NAME}.\n", status_widget)
+
+    rows = []
+    first_page = 0
+    for i, row in enumerate(key_reader, start=1):
+        if len(row) < 3:
+            log(f"⚠️ Skipping malformed row {i}: {row}", status_widget)
+            continue
+
+        student_folder, student_file, file_pages_str = row[:3]
+        try:
+            file_pages = int(file_pages_str)
+        except ValueError:
+            log(f"⚠️ Invalid page count at row {i}: {file_pages_str}", status_widget)
+            continue
+
+        if file_pages <= 0:
+            log(f"⚠️ Skipping row {i} with non-positive page count: {file_pages}", status_widget)
+            continue
+
+        rows.append(manifest_row(i, student_folder, student_file, file_pages, first_page, row[3:], status_widget))
+        first_page = rows[-1].first_page + file_pages
+
+    return rows
+
+
+def manifest_row(
+    i: int,
+    student_folder: str,
+    student_file: str,
+    file_pages: int,
+    first_page: int,
+    extra: List[str],
+    status_widget: Optional[StatusSink] = None,
+) -> KeyRow:
+    """
+    Build a KeyRow from the manifest columns after the page count (first
+    melded page, source hash, scaled width, original boxes). Missing or
+    unreadable columns fall back to what an older key file would give.
+    """
+    extra = (extra + [""] * 4)[:4]
+    try:
+        first_page = int(extra[0]) if extra[0] else first_page
+        scaled_to = float(extra[2]) if extra[2] else None
+        boxes = tuple(tuple(float(v) for v in box) for box in json.loads(extra[3])) if extra[3] else ()
+    except ValueError:
+        log(f"⚠️ Unreadable manifest columns at row {i}; using page counts only.", status_widget)
+        return KeyRow(i, student_folder, student_file, file_pages, first_page)
+    if len(boxes) != file_pages:
+        boxes = ()
+    return KeyRow(i, student_folder, student_file, file_pages, first_page, extra[1], scaled_to, boxes)
+
+
+def check_page_count(
+    rows: List[KeyRow], page_count: int, unmelded_folder: Path, status_widget: Optional[StatusSink] = None
+) -> List[KeyRow]:
+    """
+    Compare the key file with the melded PDF's page count before anything is
+    written. Rows running past the end of the PDF are logged and dropped;
+    the rest do not depend on them, so they are still unmelded.
+    """
+    expected = max((row.first_page + row.pages for row in rows), default=0)
+    if expected < page_count:
+        log(f"⚠️ The melded PDF has {page_count} pages but {KEY_FILE_NAME} only accounts for {expected}.", status_widget)
+
+    fitting = []
+    for row in rows:
+        if row.first_page + row.pages > page_count:
+            log(not_enough_pages_message(row, unmelded_folder), status_widget)
+        else:
+            fitting.append(row)
+    return fitting
+
+
+def melded_page_count(pdf_path: Path) -> int:
+    """Number of pages in a PDF, read from its page tree root without loading the pages."""
+    reader = PdfReader(str(pdf_path))
+    try:
+        return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+    except Exception:
+        return len(reader.pages)
+
+
+def select_rows(
+    rows: List[KeyRow],
+    students: Collection[str] = (),
+    pattern: Optional[str] = None,
+    status_widget: Optional[StatusSink] = None,
+) -> List[KeyRow]:
+    """
+    Keep only the rows of chosen students: those whose folder name or
+    student ID is in `students`, or whose name, ID or folder name matches
+    the regular expression `pattern`. Requested students with no row are logged.
+    """
+    wanted = {str(s).strip() for s in students}
+    regex = re.compile(pattern, re.IGNORECASE) if pattern else None
+    found = set()
+    selected = []
+    for row in rows:
+        name, sid = extract_name_id(row.folder)
+        keys = {row.folder} | ({str(sid)} if sid is not None else set())
+        matches = keys & wanted
+        if matches or (regex and any(regex.search(text) for text in keys | {name or ""})):
+            found |= matches
+            selected.append(row)
+
+    for missing in sorted(wanted - found):
+        log(f"⚠️ No student matching '{missing}' in {KEY_FILE_NAME}.", status_widget)
+    return selected
+
+
+def split_rows(rows: List[KeyRow], chunks: int) -> List[List[KeyRow]]:
+    """Split rows into at most `chunks` contiguous runs of roughly equal page counts."""
+    total_pages = sum(row.pages for row in rows)
+    target = total_pages / max(chunks, 1)
+
+    runs, current, current_pages = [], [], 0
+    for row in rows:
+        current.append(row)
+        current_pages += row.pages
+        if current_pages >= target and len(runs) < chunks - 1:
+            runs.append(current)
+            current, current_pages = [], 0
+    if current:
+        runs.append(current)
+    return runs
+
+
+# ================================================================
+# Writing student files
+# ================================================================
+def student_output_path(unmelded_folder: Path, student_folder: str, student_file: str) -> Path:
+    """Where a student's unmelded PDF goes (long filenames truncated safely)."""
+    stem = Path(student_file).stem[:MAX_FILE_NAME_CHARS]
+    return unmelded_folder / student_folder / (stem + ".pdf")
+
+
+def student_archive_name(student_folder: str, student_file: str) -> str:
+    """A student's PDF inside the ZIP: its folder at the top level, as Moodle's feedback upload expects."""
+    return student_output_path(Path(), student_folder, student_file).as_posix()
+
+
+class UnmeldOutput:
+    """
+    Where student PDFs go: the Unmelded folder, Unmelded.zip, or both.
+
+    Each PDF is added to the ZIP as soon as it is made, so the folder is
+    never read back to archive it. PDFs are already compressed, so entries
+    are stored, not deflated. The ZIP is built under a temporary name and
+    only moved into place once every student has been written.
+
+    With a journal, each finished student is recorded so that a rerun can
+    skip them (see resume). The journal is deleted at the end unless the
+    unmeld stopped part-way or some students failed, who are then retried.
+    """
+
+    def __init__(
+        self, unmelded_folder: Path, to_folder: bool = True, to_zip: bool = False, journal: Optional[Journal] = None
+    ) -> None:
+        self.unmelded_folder = unmelded_folder
+        self.to_folder = to_folder
+        self.zip_path = unmelded_folder.with_suffix(".zip")
+        self._tmp_zip = unmelded_folder.with_suffix(".tmp.zip")
+        self.archive = zipfile.ZipFile(self._tmp_zip, "w", zipfile.ZIP_STORED) if to_zip else None
+        self.journal = journal
+        self.failed = 0
+
+    def save(self, row: KeyRow, data: bytes) -> None:
+        """Store one student's finished PDF."""
+        if self.to_folder:
+            with safe_open_w(student_output_path(self.unmelded_folder, row.folder, row.file)) as f:
+                f.write(data)
+        if self.archive is not None:
+            self.archive.writestr(student_archive_name(row.folder, row.file), data)
+
+    def finished(self, row: KeyRow, skipped: bool = False) -> None:
+        """Journal a student as done: their file written (or, if skipped, nothing to write)."""
+        if self.journal is None:
+            return
+        path = student_output_path(self.unmelded_folder, row.folder, row.file)
+        self.journal.record("student", folder=row.folder, file=row.file, bytes=None if skipped else path.stat().st_size)
+
+    def fail(self, row: KeyRow, reason: str, status_widget: Optional[StatusSink] = None) -> None:
+        """Log a student whose file could not be written, and remove anything half-written."""
+        self.failed += 1
+        student_output_path(self.unmelded_folder, row.folder, row.file).unlink(missing_ok=True)
+        log(f"🚫 Could not unmeld {row.folder}/{row.file}: {reason}", status_widget)
+
+    def resume(self, rows: List[KeyRow], status_widget: Optional[StatusSink] = None) -> List[KeyRow]:
+        """
+        The rows still to do. Students the journal has as done, whose file is
+        still there at the recorded size, are skipped; their files are
+        added to the ZIP from the Unmelded folder.
+        """
+        if self.journal is None or not self.journal.resumed:
+            return rows
+        done = {(entry["folder"], entry["file"]): entry["bytes"] for entry in self.journal.of_kind("student")}
+        remaining = []
+        for row in rows:
+            path = student_output_path(self.unmelded_folder, row.folder, row.file)
+            size = done.get((row.folder, row.file), -1)
+            if size is None:
+                continue
+            if size < 0 or not path.is_file() or path.stat().st_size != size:
+                remaining.append(row)
+            elif self.archive is not None:
+                self.archive.write(path, student_archive_name(row.folder, row.file))
+        log(f"⏯️ Resuming: {len(rows) - len(remaining)} of {len(rows)} students were already unmelded.", status_widget)
+        return remaining
+
+    def __enter__(self) -> "UnmeldOutput":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if self.journal is not None:
+            if exc_type is None and not self.failed:
+                self.journal.finish()
+            else:
+                self.journal.close()
+        if self.archive is None:
+            return
+        self.archive.close()
+        if exc_type is None:
+            self._tmp_zip.replace(self.zip_path)
+        else:
+            self._tmp_zip.unlink()
+
+
+def restore_page_sizes(writer: PdfWriter, boxes: Tuple[PageBoxes, ...]) -> None:
+    """
+    Give each page of a student's file back the boxes it had before melding.
+    Melding scaled the mediabox to the melded size separately in x and y, so
+    each page is scaled back by the same two factors and then gets its
+    recorded mediabox and visible box. A key file that only recorded the
+    visible box is taken to mean the mediabox was the same. Pages whose
+    original box was unusable (and so were never scaled) are left alone.
+    """
+    for page, recorded in zip(writer.pages, boxes):
+        visible, media = recorded[:4], recorded[4:8] or recorded[:4]
+        melded_width, melded_height = float(page.mediabox.width), float(page.mediabox.height)
+        if min(visible[2] - visible[0], visible[3] - visible[1], media[2] - media[0], media[3] - media[1]) <= 0:
+            continue
+        if melded_width <= 0 or melded_height <= 0:
+            continue
+        sx = (media[2] - media[0]) / melded_width
+        sy = (media[3] - media[1]) / melded_height
+        if abs(sx - 1) > 1e-4 or abs(sy - 1) > 1e-4:
+            page.scale(sx, sy)
+        page.mediabox = RectangleObject(media)
+        page.cropbox = RectangleObject(visible)
+
+
+def write_student_pdf(
+    reader: PdfReader,
+    row: KeyRow,
+    unmelded_folder: Path,
+    initials: str,
+    zero_copy: bool = True,
+    raw: Optional[RawObjectSource] = None,
+    restore_size: bool = False,
+    output: Optional[UnmeldOutput] = None,
+) -> str:
+    """
+    Write one student's page range from the melded PDF and return the log line.
+    Raises IndexError if the melded PDF runs out of pages.
+    Without an output (or with a folder-only one) the file is written
+    straight into the Unmelded folder; otherwise it goes to output.save.
+
+    By default the pages and every object they reference are streamed
+    straight to the file. With a RawObjectSource for the melded PDF, the
+    objects (and the page tree) are copied as bytes without being parsed;
+    without one, encoded streams are still never decoded.
+    zero_copy=False uses a fresh PdfWriter per student instead, as does
+    restore_size=True when the key file recorded the original page boxes.
+    """
+    with span("write", file=row.file, pages=row.pages) as counts:
+        if output is None or output.archive is None:
+            with safe_open_w(student_output_path(unmelded_folder, row.folder, row.file)) as outfile:
+                render_student_pdf(outfile, reader, row, initials, zero_copy, raw, restore_size)
+                counts["bytes_written"] = outfile.tell()
+        else:
+            data = student_pdf_bytes(reader, row, initials, zero_copy, raw, restore_size)
+            output.save(row, data)
+            counts["bytes_written"] = len(data)
+
+    return created_message(row)
+
+
+def created_message(row: KeyRow) -> str:
+    return f"✅ Created {row.folder}/{student_output_path(Path(), row.folder, row.file).name}"
+
+
+def student_pdf_bytes(
+    reader: PdfReader,
+    row: KeyRow,
+    initials: str,
+    zero_copy: bool = True,
+    raw: Optional[RawObjectSource] = None,
+    restore_size: bool = False,
+) -> bytes:
+    """One student's PDF in memory (see render_student_pdf)."""
+    buffer = BytesIO()
+    render_student_pdf(buffer, reader, row, initials, zero_copy, raw, restore_size)
+    return buffer.getvalue()
+
+
+def render_student_pdf(
+    outfile: BinaryIO,
+    reader: PdfReader,
+    row: KeyRow,
+    initials: str,
+    zero_copy: bool = True,
+    raw: Optional[RawObjectSource] = None,
+    restore_size: bool = False,
 ) -> None:
+    """Write one student's pages to outfile, the way write_student_pdf describes."""
+    first_page, file_pages = row.first_page, row.pages
+    if restore_size and row.boxes:
+        zero_copy = False
+    if zero_copy and raw is not None:
+        pages = raw.pages[first_page:first_page + file_pages]
+        if len(pages) < file_pages:
+            raise IndexError(first_page + file_pages)
+    else:
+        pages = [reader.pages[page_number] for page_number in range(first_page, first_page + file_pages)]
+
+    if zero_copy:
+        writer = StreamingPdfWriter(outfile, [raw] if raw else ())
+        writer.append_batch([(pages, {0: [initials_annotation(initials)]} if initials else {})])
+        writer.finish()
+    else:
+        writer = PdfWriter()
+        for page in pages:
+            writer.add_page(page)
+        if restore_size:
+            restore_page_sizes(writer, row.boxes)
+        if initials:
+            writer.add_annotation(page_number=0, annotation=initials_annotation(initials))
+        writer.write(outfile)
+
+
+def not_enough_pages_message(row: KeyRow, unmelded_folder: Path) -> str:
+    """Log line for a key file row that runs past the end of the melded PDF."""
+    i, student_folder, student_file = row[:3]
+    safe_name = student_output_path(unmelded_folder, student_folder, student_file).name
+    return f"❌ Not enough pages in melded PDF for row {i} ({student_folder}/{safe_name})"
+
+
+# ================================================================
+# Grafting marking onto the original submissions
+# ================================================================
+POINT_KEYS = ("/Rect", "/QuadPoints", "/Vertices", "/L", "/CL")  # flat x, y, x, y, ... arrays
+
+
+class SubmissionSources:
     """
-    Unmelds a combined (melded) PDF back into individual student PDFs.
-    Updates progress live in a Tkinter Text widget (status_widget).
+    The original submissions a melded PDF was made from: the Moodle download
+    folder, or the downloaded ZIP (read in place).
     """
-    pdf_path = Path(pdf_to_unmeld)
-    parent_path = pdf_path.parent
-    key_file_path = parent_path / KEY_FILE_NAME
-    unmelded_folder = parent_path / UNMELDED_FOLDER_NAME
 
-    if not pdf_path.exists():
-        log(f"❌ Input PDF not found: {pdf_path}", status_widget)
-        return
-    if not key_file_path.exists():
-        log(f"❌ Key file not found: {key_file_path}", status_widget)
-        return
+    def __init__(self, download: Path) -> None:
+        self.download = download
+        self.zip_file = zipfile.ZipFile(download) if download.is_file() else None
+        self.members: Dict[Tuple[str, str], zipfile.ZipInfo] = {}
+        if self.zip_file is not None:
+            for info in self.zip_file.infolist():
+                path = PurePosixPath(info.filename)
+                self.members[(path.parent.name, path.name)] = info
+
+    def read(self, row: KeyRow) -> Optional[bytes]:
+        """The source PDF of a key file row, or None if it is not there."""
+        if self.zip_file is not None:
+            info = self.members.get((row.folder, row.file))
+            return self.zip_file.read(info) if info else None
+        path = self.download / row.folder / row.file
+        return path.read_bytes() if path.is_file() else None
+
+    def __enter__(self) -> "SubmissionSources":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.zip_file is not None:
+            self.zip_file.close()
+
+
+def _unscaled_annotation(annotation: DictionaryObject, sx: float, sy: float) -> DictionaryObject:
+    """
+    A copy of an annotation with its coordinates mapped from the melded page
+    back to the source page. The melded PDF's own objects are left as they
+    are, so its pages can still be copied if grafting fails.
+    """
+    def unscale(values: ArrayObject) -> ArrayObject:
+        return ArrayObject(FloatObject(float(v) / (sx if i % 2 == 0 else sy)) for i, v in enumerate(values))
+
+    copy = DictionaryObject(annotation)  # shallow: the arrays that change are replaced below, never edited
+    for key in POINT_KEYS:
+        if isinstance(annotation.get(key), ArrayObject):
+            copy[NameObject(key)] = unscale(annotation[key])
+    if isinstance(annotation.get("/InkList"), ArrayObject):
+        copy[NameObject("/InkList")] = ArrayObject(unscale(stroke.get_object()) for stroke in annotation["/InkList"])
+    if isinstance(annotation.get("/RD"), ArrayObject):
+        copy[NameObject("/RD")] = unscale(annotation["/RD"])  # left, top, right, bottom differences: same x, y pattern
+    return copy
+
+
+def _annotation_key(annotation: DictionaryObject, sx: float = 1, sy: float = 1) -> tuple:
+    """What identifies an annotation on a page: its type and (unscaled) rectangle."""
+    try:
+        rect = tuple(round(float(v) / (sx if i % 2 == 0 else sy), 1) for i, v in enumerate(annotation["/Rect"]))
+    except Exception:
+        rect = ()
+    return annotation.get("/Subtype"), rect
+
+
+def student_labels(row: KeyRow) -> Set[str]:
+    """The labels melding may have put on a student's first page (with or without their name)."""
+    return {student_label(row.folder, True), student_label(row.folder, False)} - {None}
+
+
+def marking_annotations(
+    melded_page: PageObject, source_page: Optional[PageObject], labels: Collection[str] = ()
+) -> List[Tuple[PdfObject, DictionaryObject]]:
+    """
+    The annotations added to a melded page during marking: those that are
+    neither one of the source page's own annotations (matched by type and
+    rectangle) nor the student's name/ID label. Each comes with a copy whose
+    coordinates are mapped back to the source page, which melding may have
+    scaled. With no source page (an image submission) nothing is original
+    and the copies keep the melded coordinates.
+    """
+    annotations = melded_page.get("/Annots")
+    if not isinstance(annotations, ArrayObject):
+        return []
+    try:
+        sx = float(melded_page.mediabox.width) / float(source_page.mediabox.width) if source_page else 1.0
+        sy = float(melded_page.mediabox.height) / float(source_page.mediabox.height) if source_page else 1.0
+    except (ZeroDivisionError, ValueError):
+        sx = sy = 1.0
+
+    source_annotations = source_page.get("/Annots", ArrayObject()) if source_page else ArrayObject()
+    original = Counter(_annotation_key(a.get_object()) for a in source_annotations)
+    marking: List[Tuple[PdfObject, DictionaryObject]] = []
+    seen: Set[int] = set()
+    for item in annotations:
+        annotation = item.get_object()
+        if not isinstance(annotation, DictionaryObject) or id(annotation) in seen:
+            continue
+        seen.add(id(annotation))
+        key = _annotation_key(annotation, sx, sy)
+        if original[key] > 0:
+            original[key] -= 1
+            continue
+        if annotation.get("/Subtype") == "/FreeText" and annotation.get("/Contents") in labels:
+            continue
+        if annotation.get("/Subtype") == "/Widget":
+            continue  # form fields belong to the document's form, not to the page
+        marking.append((item, _unscaled_annotation(annotation, sx, sy)))
+    return marking
+
+
+def graft_student_pdf(reader: PdfReader, row: KeyRow, source: bytes, initials: str) -> Optional[bytes]:
+    """
+    One student's original PDF with the marking from their pages of the
+    melded PDF added as an incremental update, or None if they have no
+    marking. Only the annotations are read from the melded PDF; the source
+    file's bytes are kept as they are, so pages keep their original size.
+    Raises ValueError if the source cannot be updated this way (e.g. it is
+    encrypted, or its page count differs from the key file).
+    """
+    labels = student_labels(row)
+    with IncrementalAppender(BytesIO(source)) as appender:
+        source_pages = appender.reader.pages
+        if len(source_pages) != row.pages:
+            raise ValueError(f"it has {len(source_pages)} pages, not {row.pages}")
+        marking = {}
+        for i in range(row.pages):
+            annotations = marking_annotations(reader.pages[row.first_page + i], source_pages[i], labels)
+            if annotations:
+                marking[i] = annotations
+        if not marking:
+            return None
+
+        if initials:
+            annotation = initials_annotation(initials)
+            marking.setdefault(0, []).append((annotation, annotation))
+        for page_number, annotations in marking.items():
+            appender.add_annotations(page_number, [item for item, _ in annotations], [copy for _, copy in annotations])
+        return source + appender.finish()
+
+
+def is_marked(reader: PdfReader, row: KeyRow) -> bool:
+    """Whether any of a student's melded pages has marking on it."""
+    labels = student_labels(row)
+    pages = reader.pages[row.first_page:row.first_page + row.pages]
+    return any(marking_annotations(page, None, labels) for page in pages)
 
-    log(f"Starting to unmeld: {pdf_to_unmeld}\n", status_widget)
 
+def unmeld_grafted(
+    pdf_path: Path,
+    rows: List[KeyRow],
+    sources: SubmissionSources,
+    unmelded_folder: Path,
+    initials: str,
+    status_widget: Optional[StatusSink] = None,
+    output: Optional[UnmeldOutput] = None,
+) -> None:
+    """
+    Write each marked student's original PDF with their marking grafted on
+    (see graft_student_pdf); students with no marking are skipped. A student
+    whose source is missing, has changed since melding, or cannot be
+    updated gets their pages copied from the melded PDF as usual.
+    """
+    output = output or UnmeldOutput(unmelded_folder)
+    skipped = 0
     with pdf_path.open("rb") as infile:
-        reader = PdfReader(infile)
-        pages_read = 0
+        with span("open", file=pdf_path.name):
+            reader = PdfReader(infile)
+        for n, row in enumerate(rows, start=1):
+            check_cancelled(status_widget)
+            if row.first_page + row.pages > len(reader.pages):
+                log(not_enough_pages_message(row, unmelded_folder), status_widget)
+                break
 
-        with key_file_path.open("r", newline="") as keyfile:
-            key_reader = list(csv.reader(keyfile))
+            with span("graft", file=row.file, pages=row.pages) as counts:
+                data, problem = None, None
+                image = is_image(row.file)
+                source = None if image else sources.read(row)
+                if image:
+                    # An image cannot take annotations, but an unmarked one is skipped like a PDF
+                    if is_marked(reader, row):
+                        problem = "original submission is an image"
+                elif source is None:
+                    problem = "original submission not found"
+                elif row.sha256 and content_hash(source) != row.sha256:
+                    problem = "original submission has changed since melding"
+                else:
+                    try:
+                        data = graft_student_pdf(reader, row, source, initials)
+                    except Exception as e:
+                        problem = f"cannot add marking to the original ({e})"
+                if data is not None:
+                    output.save(row, data)
+                    counts["bytes_written"] = len(data)
 
-        total_files = len(key_reader)
-        log(f"Found {total_files} student entries in {KEY_FILE_NAME}.\n", status_widget)
+            if problem is not None:
+                log(f"⚠️ {row.folder}/{row.file}: {problem}; copying its melded pages instead.", status_widget)
+                try:
+                    message = write_student_pdf(reader, row, unmelded_folder, initials, output=output)
+                except Exception as e:
+                    output.fail(row, failure_reason(e), status_widget)
+                    continue
+            elif data is None:
+                skipped += 1
+                message = f"⏭️ No marking for {row.folder}/{row.file}; skipped."
+            else:
+                message = created_message(row)
+            output.finished(row, skipped=problem is None and data is None)
+            log(f"[{n}/{len(rows)}] {message}", status_widget)
+            report_progress(n, len(rows), status_widget, "Unmelding")
 
-        for i, row in enumerate(key_reader, start=1):
-            if len(row) < 3:
-                log(f"⚠️ Skipping malformed row {i}: {row}", status_widget)
-                continue
+    if skipped:
+        log(f"⏭️ {skipped} of {len(rows)} students had no marking and were skipped.", status_widget)
 
-            student_folder, student_file, file_pages_str = row
-            try:
-                file_pages = int(file_pages_str)
-            except ValueError:
-                log(f"⚠️ Invalid page count at row {i}: {file_pages_str}", status_widget)
-                continue
 
-            if file_pages <= 0:
-                log(f"⚠️ Skipping row {i} with non-positive page count: {file_pages}", status_widget)
-                continue
+# ================================================================
+# Worker pool
+# ================================================================
+_worker_reader: Optional[PdfReader] = None
+_worker_raw: Optional[RawObjectSource] = None
 
-            # Truncate long filenames safely
-            stem = Path(student_file).stem[:MAX_FILE_NAME_CHARS]
-            safe_name = stem + ".pdf"
-            student_file_path = unmelded_folder / student_folder / safe_name
 
-            writer = PdfWriter()
+def _init_worker(pdf_path: str) -> None:
+    """Open (and map) the melded PDF once per worker process."""
+    global _worker_reader, _worker_raw
+    with open(pdf_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _worker_reader = PdfReader(pdf_path)
+    _worker_raw = RawObjectSource.for_reader(_worker_reader, data)
+
+
+WRITTEN, FAILED, SHORT = "written", "failed", "short"  # how a worker got on with a student
+
+
+def _unmeld_rows(
+    rows: List[KeyRow],
+    unmelded_folder: Path,
+    initials: str,
+    zero_copy: bool = True,
+    restore_size: bool = False,
+    to_bytes: bool = False,
+    trace: bool = False,
+) -> Tuple[List[Tuple[KeyRow, str, str, Optional[bytes]]], list]:
+    """
+    Worker task: write a contiguous run of students, stopping at the first
+    missing page (SHORT). A student whose file cannot be written is
+    reported as FAILED, with the reason, and the run goes on.
+    With to_bytes=True the PDFs are returned instead, for the
+    parent process to put in the ZIP. With trace=True the run's trace spans
+    are returned too, for the parent's tracer.
+    """
+    results = []
+    with tracing(Tracer() if trace else None) as tracer:
+        for row in rows:
             try:
-                for _ in range(file_pages):
-                    writer.add_page(reader.pages[pages_read])
-                    pages_read += 1
+                if to_bytes:
+                    with span("render", file=row.file, pages=row.pages) as counts:
+                        data = student_pdf_bytes(_worker_reader, row, initials, zero_copy, _worker_raw, restore_size)
+                        counts["bytes"] = len(data)
+                    results.append((row, created_message(row), WRITTEN, data))
+                else:
+                    message = write_student_pdf(
+                        _worker_reader, row, unmelded_folder, initials, zero_copy, _worker_raw, restore_size
+                    )
+                    results.append((row, message, WRITTEN, None))
             except IndexError:
-                log(f"❌ Not enough pages in melded PDF for row {i} ({student_folder}/{safe_name})", status_widget)
+                results.append((row, not_enough_pages_message(row, unmelded_folder), SHORT, None))
                 break
+            except Exception as e:
+                results.append((row, failure_reason(e), FAILED, None))
+    return results, tracer.events if tracer else []
+
+
+def unmeld_parallel(
+    pdf_path: Path,
+    rows: List[KeyRow],
+    unmelded_folder: Path,
+    initials: str,
+    workers: int,
+    status_widget: Optional[StatusSink] = None,
+    zero_copy: bool = True,
+    restore_size: bool = False,
+    output: Optional[UnmeldOutput] = None,
+) -> None:
+    """
+    Write student files from a process pool. Rows are split into contiguous
+    page ranges; progress is logged in submission order as runs complete.
+    When writing a ZIP, workers send back each PDF and it is saved here.
+    """
+    output = output or UnmeldOutput(unmelded_folder)
+    to_bytes = output.archive is not None
+    tracer = current_tracer()
+    runs = split_rows(rows, workers * CHUNKS_PER_WORKER)
+    done = 0
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(str(pdf_path),)
+    ) as pool:
+        futures = [
+            pool.submit(
+                _unmeld_rows, run, unmelded_folder, initials, zero_copy, restore_size, to_bytes, tracer is not None
+            )
+            for run in runs
+        ]
+        try:
+            for future in futures:
+                results, events = future.result()
+                if tracer:
+                    tracer.merge(events)
+                for row, message, outcome, data in results:
+                    if outcome == SHORT:
+                        log(message, status_widget)
+                        return
+                    if outcome == FAILED:
+                        output.fail(row, message, status_widget)
+                        continue
+                    if data is not None:
+                        with span("save", file=row.file, bytes_written=len(data)):
+                            output.save(row, data)
+                    output.finished(row)
+                    done += 1
+                    log(f"[{done}/{len(rows)}] {message}", status_widget)
+                    report_progress(done, len(rows), status_widget, "Unmelding")
+                check_cancelled(status_widget)
+        finally:
+            for pending in futures:
+                pending.cancel()
+
+
+# ================================================================
+# Main unmeld function
+# ================================================================
+def unmeld(
+    pdf_to_unmeld: Union[str, Sequence[str]],
+    initials: str = "",
+    zip_unmelded_folder: bool = False,
+    status_widget: Optional[StatusSink] = None,
+    workers: int = 1,
+    zero_copy: bool = True,
+    restore_size: bool = False,
+    students: Collection[str] = (),
+    pattern: Optional[str] = None,
+    zip_only: bool = False,
+    graft_from: Optional[str] = None,
+) -> bool:
+    """
+    Unmelds a combined (melded) PDF back into individual student PDFs.
+    Updates progress live in a Tkinter Text widget (status_widget).
+    With workers > 1 the student files are written by a process pool.
+    zero_copy=False writes each file with its own PdfWriter (see write_student_pdf).
+    With restore_size=True, pages go back to their size before melding
+    (needs a key file that recorded the original page boxes).
+    Given `students` (folder names or student IDs) and/or a regex `pattern`,
+    only those students' files are written (see select_rows).
+    With zip_unmelded_folder=True each file also goes into Unmelded.zip as it
+    is written; zip_only=True writes only the ZIP, with no Unmelded folder.
+    With graft_from (the Moodle download folder or ZIP that was melded), the
+    marking is added to each student's original PDF instead, and students
+    with no marking are skipped (see unmeld_grafted); workers, zero_copy
+    and restore_size do not apply.
+    When writing the Unmelded folder, finished students are journalled
+    (unmeld_journal.jsonl, next to the Unmelded folder): if the unmeld stops
+    part-way, running it again with the same options only writes the rest.
+    A student whose file cannot be written is logged and the rest carry on.
+    Returns False if the unmeld could not be done or any student's file
+    could not be written (the reasons are logged).
+    pdf_to_unmeld may also be a list of melded PDFs, each next to its own
+    key file, such as the shards of a sharded meld. They are unmelded
+    together into one Unmelded folder (and ZIP) in the folder they share.
+    """
+    if isinstance(pdf_to_unmeld, (str, Path)):
+        pdf_paths = [Path(pdf_to_unmeld)]
+    else:
+        pdf_paths = [Path(pdf) for pdf in pdf_to_unmeld]
+    if len(pdf_paths) > 1:
+        parent_path = Path(os.path.commonpath([pdf.resolve().parent for pdf in pdf_paths]))
+    else:
+        parent_path = pdf_paths[0].parent
+    unmelded_folder = parent_path / UNMELDED_FOLDER_NAME
 
-            with safe_open_w(student_file_path) as outfile:
-                writer.write(outfile)
+    for pdf_path in pdf_paths:
+        key_file_path = pdf_path.parent / KEY_FILE_NAME
+        if not pdf_path.exists():
+            log(f"❌ Input PDF not found: {pdf_path}", status_widget)
+            return False
+        if not key_file_path.exists():
+            log(f"❌ Key file not found: {key_file_path}", status_widget)
+            return False
+    if graft_from and not Path(graft_from).exists():
+        log(f"❌ Original submissions not found: {graft_from}", status_widget)
+        return False
+    if pattern:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            log(f"❌ Invalid student pattern: {pattern!r} ({e})", status_widget)
+            return False
 
-            annotate(student_file_path, initials)
-            log(f"[{i}/{total_files}] ✅ Created {student_folder}/{safe_name}", status_widget)
+    log(f"Starting to unmeld: {', '.join(str(pdf) for pdf in pdf_paths)}\n", status_widget)
 
-    log(f"\n✅ Unmeld complete! Files saved in: {unmelded_folder.resolve()}", status_widget)
-        
-    if zip_unmelded_folder:
-        shutil.make_archive(str(unmelded_folder), "zip", unmelded_folder)
-        log(f"\n📦 Files also zipped to: {unmelded_folder}.zip", status_widget)
-    
+    with span("unmeld", RUN, file=", ".join(pdf.name for pdf in pdf_paths)) as run:
+        shards = []
+        for pdf_path in pdf_paths:
+            with span("key file", file=KEY_FILE_NAME) as counts:
+                rows = read_key_file(pdf_path.parent / KEY_FILE_NAME, status_widget)
+                counts["rows"] = len(rows)
+            # The whole key file is checked against the PDF, whichever students are unmelded
+            rows = check_page_count(rows, melded_page_count(pdf_path), unmelded_folder, status_widget)
+            shards.append((pdf_path, rows))
+        if students or pattern:
+            cohort = [row for _, rows in shards for row in rows]
+            chosen = {id(row) for row in select_rows(cohort, students, pattern, status_widget)}
+            log(f"Unmelding {len(chosen)} of {len(cohort)} students.", status_widget)
+            if not chosen:
+                log("❌ No students selected.", status_widget)
+                return False
+            shards = [(pdf_path, [row for row in rows if id(row) in chosen]) for pdf_path, rows in shards]
+            shards = [(pdf_path, rows) for pdf_path, rows in shards if rows]
+        all_rows = [row for _, rows in shards for row in rows]
+        run.update(students=len(all_rows), pages=sum(row.pages for row in all_rows))
+        if restore_size and not graft_from and not any(row.boxes for row in all_rows):
+            log(f"⚠️ {KEY_FILE_NAME} has no original page sizes; pages keep their melded size.", status_widget)
+
+        journal = None
+        if not zip_only:
+            melded = [pdf.stat() for pdf in pdf_paths]
+            journal = Journal(parent_path / UNMELD_JOURNAL_NAME, {
+                "pdf": [str(pdf.resolve()) for pdf in pdf_paths],
+                "pdf_bytes": [stat.st_size for stat in melded],
+                "pdf_mtime": [stat.st_mtime_ns for stat in melded],
+                "initials": initials,
+                "zero_copy": zero_copy,
+                "restore_size": restore_size,
+                "graft_from": str(Path(graft_from).resolve()) if graft_from else None,
+            })
+
+        with ExitStack() as stack:
+            output = stack.enter_context(
+                UnmeldOutput(unmelded_folder, not zip_only, zip_unmelded_folder or zip_only, journal)
+            )
+            sources = stack.enter_context(SubmissionSources(Path(graft_from))) if graft_from else None
+            if graft_from:
+                log(f"Adding marking to the original submissions in {graft_from}.", status_widget)
+            for pdf_path, rows in shards:
+                if len(shards) > 1:
+                    log(f"\n📚 {pdf_path.parent.name}/{pdf_path.name}: {len(rows)} students", status_widget)
+                rows = output.resume(rows, status_widget)
+                unmeld_rows(
+                    pdf_path, rows, unmelded_folder, initials, output, status_widget,
+                    workers, zero_copy, restore_size, sources,
+                )
+
+    if output.failed:
+        log(f"\n🚫 {output.failed} student file(s) could not be written; run the unmeld again to retry them.", status_widget)
+    if not zip_only:
+        log(f"\n✅ Unmeld complete! Files saved in: {unmelded_folder.resolve()}", status_widget)
+    if output.archive is not None:
+        log(f"\n📦 Files {'' if zip_only else 'also '}zipped to: {output.zip_path}", status_widget)
+
+    tracer = current_tracer()
+    if tracer:
+        log(f"⏱️ Stages: {tracer.summary()}", status_widget)
     log(f"\n✅ Done\n", status_widget)
+    return not output.failed
 
-        
-        
 
+def unmeld_rows(
+    pdf_path: Path,
+    rows: List[KeyRow],
+    unmelded_folder: Path,
+    initials: str,
+    output: UnmeldOutput,
+    status_widget: Optional[StatusSink] = None,
+    workers: int = 1,
+    zero_copy: bool = True,
+    restore_size: bool = False,
+    sources: Optional[SubmissionSources] = None,
+) -> None:
+    """Write the chosen students of one melded PDF, in the way unmeld() was asked to."""
+    if sources is not None:
+        unmeld_grafted(pdf_path, rows, sources, unmelded_folder, initials, status_widget, output)
+    elif workers > 1 and len(rows) > 1:
+        log(f"Writing student files with {workers} workers.", status_widget)
+        unmeld_parallel(
+            pdf_path, rows, unmelded_folder, initials, workers, status_widget, zero_copy, restore_size, output
+        )
+    else:
+        with pdf_path.open("rb") as infile, mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            with span("open", file=pdf_path.name, bytes=len(data)):
+                reader = PdfReader(infile)
+                raw = RawObjectSource.for_reader(reader, data) if zero_copy else None
+            for n, row in enumerate(rows, start=1):
+                check_cancelled(status_widget)
+                try:
+                    message = write_student_pdf(
+                        reader, row, unmelded_folder, initials, zero_copy, raw, restore_size, output
+                    )
+                except IndexError:
+                    log(not_enough_pages_message(row, unmelded_folder), status_widget)
+                    break
+                except Exception as e:
+                    output.fail(row, failure_reason(e), status_widget)
+                    continue
+                output.finished(row)
+                log(f"[{n}/{len(rows)}] {message}", status_widget)
+                report_progress(n, len(rows), status_widget, "Unmelding")
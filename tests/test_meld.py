@@ -0,0 +1,192 @@
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import FreeText
+from pypdf.generic import RectangleObject
+
+from Meld import meld, meld_outputs, plan_scaling, plan_shards, shard_folder, MELDED_FILE_NAME, KEY_FILE_NAME, TARGET_WIDTH
+from Meldcache import PageCache
+from Meldjournal import MELD_JOURNAL_NAME, QUARANTINE_FILE_NAME
+from Meldlogging import JobCancelled, MessageList
+from Unmeld import unmeld, UNMELDED_FOLDER_NAME
+
+
+# ================================================================
+# Helpers
+# ================================================================
+def write_download(download, students):
+    """A download folder with one submission per student: a blank page, or the given bytes."""
+    for folder, content in students.items():
+        (download / folder).mkdir(parents=True)
+        path = download / folder / "answers.pdf"
+        if content is None:
+            writer = PdfWriter()
+            writer.add_blank_page(width=595, height=842)
+            with path.open("wb") as f:
+                writer.write(f)
+        else:
+            path.write_bytes(content)
+
+
+class CancelAfter(MessageList):
+    """Job status that cancels the job once a message containing `text` is logged."""
+
+    def __init__(self, text):
+        super().__init__()
+        self.text = text
+
+    def put(self, message):
+        super().put(message)
+        if self.text in message:
+            self.cancel()
+
+
+STUDENTS = {f"Student {n}_{n}_assignsubmission_file": None for n in range(1, 4)}
+
+
+# ================================================================
+# Scaling plan
+# ================================================================
+def test_scaling_plan_summary(tmp_path):
+    writer = PdfWriter()
+    writer.add_blank_page(width=TARGET_WIDTH, height=842)  # already at target width
+    writer.add_blank_page(width=842, height=595).rotate(90)
+    writer.add_blank_page(width=595, height=842).mediabox = RectangleObject([0, 0, 0, 842])
+
+    plan = plan_scaling(writer.pages, TARGET_WIDTH)
+    assert plan.sizes[:2] == [None, (TARGET_WIDTH, TARGET_WIDTH * 595 / 842)]
+    assert (plan.at_target, plan.to_scale, plan.invalid, plan.rotated) == (1, 1, [2], 1)
+    assert plan.summary() == (
+        "1 of 3 pages already at target width, 1 scaled, 1 with invalid boxes left as they are (1 rotated)"
+    )
+
+    plan.add(plan_scaling(writer.pages, TARGET_WIDTH))
+    assert plan.invalid == [2, 5]
+    assert plan.summary().startswith("2 of 6 pages already at target width, 2 scaled, 2 with invalid boxes")
+
+
+# ================================================================
+# Resuming
+# ================================================================
+def test_resumable_meld_is_chunked(tmp_path):
+    write_download(tmp_path / "download", STUDENTS)
+    status = MessageList()
+    assert meld(str(tmp_path / "download"), True, status, confirm_overwrite=lambda _: True, workers=2, resumable=True)
+    assert any(message.startswith("⏱️ Chunked meld") for message in status.messages)
+    assert not (tmp_path / MELD_JOURNAL_NAME).exists()
+
+
+def test_resumable_meld_carries_on_after_cancel(tmp_path):
+    write_download(tmp_path / "download", STUDENTS)
+    options = {"confirm_overwrite": lambda _: True, "chunk_size": 1, "resumable": True}
+    with pytest.raises(JobCancelled):
+        meld(str(tmp_path / "download"), True, CancelAfter("Chunk 1/3 written"), **options)
+    assert (tmp_path / MELD_JOURNAL_NAME).exists()
+
+    status = MessageList()
+    assert meld(str(tmp_path / "download"), True, status, **options)
+    assert "⏯️ Resuming: 1 of 3 folders were already melded." in status.messages
+    assert len(PdfReader(tmp_path / MELDED_FILE_NAME).pages) == 3
+
+
+# ================================================================
+# Incremental Meld
+# ================================================================
+def test_incremental_meld_keeps_earlier_bytes_and_marking(tmp_path):
+    download = tmp_path / "download"
+    write_download(download, dict(list(STUDENTS.items())[:2]))
+    assert meld(str(download), True, confirm_overwrite=lambda _: True)
+
+    # Mark the first page, as a marker's PDF editor would
+    writer = PdfWriter(clone_from=str(tmp_path / MELDED_FILE_NAME))
+    writer.add_annotation(0, FreeText(text="Well done", rect=(50, 50, 200, 80)))
+    with (tmp_path / MELDED_FILE_NAME).open("wb") as f:
+        writer.write(f)
+    marked = (tmp_path / MELDED_FILE_NAME).read_bytes()
+
+    write_download(download, dict(list(STUDENTS.items())[2:]))
+    assert meld(str(download), True, confirm_overwrite=lambda _: True, incremental=True)
+
+    updated = (tmp_path / MELDED_FILE_NAME).read_bytes()
+    assert updated.startswith(marked)
+    reader = PdfReader(tmp_path / MELDED_FILE_NAME)
+    assert len(reader.pages) == 3
+    assert "Well done" in [annotation.get_object().get("/Contents") for annotation in reader.pages[0]["/Annots"]]
+    assert [line.split(",")[0] for line in (tmp_path / KEY_FILE_NAME).read_text().splitlines()] == list(STUDENTS)
+
+
+# ================================================================
+# Shards
+# ================================================================
+def test_existing_shards_need_confirmation(tmp_path):
+    write_download(tmp_path / "download", STUDENTS)
+    assert meld(str(tmp_path / "download"), True, confirm_overwrite=lambda _: True, workers=2, shards=2)
+    outputs = [shard_folder(tmp_path, k) / MELDED_FILE_NAME for k in (1, 2)]
+    assert meld_outputs(tmp_path / "download", 2) == outputs
+
+    asked = []
+    status = MessageList()
+    assert not meld(str(tmp_path / "download"), True, status, confirm_overwrite=asked.append, workers=2, shards=2)
+    assert asked == outputs[:1]
+
+
+def test_shards_are_balanced_and_unmeld_together(tmp_path):
+    piles = plan_shards([5, 1, 4, 2, 3, 3], 2)
+    assert piles == [[0, 1, 5], [2, 3, 4]]  # 9 pages each
+
+    write_download(tmp_path / "download", STUDENTS)
+    assert meld(str(tmp_path / "download"), True, confirm_overwrite=lambda _: True, workers=2, shards=2)
+    shards = [str(shard_folder(tmp_path, k) / MELDED_FILE_NAME) for k in (1, 2)]
+    assert sorted(len(PdfReader(path).pages) for path in shards) == [1, 2]
+
+    assert unmeld(shards)
+    assert sorted(path.name for path in (tmp_path / UNMELDED_FOLDER_NAME).iterdir()) == list(STUDENTS)
+
+
+def test_fewer_shards_warn_about_stale_ones(tmp_path):
+    write_download(tmp_path / "download", STUDENTS)
+    assert meld(str(tmp_path / "download"), True, confirm_overwrite=lambda _: True, workers=2, shards=3)
+
+    status = MessageList()
+    assert meld(str(tmp_path / "download"), True, status, confirm_overwrite=lambda _: True, workers=2, shards=2)
+    assert any(message.startswith("⚠️ Shard 3: left from an earlier meld") for message in status.messages)
+
+
+def test_quarantined_shard_removes_its_earlier_output(tmp_path):
+    students = dict(list(STUDENTS.items())[:2])
+    write_download(tmp_path / "download", students)
+    assert meld(str(tmp_path / "download"), True, confirm_overwrite=lambda _: True, workers=2, shards=2)
+
+    # The second student's only submission is now unreadable, leaving Shard 2 empty
+    (tmp_path / "download" / list(students)[1] / "answers.pdf").write_bytes(b"%PDF-1.4 not really")
+    status = MessageList()
+    assert meld(str(tmp_path / "download"), True, status, confirm_overwrite=lambda _: True, workers=2, shards=2)
+    assert "❌ Shard 2: nothing melded; any earlier melded PDF and key file were removed." in status.messages
+    assert not (shard_folder(tmp_path, 2) / MELDED_FILE_NAME).exists()
+    assert not (shard_folder(tmp_path, 2) / KEY_FILE_NAME).exists()
+    assert (shard_folder(tmp_path, 1) / MELDED_FILE_NAME).exists()
+
+
+# ================================================================
+# Failures
+# ================================================================
+def test_unusable_cache_directory_does_not_quarantine(tmp_path):
+    write_download(tmp_path / "download", {"Doe Jane_1_assignsubmission_file": None})
+    (tmp_path / "notadir").write_text("")
+    cache = PageCache(tmp_path / "notadir" / "cache")
+
+    assert meld(str(tmp_path / "download"), True, confirm_overwrite=lambda _: True, cache=cache)
+    assert not cache.writable
+    assert not (tmp_path / QUARANTINE_FILE_NAME).exists()
+    assert "Doe Jane_1" in (tmp_path / KEY_FILE_NAME).read_text()
+
+
+def test_nothing_melded_keeps_existing_output(tmp_path):
+    write_download(tmp_path / "download", {"Doe Jane_1_assignsubmission_file": b"%PDF-1.4 not really"})
+    (tmp_path / MELDED_FILE_NAME).write_bytes(b"marked")
+    (tmp_path / KEY_FILE_NAME).write_text("key")
+
+    for options in ({}, {"workers": 2}, {"chunk_size": 1}):
+        assert not meld(str(tmp_path / "download"), True, confirm_overwrite=lambda _: True, **options)
+        assert (tmp_path / MELDED_FILE_NAME).read_bytes() == b"marked"
+        assert (tmp_path / KEY_FILE_NAME).read_text() == "key"
+        assert (tmp_path / QUARANTINE_FILE_NAME).exists()
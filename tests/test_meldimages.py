@@ -0,0 +1,71 @@
+from io import BytesIO
+
+import pytest
+from pypdf import PdfReader
+
+from Meld import ScannedFolder, _count_folder_pages
+from Meldimages import PREFETCH_PER_WORKER, ImageConverter, image_page_count
+
+Image = pytest.importorskip("PIL.Image")
+
+
+# ================================================================
+# Helpers
+# ================================================================
+def tiff(frames):
+    """A TIFF with `frames` pages."""
+    images = [Image.new("L", (60, 80), 255 - 40 * n) for n in range(frames)]
+    buffer = BytesIO()
+    images[0].save(buffer, "TIFF", save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+
+class CountingReads:
+    """read() callables for a batch of images that count how often each is read."""
+
+    def __init__(self, count, frames=1):
+        self.data = [tiff(frames) for _ in range(count)]
+        self.reads = [0] * count
+
+    def read(self, n):
+        def read():
+            self.reads[n] += 1
+            return self.data[n]
+        return read
+
+    def items(self):
+        return ((n, self.read(n)) for n in range(len(self.data)))
+
+
+# ================================================================
+# Conversion
+# ================================================================
+def test_multi_page_tiff_counts_every_frame():
+    assert image_page_count(tiff(1)) == 1
+    assert image_page_count(tiff(3)) == 3
+
+
+def test_shard_plan_counts_tiff_frames(tmp_path):
+    scan = tmp_path / "scan.tiff"
+    scan.write_bytes(tiff(3))
+    assert _count_folder_pages(ScannedFolder(tmp_path, [scan])) == 3
+
+
+def test_prefetched_images_are_read_once():
+    reads = CountingReads(6, frames=2)
+    with ImageConverter(100, workers=2) as images:
+        images.prefetch(reads.items())
+        for n in range(6):
+            data, to_pdf = images.take(n, reads.read(n))
+            assert data == reads.data[n]
+            assert len(PdfReader(BytesIO(to_pdf())).pages) == 2
+    assert reads.reads == [1] * 6
+
+
+def test_prefetch_stays_within_its_window():
+    reads = CountingReads(10)
+    with ImageConverter(100, workers=2) as images:
+        images.prefetch(reads.items())
+        assert sum(reads.reads) == 2 * PREFETCH_PER_WORKER
+        images.take(0, reads.read(0))
+        assert sum(reads.reads) == 2 * PREFETCH_PER_WORKER + 1
@@ -0,0 +1,140 @@
+from io import BytesIO
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+
+from Meldwriter import IncrementalAppender, RawObjectSource, StreamingPdfWriter, rewrite_references
+
+
+# ================================================================
+# Helpers
+# ================================================================
+def build_pdf(objects):
+    """A PDF file whose objects 1, 2, ... have the given bodies, with an xref table."""
+    out = BytesIO()
+    out.write(b"%PDF-1.7\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def blank_pdf(width):
+    """A one-page PDF of a blank page `width` points square, written by pypdf."""
+    writer = PdfWriter()
+    writer.add_blank_page(width, width)
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def page_pdf(extra):
+    """A one-page PDF whose page dictionary also holds `extra`, with a font as object 4."""
+    return build_pdf([
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] "
+        b"/Resources << /Font << /F1 4 0 R >> >> " + extra + b" >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ])
+
+
+def copy_raw(data):
+    """Copy every page of `data` through the raw copier; the output and whether page 3 was copied raw."""
+    reader = PdfReader(BytesIO(data))
+    raw = RawObjectSource.for_reader(reader, data)
+    out = BytesIO()
+    writer = StreamingPdfWriter(out, raw_sources=[raw])
+    copied_raw = raw.read(3, 0) is not None
+    writer.append_batch([(raw.pages, {})])
+    writer.finish()
+    return PdfReader(BytesIO(out.getvalue())), copied_raw
+
+
+def renumber_all(idnum, generation):
+    return b"%d 0 R" % (idnum + 100)
+
+
+# ================================================================
+# Tokenizing
+# ================================================================
+@pytest.mark.parametrize("string", [
+    rb"(a (b (c 1 0 R)))",
+    rb"(one \) 1 0 R \( two)",
+    rb"(unbalanced \( 1 0 R)",
+    rb"(ends with a backslash \\)",
+    rb"(keywords endobj and stream" b"\n" rb"1 0 R)",
+])
+def test_references_in_strings_are_kept(string):
+    head = b"<< /A " + string + b" /B 1 0 R >>"
+    assert rewrite_references(head, renumber_all) == b"<< /A " + string + b" /B 101 0 R >>"
+
+
+def test_references_in_hex_strings_and_comments_are_kept():
+    head = b"<< /A <31203020 52> % 1 0 R\n/B [1 0 R 2 0 R] >>"
+    assert rewrite_references(head, renumber_all) == b"<< /A <31203020 52> % 1 0 R\n/B [101 0 R 102 0 R] >>"
+
+
+@pytest.mark.parametrize("head", [
+    b"<< /A (never closed 1 0 R >>",
+    b"<< /A (a (b) 1 0 R >>",
+    b"<< /A stray) 1 0 R >>",
+    b"<< /A <not hex> >>",
+])
+def test_unsure_syntax_is_refused(head):
+    with pytest.raises(ValueError):
+        rewrite_references(head, renumber_all)
+
+
+# ================================================================
+# Raw Copying
+# ================================================================
+def test_raw_read_skips_keywords_in_strings():
+    data = page_pdf(rb"/Note (x (endobj) stream" b"\n" rb"\) 4 0 R)")
+    raw = RawObjectSource.for_reader(PdfReader(BytesIO(data)), data)
+    head, stream = raw.read(3, 0)
+    assert stream is None
+    assert head.rstrip().endswith(rb"/Note (x (endobj) stream" b"\n" rb"\) 4 0 R) >>")
+
+
+@pytest.mark.parametrize("note, text", [
+    (rb"(a (b (c 4 0 R)))", "a (b (c 4 0 R))"),
+    (rb"(one \) 4 0 R \( two)", "one ) 4 0 R ( two"),
+    (rb"(endobj (stream" b"\n" rb"4 0 R))", "endobj (stream\n4 0 R)"),
+])
+def test_raw_copy_keeps_nested_and_escaped_strings(note, text):
+    reader, copied_raw = copy_raw(page_pdf(b"/Note " + note))
+    assert copied_raw
+    page = reader.pages[0]
+    assert page["/Note"] == text
+    assert page["/Resources"]["/Font"]["/F1"]["/BaseFont"] == "/Helvetica"
+
+
+def test_unterminated_string_falls_back_to_parsing():
+    # pypdf reads the string to the end of the dictionary; the raw copier must not guess
+    data = page_pdf(rb"/Note (open \) 4 0 R")
+    reader, copied_raw = copy_raw(data)
+    assert not copied_raw
+    assert len(reader.pages) == 1
+
+
+# ================================================================
+# Incremental Update
+# ================================================================
+def test_incremental_xref_section_is_zero_indexed(caplog):
+    original = blank_pdf(100)
+    appender = IncrementalAppender(BytesIO(original))
+    appender.append_pages([PdfReader(BytesIO(blank_pdf(200))).pages[0]], {})
+    updated = original + appender.finish()
+
+    section = updated[updated.rindex(b"\nxref\n") + 6:]
+    assert section.startswith(b"0 1\n0000000000 65535 f")
+    reader = PdfReader(BytesIO(updated), strict=True)
+    assert [float(page.mediabox.width) for page in reader.pages] == [100, 200]
+    assert "not zero-indexed" not in caplog.text
@@ -0,0 +1,138 @@
+import pytest
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import Rectangle
+from pypdf.generic import RectangleObject
+
+from Meld import TARGET_WIDTH, meld, KEY_FILE_NAME, MELDED_FILE_NAME
+from Meldlogging import MessageList
+from Unmeld import marking_annotations, unmeld, UNMELDED_FOLDER_NAME
+
+
+# ================================================================
+# Helpers
+# ================================================================
+def write_submission(path, mediabox, cropbox=None):
+    """A one-page PDF with the given boxes, in a student's submission folder."""
+    writer = PdfWriter()
+    page = writer.add_blank_page(width=mediabox[2] - mediabox[0], height=mediabox[3] - mediabox[1])
+    page.mediabox = RectangleObject(mediabox)
+    if cropbox is not None:
+        page.cropbox = RectangleObject(cropbox)
+    path.parent.mkdir(parents=True)
+    with path.open("wb") as f:
+        writer.write(f)
+
+
+def meld_cohort(tmp_path, folders):
+    """Meld a download with a portrait page for each student folder; returns the melded PDF's path."""
+    for folder in folders:
+        write_submission(tmp_path / "download" / folder / "answers.pdf", [0, 0, 595, 842])
+    assert meld(str(tmp_path / "download"), True, confirm_overwrite=lambda _: True)
+    return tmp_path / MELDED_FILE_NAME
+
+
+def mark(melded, page_numbers, rect=(100, 100, 200, 150)):
+    """Add a rectangle to the given pages of the melded PDF, as a marker would."""
+    writer = PdfWriter(clone_from=melded)
+    for page_number in page_numbers:
+        writer.add_annotation(page_number, Rectangle(rect=rect))
+    with melded.open("wb") as f:
+        writer.write(f)
+
+
+def boxes(page):
+    return [round(float(v), 1) for v in page.mediabox], [round(float(v), 1) for v in page.cropbox]
+
+
+# ================================================================
+# Restoring page sizes
+# ================================================================
+SUBMISSIONS = {
+    "Landscape Lara_101_assignsubmission_file": ([0, 0, 842, 595], None),
+    "Cropped Carl_102_assignsubmission_file": ([0, 0, 600, 800], [50, 60, 550, 760]),
+    "Offset Olga_103_assignsubmission_file": ([20, 30, 632, 822], [40, 50, 600, 800]),
+}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_restore_size_gives_back_the_original_boxes(tmp_path, workers):
+    download = tmp_path / "download"
+    for folder, (mediabox, cropbox) in SUBMISSIONS.items():
+        write_submission(download / folder / "answers.pdf", mediabox, cropbox)
+
+    assert meld(str(download), True, confirm_overwrite=lambda _: True)
+    melded = PdfReader(tmp_path / MELDED_FILE_NAME)
+    assert {round(float(page.cropbox.width), 1) for page in melded.pages} == {TARGET_WIDTH}
+
+    assert unmeld(str(tmp_path / MELDED_FILE_NAME), restore_size=True, workers=workers)
+    for folder, (mediabox, cropbox) in SUBMISSIONS.items():
+        page = PdfReader(tmp_path / UNMELDED_FOLDER_NAME / folder / "answers.pdf").pages[0]
+        assert boxes(page) == (mediabox, cropbox or mediabox)
+
+
+# ================================================================
+# Selective unmeld
+# ================================================================
+def test_selected_students_are_checked_against_the_whole_key_file(tmp_path):
+    melded = meld_cohort(tmp_path, SUBMISSIONS)
+    status = MessageList()
+    assert unmeld(str(melded), status_widget=status, students=["102"])
+    assert not any("only accounts for" in message for message in status.messages)
+    assert [path.name for path in (tmp_path / UNMELDED_FOLDER_NAME).iterdir()] == ["Cropped Carl_102_assignsubmission_file"]
+
+    # A key file that misses a student is still reported when only others are chosen
+    key_file = tmp_path / KEY_FILE_NAME
+    key_file.write_text("".join(key_file.read_text().splitlines(keepends=True)[:2]))
+    status = MessageList()
+    assert unmeld(str(melded), status_widget=status, pattern="lara")
+    assert "⚠️ The melded PDF has 3 pages but key_file.csv only accounts for 2." in status.messages
+
+
+def test_invalid_student_pattern_is_an_input_error(tmp_path):
+    melded = meld_cohort(tmp_path, SUBMISSIONS)
+    status = MessageList()
+    assert not unmeld(str(melded), status_widget=status, pattern="(")
+    assert status.messages[-1].startswith("❌ Invalid student pattern: '('")
+    assert not (tmp_path / UNMELDED_FOLDER_NAME).exists()
+
+
+# ================================================================
+# Grafting marking onto the original submissions
+# ================================================================
+def test_marking_is_unscaled_on_a_copy(tmp_path):
+    download = tmp_path / "download"
+    write_submission(download / "Landscape Lara_101_assignsubmission_file" / "answers.pdf", [0, 0, 842, 595])
+    assert meld(str(download), True, confirm_overwrite=lambda _: True)
+    melded = tmp_path / MELDED_FILE_NAME
+    mark(melded, [0])
+
+    reader = PdfReader(melded)
+    source = PdfReader(download / "Landscape Lara_101_assignsubmission_file" / "answers.pdf")
+    [(item, copy)] = [pair for pair in marking_annotations(reader.pages[0], source.pages[0])
+                      if pair[1]["/Subtype"] == "/Square"]
+    assert [round(float(v)) for v in copy["/Rect"]] == [142, 142, 283, 212]
+    # The melded page keeps its marking where it was, for copying the pages if grafting fails
+    assert [round(float(v)) for v in item.get_object()["/Rect"]] == [100, 100, 200, 150]
+
+
+def test_unmarked_image_students_are_skipped_when_grafting(tmp_path):
+    download = tmp_path / "download"
+    write_submission(download / "Paper Pat_201_assignsubmission_file" / "answers.pdf", [0, 0, 595, 842])
+    for folder in ("Photo Phil_202_assignsubmission_file", "Scan Sam_203_assignsubmission_file"):
+        (download / folder).mkdir()
+        Image.new("L", (60, 80), 200).save(download / folder / "answers.png")
+    assert meld(str(download), True, confirm_overwrite=lambda _: True)
+    mark(tmp_path / MELDED_FILE_NAME, [0, 1])  # Pat and Phil (folders are melded in name order)
+
+    status = MessageList()
+    assert unmeld(str(tmp_path / MELDED_FILE_NAME), status_widget=status, graft_from=str(download))
+    unmelded = tmp_path / UNMELDED_FOLDER_NAME
+    assert sorted(path.name for path in unmelded.iterdir()) == [
+        "Paper Pat_201_assignsubmission_file",
+        "Photo Phil_202_assignsubmission_file",
+    ]
+    assert "⚠️ Photo Phil_202_assignsubmission_file/answers.png: original submission is an image; " \
+           "copying its melded pages instead." in status.messages
+    assert any(message.endswith("⏭️ No marking for Scan Sam_203_assignsubmission_file/answers.png; skipped.")
+               for message in status.messages)